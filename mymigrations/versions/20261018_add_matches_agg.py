@@ -0,0 +1,53 @@
+"""add matches agg table
+
+Revision ID: 20261018_add_matches_agg
+Revises: 20260706_add_faceit_tables
+Create Date: 2026-10-18
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "20261018_add_matches_agg"
+down_revision: Union[str, None] = "20260706_add_faceit_tables"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "matches_agg",
+        sa.Column("steamid", sa.String(length=20), nullable=False),
+        sa.Column("seasonId", sa.String(length=20), nullable=False),
+        sa.Column("modeClass", sa.String(length=10), nullable=False),
+        sa.Column("cnt", sa.Integer(), nullable=False),
+        sa.Column("winCnt", sa.Integer(), nullable=False),
+        sa.Column("roundSum", sa.Integer(), nullable=False),
+        sa.Column("ratingSum", sa.Float(), nullable=False),
+        sa.Column("ratingSqSum", sa.Float(), nullable=False),
+        sa.Column("weSum", sa.Float(), nullable=False),
+        sa.Column("weSqSum", sa.Float(), nullable=False),
+        sa.Column("adrSum", sa.Float(), nullable=False),
+        sa.Column("adrSqSum", sa.Float(), nullable=False),
+        sa.Column("scoreChangeSum", sa.BigInteger(), nullable=False),
+        sa.Column("scoreChangeSqSum", sa.BigInteger(), nullable=False),
+        sa.Column("killSum", sa.Integer(), nullable=False),
+        sa.Column("deathSum", sa.Integer(), nullable=False),
+        sa.Column("assistSum", sa.Integer(), nullable=False),
+        sa.Column("headShotSum", sa.Integer(), nullable=False),
+        sa.Column("entryKillSum", sa.Integer(), nullable=False),
+        sa.Column("firstDeathSum", sa.Integer(), nullable=False),
+        sa.Column("snipeSum", sa.Integer(), nullable=False),
+        sa.Column("multiKillSum", sa.Integer(), nullable=False),
+        sa.Column("flashTeammateSum", sa.Integer(), nullable=False),
+        sa.Column("flashSuccessSum", sa.Integer(), nullable=False),
+        sa.Column("throwsSum", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("steamid", "seasonId", "modeClass"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("matches_agg")
@@ -1,19 +1,26 @@
 from __future__ import annotations
 
 from collections import Counter, defaultdict
-from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
 from datetime import datetime, time as datetime_time
-from functools import lru_cache
+from functools import lru_cache, partial
 import asyncio
+import heapq
 import json
 import math
 import msgpack
+import multiprocessing
+import numpy as np
+import os
 import re
-from typing import Any, Callable, Iterable
+from typing import Any, Awaitable, Callable, Iterable
 
 from nonebot import get_driver, get_plugin_config, logger, require
 from nonebot.plugin import PluginMetadata
-from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy import Select, delete, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import aliased
 
 require("utils")
@@ -23,9 +30,14 @@ require("models")
 from ..models import (
     ChatChunkIndex,
     ChatChunkMessage,
+    ChatLexiconStat,
     ChatMessageIndex,
     ChatReplyEdge,
     ChatRetrievalSpan,
+    ChatSpanIndexStat,
+    ChatSpanParticipant,
+    ChatSpanPosting,
+    ChatSpanTerm,
     ChatTokenLexicon,
     GroupMsg,
 )
@@ -51,15 +63,20 @@ MAX_SPAN_CHARS = 3000
 REBUILD_CHUNK_FLUSH_SIZE = 1000
 REBUILD_SPAN_FLUSH_SIZE = 1000
 LIVE_REBUILD_SECONDS = 7200
+LIVE_INDEX_INTERVAL_SECONDS = 30
+LIVE_INDEX_BATCH_SIZE = 50
 STARTUP_REPAIR_SECONDS = 86400
 STARTUP_REPAIR_LIMIT = 5000
-BM25_CANDIDATE_LIMIT = 50000
 BM25_K1 = 1.5
 BM25_B = 0.75
 LEXICON_MAX_TERMS = 2000
 LEXICON_MIN_FREQ = 3
 LEXICON_MIN_DOC_FREQ = 2
 LEXICON_MAX_DOC_FREQ_RATIO = 0.005
+INDEX_TERM_MAX_LENGTH = 80
+SPAN_TERM_BATCH_SIZE = 500
+TOKENIZE_BATCH_SIZE = 200
+PACKED_ID_DTYPE = np.dtype("<u4")
 
 TOKEN_RE = re.compile(r"[A-Za-z0-9_\u4e00-\u9fff]+")
 CJK_RUN_RE = re.compile(r"[\u4e00-\u9fff]{2,}")
@@ -127,6 +144,42 @@ class ParsedMessage:
     segment_types: list[str]
 
 
+@dataclass
+class _SpanIndexDelta:
+    doc_freq: Counter[int] = field(default_factory=Counter)
+    span_count: int = 0
+    token_total: int = 0
+
+
+@dataclass
+class _LexiconStats:
+    term_freq: Counter[str] = field(default_factory=Counter)
+    doc_freq: Counter[str] = field(default_factory=Counter)
+    last_seen: dict[str, int] = field(default_factory=dict)
+    total_docs: int = 0
+
+    def add_messages(self, rows: Iterable[tuple[int, str | None]]) -> None:
+        for timestamp, plain_text in rows:
+            if not plain_text:
+                continue
+            candidates = _lexicon_candidates_from_text(plain_text)
+            if not candidates:
+                continue
+            compact = normalize_text(plain_text).replace(" ", "")
+            self.total_docs += 1
+            for term in candidates:
+                self.term_freq[term] += max(1, compact.count(term))
+                self.doc_freq[term] += 1
+                self.last_seen[term] = max(self.last_seen.get(term, 0), int(timestamp))
+
+    def merge(self, other: _LexiconStats) -> None:
+        self.term_freq.update(other.term_freq)
+        self.doc_freq.update(other.doc_freq)
+        for term, timestamp in other.last_seen.items():
+            self.last_seen[term] = max(self.last_seen.get(term, 0), timestamp)
+        self.total_docs += other.total_docs
+
+
 def _json_dumps(value: Any) -> str:
     return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
 
@@ -141,6 +194,16 @@ def _json_loads_list(value: str | None) -> list[Any]:
         return []
 
 
+def _pack_ids(values: Iterable[int]) -> bytes:
+    return np.fromiter(values, dtype=PACKED_ID_DTYPE).tobytes()
+
+
+def _unpack_ids(data: bytes | None) -> list[int]:
+    if not data:
+        return []
+    return np.frombuffer(data, dtype=PACKED_ID_DTYPE).tolist()
+
+
 def image_id_from_hash(hash_value: Any) -> str | None:
     value = str(hash_value or "").strip().lower()
     if not re.fullmatch(r"[0-9a-f]{64}", value):
@@ -227,38 +290,12 @@ def _bm25_tokens(text: str, lexicon_terms: Iterable[str] | None = None) -> list[
     return tokens
 
 
-def _bm25_rank(query_terms: list[str], documents: list[list[str]]) -> list[float]:
-    if not query_terms or not documents:
-        return [0.0 for _ in documents]
-    doc_count = len(documents)
-    avg_len = sum(len(doc) for doc in documents) / doc_count if doc_count else 0.0
-    if avg_len <= 0:
-        return [0.0 for _ in documents]
-
-    doc_freq: Counter[str] = Counter()
-    query_terms = list(dict.fromkeys(query_terms))
-    query_set = set(query_terms)
-    for doc in documents:
-        doc_freq.update(set(doc) & query_set)
+def _index_term(term: str) -> str:
+    return term[:INDEX_TERM_MAX_LENGTH]
 
-    idf = {
-        term: math.log(1 + (doc_count - doc_freq.get(term, 0) + 0.5) / (doc_freq.get(term, 0) + 0.5))
-        for term in query_terms
-    }
 
-    scores: list[float] = []
-    for doc in documents:
-        term_freq = Counter(doc)
-        doc_len = len(doc)
-        score = 0.0
-        for term in query_terms:
-            freq = term_freq.get(term, 0)
-            if freq <= 0:
-                continue
-            denominator = freq + BM25_K1 * (1 - BM25_B + BM25_B * doc_len / avg_len)
-            score += idf[term] * (freq * (BM25_K1 + 1)) / denominator
-        scores.append(score)
-    return scores
+def _bm25_idf(doc_count: int, doc_freq: int) -> float:
+    return math.log(1 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
 
 
 def _keyword_source_text(text: str) -> str:
@@ -329,6 +366,12 @@ def _score_lexicon_term(term: str, freq: int, doc_freq: int, total_docs: int) ->
     return float(freq) * idf * length_bonus
 
 
+def _lexicon_max_doc_freq(total_docs: int) -> int:
+    if total_docs >= 1000:
+        return max(LEXICON_MIN_DOC_FREQ, int(total_docs * LEXICON_MAX_DOC_FREQ_RATIO))
+    return total_docs
+
+
 def extract_keywords(text: str, limit: int = 12) -> list[str]:
     text = _keyword_source_text(text)
     try:
@@ -533,9 +576,286 @@ def _build_span_groups(rows: list[ChatMessageIndex]) -> list[list[ChatMessageInd
     return spans
 
 
+def _reply_targets(rows: Iterable[ChatMessageIndex]) -> defaultdict[int, list[ChatMessageIndex]]:
+    reply_targets: defaultdict[int, list[ChatMessageIndex]] = defaultdict(list)
+    for row in rows:
+        if row.reply_to_record_id is not None:
+            reply_targets[row.reply_to_record_id].append(row)
+    return reply_targets
+
+
+def _chunk_text(rows: list[ChatMessageIndex]) -> str:
+    return "\n".join(_message_lines(rows))
+
+
+def _chunk_values(rows: list[ChatMessageIndex], text: str, keywords: list[str]) -> dict[str, Any]:
+    return {
+        "start_time": rows[0].timestamp,
+        "end_time": rows[-1].timestamp,
+        "chunk_text": text,
+        "keywords": _json_dumps(keywords),
+        "summary": _chunk_summary(text),
+        "participant_uids": _json_dumps(_participants(rows)),
+    }
+
+
+def _span_text(
+    span_rows: list[ChatMessageIndex],
+    msg_by_id: dict[int, ChatMessageIndex],
+    reply_targets: dict[int, list[ChatMessageIndex]],
+) -> str:
+    span_ids = {row.record_id for row in span_rows}
+    lines = _message_lines(span_rows)
+    anchor_rows: list[ChatMessageIndex] = []
+    for row in span_rows:
+        if row.reply_to_record_id and row.reply_to_record_id not in span_ids:
+            target = msg_by_id.get(row.reply_to_record_id)
+            if target is not None:
+                anchor_rows.append(target)
+        for reply_row in reply_targets.get(row.record_id, [])[:3]:
+            if reply_row.record_id not in span_ids:
+                anchor_rows.append(reply_row)
+    if anchor_rows:
+        seen: set[int] = set()
+        lines.append("reply anchors:")
+        for anchor in anchor_rows:
+            if anchor.record_id in seen:
+                continue
+            seen.add(anchor.record_id)
+            lines.append(_format_message(anchor, prefix="anchor"))
+    return "\n".join(lines)
+
+
+def _span_values(
+    span_rows: list[ChatMessageIndex],
+    text: str,
+    token_ids: list[int],
+    keywords: list[str],
+) -> dict[str, Any]:
+    chunk_ids = sorted({row.primary_chunk_id for row in span_rows if row.primary_chunk_id is not None})
+    return {
+        "start_time": span_rows[0].timestamp,
+        "end_time": span_rows[-1].timestamp,
+        "span_text": text,
+        "keywords": _json_dumps(keywords),
+        "token_ids": _pack_ids(token_ids),
+        "token_count": len(token_ids),
+        "message_ids": _pack_ids(row.record_id for row in span_rows),
+        "chunk_ids": _pack_ids(chunk_ids),
+    }
+
+
+# 本进程 jieba.add_word 的调用记录。add_word 不带词频时按当前词典推算词频，切词结果和加词的顺序有关，
+# 分词进程按同样的顺序重放主进程的记录，切出的词才和主进程（查询分词、内联回退）一致
+_jieba_terms: list[str] = []
+_jieba_term_set: set[str] = set()
+
+
+def _add_jieba_terms(terms: Iterable[str]) -> None:
+    new_terms = [term for term in dict.fromkeys(terms) if term not in _jieba_term_set]
+    if not new_terms:
+        return
+    try:
+        import jieba
+
+        for term in new_terms:
+            jieba.add_word(term)
+    except Exception:
+        pass
+    _jieba_terms.extend(new_terms)
+    _jieba_term_set.update(new_terms)
+
+
+def _init_tokenize_worker() -> None:
+    try:
+        import jieba
+
+        jieba.initialize()
+    except Exception:
+        pass
+
+
+def _run_tokenize_task(
+    start: int,
+    terms: tuple[str, ...],
+    func: Callable[[list[Any]], Any],
+    items: list[Any],
+) -> tuple[int, int, Any]:
+    # terms 是主进程记录从 start 开始的一段，本进程已经重放过的部分跳过
+    _add_jieba_terms(terms[len(_jieba_terms) - start :])
+    return os.getpid(), len(_jieba_terms), func(items)
+
+
+def _span_features_task(lexicon_terms: tuple[str, ...], texts: list[str]) -> list[tuple[list[str], list[str]]]:
+    return [(_bm25_tokens(text, lexicon_terms), extract_keywords(text)) for text in texts]
+
+
+def _keywords_task(texts: list[str]) -> list[list[str]]:
+    return [extract_keywords(text) for text in texts]
+
+
+def _lexicon_stats_task(rows: list[tuple[int, str | None]]) -> _LexiconStats:
+    stats = _LexiconStats()
+    stats.add_messages(rows)
+    return stats
+
+
+class TokenizeService:
+    """Runs jieba tokenization in worker processes so indexing does not block the event loop."""
+
+    def __init__(self, workers: int) -> None:
+        self._workers = max(0, int(workers))
+        self._executor: ProcessPoolExecutor | None = None
+        # fork 时工作进程继承的记录长度，以及各工作进程已经重放到的长度
+        self._fork_version = 0
+        self._worker_versions: dict[int, int] = {}
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    def start(self) -> None:
+        # fork 只在这里发生：要在事件循环、数据库连接和其他线程启动之前调用，之后工作进程退出也不再补 fork
+        if self._executor is not None or self._workers <= 0 or "fork" not in multiprocessing.get_all_start_methods():
+            return
+        self._executor = ProcessPoolExecutor(
+            max_workers=self._workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_tokenize_worker,
+        )
+        self._fork_version = len(_jieba_terms)
+        self._worker_versions = {}
+        # fork 上下文的进程池在第一次提交任务时一次性 fork 出全部工作进程
+        self._executor.submit(_init_tokenize_worker)
+
+    def configure(self, workers: int) -> None:
+        self.shutdown()
+        self._workers = max(0, int(workers))
+        self.start()
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _synced_version(self) -> int:
+        if len(self._worker_versions) < self._workers:
+            return self._fork_version
+        return min(self._worker_versions.values())
+
+    async def _run(self, func: Callable[[list[Any]], Any], items: list[Any]) -> list[Any]:
+        executor = self._executor
+        if executor is None:
+            return [func(items)]
+        size = max(1, min(TOKENIZE_BATCH_SIZE, math.ceil(len(items) / self._workers)))
+        # 只带上还有工作进程没重放过的那段加词记录
+        start = self._synced_version()
+        terms = tuple(_jieba_terms[start:])
+        loop = asyncio.get_running_loop()
+        try:
+            results = await asyncio.gather(*(
+                loop.run_in_executor(
+                    executor,
+                    partial(_run_tokenize_task, start, terms, func, items[offset : offset + size]),
+                )
+                for offset in range(0, len(items), size)
+            ))
+        except BrokenProcessPool:
+            logger.warning("chat tokenize worker died, tokenizing inline from now on")
+            self.shutdown()
+            return [func(items)]
+        for pid, version, _result in results:
+            self._worker_versions[pid] = max(self._worker_versions.get(pid, 0), version)
+        return [result for _pid, _version, result in results]
+
+    async def _map(self, func: Callable[[list[Any]], list[Any]], items: list[Any]) -> list[Any]:
+        if not items:
+            return []
+        return [item for result in await self._run(func, items) for item in result]
+
+    async def span_features(self, texts: list[str], lexicon_terms: Iterable[str]) -> list[tuple[list[str], list[str]]]:
+        # 词表按固定顺序传过去，补词的顺序才不受集合在各进程里的遍历顺序影响
+        return await self._map(partial(_span_features_task, tuple(sorted(lexicon_terms))), texts)
+
+    async def keywords(self, texts: list[str]) -> list[list[str]]:
+        return await self._map(_keywords_task, texts)
+
+    async def lexicon_stats(self, rows: list[tuple[int, str | None]]) -> _LexiconStats:
+        stats = _LexiconStats()
+        if not rows:
+            return stats
+        for result in await self._run(_lexicon_stats_task, rows):
+            stats.merge(result)
+        return stats
+
+
+class _LiveIndexQueue:
+    """Coalesces new messages per group and flushes at most once per interval or batch."""
+
+    def __init__(self, flush: Callable[[str, int], Awaitable[None]]) -> None:
+        self._flush = flush
+        self._start_times: dict[str, int] = {}
+        self._counts: Counter[str] = Counter()
+        self._events: dict[str, asyncio.Event] = {}
+        self._tasks: dict[str, asyncio.Task[None]] = {}
+
+    def add(self, group_id: str, timestamp: int) -> None:
+        self._start_times[group_id] = min(self._start_times.get(group_id, timestamp), timestamp)
+        self._counts[group_id] += 1
+        event = self._events.setdefault(group_id, asyncio.Event())
+        if self._counts[group_id] >= LIVE_INDEX_BATCH_SIZE:
+            event.set()
+        task = self._tasks.get(group_id)
+        if task is None or task.done():
+            self._tasks[group_id] = asyncio.create_task(self._run(group_id))
+
+    async def _run(self, group_id: str) -> None:
+        event = self._events[group_id]
+        try:
+            await asyncio.wait_for(event.wait(), LIVE_INDEX_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        await self._flush_group(group_id)
+        if group_id in self._start_times:
+            self._tasks[group_id] = asyncio.create_task(self._run(group_id))
+
+    async def _flush_group(self, group_id: str) -> None:
+        self._events[group_id].clear()
+        start_time = self._start_times.pop(group_id, None)
+        count = self._counts.pop(group_id, 0)
+        if start_time is None:
+            return
+        try:
+            await self._flush(group_id, start_time)
+        except Exception as e:
+            logger.warning(f"live index flush group={group_id} messages={count} failed: {e}")
+
+    async def flush_all(self) -> None:
+        while self._tasks:
+            group_id, task = self._tasks.popitem()
+            self._events[group_id].set()
+            await task
+
+
 class DataManager:
     def __init__(self) -> None:
         self._lexicon_cache: dict[str, set[str]] = {}
+        self._lexicon_cutoff: dict[str, float] = {}
+        self._live_queue = _LiveIndexQueue(self.flush_live_indexes)
+        self._tokenizer = TokenizeService(config.chat_history_tokenize_workers)
+
+    @property
+    def tokenizer_workers(self) -> int:
+        return self._tokenizer.workers
+
+    def start_tokenizer(self) -> None:
+        self._tokenizer.start()
+
+    def configure_tokenizer(self, workers: int) -> None:
+        self._tokenizer.configure(workers)
+
+    def shutdown_tokenizer(self) -> None:
+        self._tokenizer.shutdown()
 
     def _index_row_from_group_msg(self, msg: GroupMsg) -> ChatMessageIndex | None:
         try:
@@ -581,8 +901,249 @@ class DataManager:
 
         await self.refresh_reply_edge(record_id)
         if rebuild_tail and group_id is not None:
-            await self.update_group_lexicon(group_id, start_time=timestamp, replace=False)
-            await self.rebuild_group_indexes(group_id, start_time=max(0, timestamp - LIVE_REBUILD_SECONDS))
+            self._live_queue.add(group_id, timestamp)
+
+    async def flush_live_indexes(self, group_id: str, start_time: int) -> None:
+        # 只统计还没切进 chunk 的新消息，词表维护和新消息数量成正比
+        async with async_session_factory() as session:
+            result = await session.execute(
+                select(ChatMessageIndex.record_id, ChatMessageIndex.timestamp, ChatMessageIndex.plain_text)
+                .where(ChatMessageIndex.group_id == group_id, ChatMessageIndex.primary_chunk_id.is_(None))
+            )
+            rows = list(result.all())
+        if not rows:
+            return
+        stats = await self._tokenizer.lexicon_stats([(timestamp, plain_text) for _record_id, timestamp, plain_text in rows])
+        await self._merge_lexicon_stats(group_id, stats)
+        # 之后到达的消息还没计入词表，留给下一次 flush
+        max_record_id = max(int(row[0]) for row in rows)
+        if not await self.extend_group_indexes(group_id, max_record_id):
+            # 窗口要盖住所有刚计入词表的消息，否则窗口外的消息一直不进 chunk，每次 flush 都被重复统计
+            window_start = min(start_time, min(int(row[1]) for row in rows))
+            await self.rebuild_group_indexes(
+                group_id,
+                start_time=max(0, window_start - LIVE_REBUILD_SECONDS),
+                max_record_id=max_record_id,
+            )
+
+    async def flush_pending_live_indexes(self) -> None:
+        await self._live_queue.flush_all()
+
+    async def extend_group_indexes(self, group_id: str, max_record_id: int | None = None) -> bool:
+        lexicon_terms = await self._enabled_lexicon_terms(group_id)
+        index_delta = _SpanIndexDelta()
+        async with async_session_factory() as session:
+            async with session.begin():
+                stmt = select(ChatMessageIndex).where(
+                    ChatMessageIndex.group_id == group_id,
+                    ChatMessageIndex.primary_chunk_id.is_(None),
+                )
+                if max_record_id is not None:
+                    stmt = stmt.where(ChatMessageIndex.record_id <= max_record_id)
+                result = await session.execute(
+                    stmt.order_by(ChatMessageIndex.timestamp.asc(), ChatMessageIndex.record_id.asc())
+                )
+                new_rows = list(result.scalars().all())
+                if not new_rows:
+                    return True
+                open_chunk = (
+                    await session.execute(
+                        select(ChatChunkIndex)
+                        .where(ChatChunkIndex.group_id == group_id)
+                        .order_by(ChatChunkIndex.start_time.desc(), ChatChunkIndex.id.desc())
+                        .limit(1)
+                    )
+                ).scalar_one_or_none()
+                open_span = (
+                    await session.execute(
+                        select(ChatRetrievalSpan)
+                        .where(ChatRetrievalSpan.group_id == group_id)
+                        .order_by(ChatRetrievalSpan.start_time.desc(), ChatRetrievalSpan.id.desc())
+                        .limit(1)
+                    )
+                ).scalar_one_or_none()
+                # 新消息必须都排在已有索引之后才能只追加，否则交给窗口重建
+                if (
+                    open_chunk is None
+                    or open_span is None
+                    or new_rows[0].timestamp < open_chunk.end_time
+                    or new_rows[0].timestamp < open_span.end_time
+                ):
+                    return False
+
+                result = await session.execute(
+                    select(ChatMessageIndex)
+                    .join(ChatChunkMessage, ChatChunkMessage.message_id == ChatMessageIndex.record_id)
+                    .where(ChatChunkMessage.chunk_id == open_chunk.id, ChatChunkMessage.role == "core")
+                    .order_by(ChatChunkMessage.message_order.asc())
+                )
+                chunk_rows = list(result.scalars().all())
+                span_ids = _unpack_ids(open_span.message_ids)
+                result = await session.execute(select(ChatMessageIndex).where(ChatMessageIndex.record_id.in_(span_ids)))
+                msg_by_id = {row.record_id: row for row in result.scalars().all()}
+                span_rows = [msg_by_id[record_id] for record_id in span_ids if record_id in msg_by_id]
+                msg_by_id.update((row.record_id, row) for row in chunk_rows + new_rows)
+                missing_targets = {
+                    row.reply_to_record_id
+                    for row in span_rows + new_rows
+                    if row.reply_to_record_id is not None and row.reply_to_record_id not in msg_by_id
+                }
+                if missing_targets:
+                    result = await session.execute(
+                        select(ChatMessageIndex).where(
+                            ChatMessageIndex.group_id == group_id,
+                            ChatMessageIndex.record_id.in_(missing_targets),
+                        )
+                    )
+                    msg_by_id.update((row.record_id, row) for row in result.scalars().all())
+
+                # 已有 chunk 是贪心切分出来的，在它后面接上新消息重新切分，第一组就是延长后的 open chunk
+                chunk_groups = _build_core_groups(chunk_rows + new_rows)
+                chunk_texts = [_chunk_text(group) for group in chunk_groups]
+                chunk_keywords = await self._tokenizer.keywords(chunk_texts)
+                new_chunks: list[tuple[ChatChunkIndex, list[ChatMessageIndex], int]] = []
+                for index, (group, text, keywords) in enumerate(zip(chunk_groups, chunk_texts, chunk_keywords)):
+                    if index == 0:
+                        for key, value in _chunk_values(group, text, keywords).items():
+                            setattr(open_chunk, key, value)
+                        new_chunks.append((open_chunk, group[len(chunk_rows):], len(chunk_rows)))
+                    else:
+                        chunk = ChatChunkIndex(group_id=group_id, **_chunk_values(group, text, keywords))
+                        session.add(chunk)
+                        new_chunks.append((chunk, group, 0))
+                await session.flush()
+                for chunk, rows, first_order in new_chunks:
+                    for order, row in enumerate(rows, start=first_order):
+                        row.primary_chunk_id = chunk.id
+                        session.add(ChatChunkMessage(
+                            chunk_id=chunk.id,
+                            message_id=row.record_id,
+                            role="core",
+                            message_order=order,
+                        ))
+
+                reply_targets = _reply_targets(span_rows + new_rows)
+                await self._remove_span_postings(
+                    session,
+                    group_id,
+                    select(ChatRetrievalSpan.id).where(ChatRetrievalSpan.id == open_span.id),
+                    index_delta,
+                )
+                span_groups = _build_span_groups(span_rows + new_rows)
+                span_texts = [_span_text(group, msg_by_id, reply_targets) for group in span_groups]
+                features = await self._tokenizer.span_features(span_texts, lexicon_terms)
+                vocab: dict[str, int] = {}
+                span_term_ids = await self._span_term_ids(session, group_id, [tokens for tokens, _ in features], vocab)
+                pending_spans: list[tuple[ChatRetrievalSpan, list[ChatMessageIndex], list[int]]] = []
+                for index, (group, text, term_ids, (_tokens, keywords)) in enumerate(
+                    zip(span_groups, span_texts, span_term_ids, features)
+                ):
+                    if index == 0:
+                        span = open_span
+                        for key, value in _span_values(group, text, term_ids, keywords).items():
+                            setattr(span, key, value)
+                    else:
+                        span = ChatRetrievalSpan(group_id=group_id, **_span_values(group, text, term_ids, keywords))
+                        session.add(span)
+                    pending_spans.append((span, group, term_ids))
+                await session.flush()
+                await self._add_span_postings(
+                    session,
+                    group_id,
+                    [(span.id, term_ids) for span, _group, term_ids in pending_spans],
+                    index_delta,
+                )
+                await self._index_span_participants(
+                    session,
+                    group_id,
+                    [(span.id, _participants(group)) for span, group, _term_ids in pending_spans],
+                )
+                span_ids_set = {row.record_id for row in span_rows + new_rows}
+                await self._refresh_span_anchors(
+                    session,
+                    group_id,
+                    [msg_by_id[row.reply_to_record_id] for row in new_rows if row.reply_to_record_id in msg_by_id and row.reply_to_record_id not in span_ids_set],
+                    {span.id for span, _group, _term_ids in pending_spans},
+                    lexicon_terms,
+                    vocab,
+                    index_delta,
+                )
+                await self._apply_span_index_delta(session, group_id, index_delta)
+        return True
+
+    async def _refresh_span_anchors(
+        self,
+        session: AsyncSession,
+        group_id: str,
+        targets: list[ChatMessageIndex],
+        skip_span_ids: set[int],
+        lexicon_terms: set[str],
+        vocab: dict[str, int],
+        delta: _SpanIndexDelta,
+    ) -> None:
+        # 新消息回复了已封闭 span 里的消息时，只重写这些 span 的 reply anchors
+        if not targets:
+            return
+        target_ids = {row.record_id for row in targets}
+        span_result = await session.execute(
+            select(ChatRetrievalSpan).where(
+                ChatRetrievalSpan.group_id == group_id,
+                ChatRetrievalSpan.start_time <= max(row.timestamp for row in targets),
+                ChatRetrievalSpan.end_time >= min(row.timestamp for row in targets),
+            )
+        )
+        spans = [
+            span for span in span_result.scalars().all()
+            if span.id not in skip_span_ids and target_ids & set(_unpack_ids(span.message_ids))
+        ]
+        if not spans:
+            return
+        refreshed: list[tuple[ChatRetrievalSpan, list[ChatMessageIndex], str]] = []
+        for span in spans:
+            ids = _unpack_ids(span.message_ids)
+            msg_result = await session.execute(select(ChatMessageIndex).where(ChatMessageIndex.record_id.in_(ids)))
+            msg_by_id = {row.record_id: row for row in msg_result.scalars().all()}
+            span_rows = [msg_by_id[record_id] for record_id in ids if record_id in msg_by_id]
+            reply_result = await session.execute(
+                select(ChatMessageIndex)
+                .join(ChatReplyEdge, ChatReplyEdge.from_message_id == ChatMessageIndex.record_id)
+                .where(ChatReplyEdge.group_id == group_id, ChatReplyEdge.to_message_id.in_(ids))
+                .order_by(ChatMessageIndex.timestamp.asc(), ChatMessageIndex.record_id.asc())
+            )
+            reply_rows = list(reply_result.scalars().all())
+            reply_to_ids = {row.reply_to_record_id for row in span_rows if row.reply_to_record_id is not None} - set(msg_by_id)
+            if reply_to_ids:
+                target_result = await session.execute(
+                    select(ChatMessageIndex).where(
+                        ChatMessageIndex.group_id == group_id,
+                        ChatMessageIndex.record_id.in_(reply_to_ids),
+                    )
+                )
+                msg_by_id.update((row.record_id, row) for row in target_result.scalars().all())
+            text = _span_text(span_rows, msg_by_id, _reply_targets(reply_rows))
+            if text != span.span_text:
+                refreshed.append((span, span_rows, text))
+        if not refreshed:
+            return
+
+        features = await self._tokenizer.span_features([text for _span, _rows, text in refreshed], lexicon_terms)
+        span_term_ids = await self._span_term_ids(session, group_id, [tokens for tokens, _ in features], vocab)
+        await self._remove_span_postings(
+            session,
+            group_id,
+            select(ChatRetrievalSpan.id).where(ChatRetrievalSpan.id.in_([span.id for span, _rows, _text in refreshed])),
+            delta,
+        )
+        for (span, span_rows, text), term_ids, (_tokens, keywords) in zip(refreshed, span_term_ids, features):
+            for key, value in _span_values(span_rows, text, term_ids, keywords).items():
+                setattr(span, key, value)
+        await session.flush()
+        await self._add_span_postings(
+            session,
+            group_id,
+            [(span.id, term_ids) for (span, _rows, _text), term_ids in zip(refreshed, span_term_ids)],
+            delta,
+        )
 
     async def refresh_reply_edge(self, record_id: int) -> None:
         async with async_session_factory() as session:
@@ -807,20 +1368,18 @@ class DataManager:
             return self._lexicon_cache[group_id]
         async with async_session_factory() as session:
             result = await session.execute(
-                select(ChatTokenLexicon.term)
+                select(ChatTokenLexicon.term, ChatTokenLexicon.score)
                 .where(ChatTokenLexicon.group_id == group_id, ChatTokenLexicon.enabled == True)
                 .order_by(ChatTokenLexicon.score.desc())
                 .limit(LEXICON_MAX_TERMS)
             )
-            terms = {str(term) for term in result.scalars().all()}
-        try:
-            import jieba
-
-            for term in terms:
-                jieba.add_word(term)
-        except Exception:
-            pass
+            rows = list(result.all())
+            terms = {str(term) for term, _score in rows}
+        # jieba 词典是全局的，只加入新启用的词，并记进加词记录供分词进程重放
+        _add_jieba_terms(str(term) for term, _score in rows)
         self._lexicon_cache[group_id] = terms
+        # 词表已满时，新词的分数要超过当前最低分才会进入
+        self._lexicon_cutoff[group_id] = float(rows[-1][1]) if len(rows) >= LEXICON_MAX_TERMS else float("-inf")
         return terms
 
     async def update_group_lexicon(
@@ -831,11 +1390,8 @@ class DataManager:
         batch_size: int = 2000,
     ) -> int:
         batch_size = max(100, int(batch_size))
-        term_freq: Counter[str] = Counter()
-        doc_freq: Counter[str] = Counter()
-        last_seen: dict[str, int] = {}
+        stats = _LexiconStats()
         last_id = 0
-        total_docs = 0
 
         while True:
             async with async_session_factory() as session:
@@ -852,45 +1408,17 @@ class DataManager:
                 rows = list(result.all())
             if not rows:
                 break
-            for record_id, timestamp, plain_text in rows:
-                last_id = int(record_id)
-                if not plain_text:
-                    continue
-                candidates = _lexicon_candidates_from_text(plain_text)
-                if not candidates:
-                    continue
-                compact = normalize_text(plain_text).replace(" ", "")
-                total_docs += 1
-                for term in candidates:
-                    count = compact.count(term)
-                    term_freq[term] += max(1, count)
-                    doc_freq[term] += 1
-                    last_seen[term] = max(last_seen.get(term, 0), int(timestamp))
-
-        if not term_freq:
-            return 0
+            last_id = int(rows[-1][0])
+            stats.merge(await self._tokenizer.lexicon_stats([(timestamp, plain_text) for _record_id, timestamp, plain_text in rows]))
 
-        if replace:
-            selected_terms = set(term_freq.keys())
-        else:
-            selected_terms = set(term_freq.keys())
-            async with async_session_factory() as session:
-                result = await session.execute(
-                    select(ChatTokenLexicon).where(
-                        ChatTokenLexicon.group_id == group_id,
-                        ChatTokenLexicon.term.in_(selected_terms),
-                    )
-                )
-                existing = {row.term: row for row in result.scalars().all()}
-            for term, row in existing.items():
-                term_freq[term] += row.freq
-                doc_freq[term] += row.doc_freq
-                last_seen[term] = max(last_seen.get(term, 0), row.last_seen)
+        if not replace:
+            return await self._merge_lexicon_stats(group_id, stats)
+        if not stats.term_freq:
+            return 0
 
-        total_docs_for_score = max(total_docs, max(doc_freq.values(), default=0))
-        max_enabled_doc_freq = total_docs_for_score
-        if total_docs_for_score >= 1000:
-            max_enabled_doc_freq = max(LEXICON_MIN_DOC_FREQ, int(total_docs_for_score * LEXICON_MAX_DOC_FREQ_RATIO))
+        term_freq, doc_freq, last_seen = stats.term_freq, stats.doc_freq, stats.last_seen
+        total_docs_for_score = max(stats.total_docs, max(doc_freq.values(), default=0))
+        max_enabled_doc_freq = _lexicon_max_doc_freq(total_docs_for_score)
 
         scored = [
             (term, term_freq[term], doc_freq[term], _score_lexicon_term(term, term_freq[term], doc_freq[term], total_docs_for_score))
@@ -909,27 +1437,97 @@ class DataManager:
 
         async with async_session_factory() as session:
             async with session.begin():
-                if replace:
-                    await session.execute(delete(ChatTokenLexicon).where(ChatTokenLexicon.group_id == group_id))
-                for term, freq, docs, score in keep:
-                    await session.merge(ChatTokenLexicon(
-                        group_id=group_id,
-                        term=term,
-                        freq=int(freq),
-                        doc_freq=int(docs),
-                        score=float(score),
-                        last_seen=int(last_seen.get(term, 0)),
-                        enabled=term in enabled_terms,
-                    ))
-        self._lexicon_cache.pop(group_id, None)
+                await session.execute(delete(ChatTokenLexicon).where(ChatTokenLexicon.group_id == group_id))
+                if keep:
+                    await session.execute(insert(ChatTokenLexicon), [
+                        {
+                            "group_id": group_id,
+                            "term": term,
+                            "freq": int(freq),
+                            "doc_freq": int(docs),
+                            "score": float(score),
+                            "last_seen": int(last_seen.get(term, 0)),
+                            "enabled": term in enabled_terms,
+                        }
+                        for term, freq, docs, score in keep
+                    ])
+                await session.merge(ChatLexiconStat(group_id=group_id, doc_count=stats.total_docs))
         await self._enabled_lexicon_terms(group_id, refresh=True)
-        logger.info(f"chat lexicon updated group={group_id} docs={total_docs} terms={len(keep)} enabled={len(enabled_terms)}")
+        logger.info(f"chat lexicon updated group={group_id} docs={stats.total_docs} terms={len(keep)} enabled={len(enabled_terms)}")
         return len(enabled_terms)
 
-    async def rebuild_group_indexes(self, group_id: str, start_time: int = 0) -> None:
+    async def _merge_lexicon_stats(self, group_id: str, stats: _LexiconStats) -> int:
+        if not stats.term_freq:
+            return 0
+        enabled_changed = False
+        async with async_session_factory() as session:
+            async with session.begin():
+                stat = await session.get(ChatLexiconStat, group_id)
+                if stat is None:
+                    # 旧数据没有文档数，按已索引的消息数（已包含这批新消息）估算一次
+                    doc_count = await session.scalar(
+                        select(func.count()).select_from(ChatMessageIndex).where(ChatMessageIndex.group_id == group_id)
+                    ) or 0
+                    stat = ChatLexiconStat(group_id=group_id, doc_count=int(doc_count))
+                    session.add(stat)
+                else:
+                    stat.doc_count += stats.total_docs
+                total_docs = stat.doc_count
+                max_enabled_doc_freq = _lexicon_max_doc_freq(total_docs)
+                cached_terms = self._lexicon_cache.get(group_id, set())
+                cutoff = self._lexicon_cutoff.get(group_id, float("-inf"))
+
+                terms = [term for term in stats.term_freq if _is_good_lexicon_term(term)]
+                for start in range(0, len(terms), SPAN_TERM_BATCH_SIZE):
+                    batch = terms[start : start + SPAN_TERM_BATCH_SIZE]
+                    result = await session.execute(
+                        select(
+                            ChatTokenLexicon.term,
+                            ChatTokenLexicon.freq,
+                            ChatTokenLexicon.doc_freq,
+                            ChatTokenLexicon.last_seen,
+                        )
+                        .where(ChatTokenLexicon.group_id == group_id, ChatTokenLexicon.term.in_(batch))
+                    )
+                    existing = {term: (freq, docs, seen) for term, freq, docs, seen in result.all()}
+                    updates: list[dict[str, Any]] = []
+                    inserts: list[dict[str, Any]] = []
+                    for term in batch:
+                        old_freq, old_docs, old_seen = existing.get(term, (0, 0, 0))
+                        freq = int(old_freq) + stats.term_freq[term]
+                        docs = int(old_docs) + stats.doc_freq[term]
+                        enabled = (
+                            freq >= LEXICON_MIN_FREQ
+                            and docs >= LEXICON_MIN_DOC_FREQ
+                            and docs <= max_enabled_doc_freq
+                        )
+                        score = _score_lexicon_term(term, freq, docs, total_docs)
+                        if (term in cached_terms and not enabled) or (term not in cached_terms and enabled and score > cutoff):
+                            enabled_changed = True
+                        row = {
+                            "group_id": group_id,
+                            "term": term,
+                            "freq": freq,
+                            "doc_freq": docs,
+                            "score": score,
+                            "last_seen": max(int(old_seen), stats.last_seen.get(term, 0)),
+                            "enabled": enabled,
+                        }
+                        (updates if term in existing else inserts).append(row)
+                    if updates:
+                        await session.execute(update(ChatTokenLexicon), updates)
+                    if inserts:
+                        await session.execute(insert(ChatTokenLexicon), inserts)
+        if enabled_changed or group_id not in self._lexicon_cache:
+            await self._enabled_lexicon_terms(group_id, refresh=True)
+        return len(terms)
+
+    async def rebuild_group_indexes(self, group_id: str, start_time: int = 0, max_record_id: int | None = None) -> None:
+        # max_record_id 只对窗口重建生效：更新的消息还没计入词表，留着不切 chunk；整群重建会重算词表，全部切分
         if start_time <= 0:
             await self.update_group_lexicon(group_id, replace=True)
         lexicon_terms = await self._enabled_lexicon_terms(group_id)
+        index_delta = _SpanIndexDelta()
         async with async_session_factory() as session:
             async with session.begin():
                 if start_time <= 0:
@@ -938,6 +1536,10 @@ class DataManager:
                     )))
                     await session.execute(delete(ChatChunkIndex).where(ChatChunkIndex.group_id == group_id))
                     await session.execute(delete(ChatRetrievalSpan).where(ChatRetrievalSpan.group_id == group_id))
+                    await session.execute(delete(ChatSpanParticipant).where(ChatSpanParticipant.group_id == group_id))
+                    await session.execute(delete(ChatSpanPosting).where(ChatSpanPosting.group_id == group_id))
+                    await session.execute(delete(ChatSpanTerm).where(ChatSpanTerm.group_id == group_id))
+                    await session.execute(delete(ChatSpanIndexStat).where(ChatSpanIndexStat.group_id == group_id))
                     await session.execute(
                         update(ChatMessageIndex)
                         .where(ChatMessageIndex.group_id == group_id)
@@ -957,6 +1559,12 @@ class DataManager:
                             ChatChunkIndex.end_time >= rebuild_from,
                         )
                     )
+                    old_span_ids = select(ChatRetrievalSpan.id).where(
+                        ChatRetrievalSpan.group_id == group_id,
+                        ChatRetrievalSpan.end_time >= rebuild_from,
+                    )
+                    await self._remove_span_postings(session, group_id, old_span_ids, index_delta)
+                    await session.execute(delete(ChatSpanParticipant).where(ChatSpanParticipant.span_id.in_(old_span_ids)))
                     await session.execute(
                         delete(ChatRetrievalSpan).where(
                             ChatRetrievalSpan.group_id == group_id,
@@ -969,102 +1577,232 @@ class DataManager:
                         .values(primary_chunk_id=None)
                     )
 
+                stmt = select(ChatMessageIndex).where(
+                    ChatMessageIndex.group_id == group_id,
+                    ChatMessageIndex.timestamp >= rebuild_from,
+                )
+                if start_time > 0 and max_record_id is not None:
+                    stmt = stmt.where(ChatMessageIndex.record_id <= max_record_id)
                 result = await session.execute(
-                    select(ChatMessageIndex)
-                    .where(ChatMessageIndex.group_id == group_id, ChatMessageIndex.timestamp >= rebuild_from)
-                    .order_by(ChatMessageIndex.timestamp.asc(), ChatMessageIndex.record_id.asc())
+                    stmt.order_by(ChatMessageIndex.timestamp.asc(), ChatMessageIndex.record_id.asc())
                 )
                 rows = list(result.scalars().all())
                 msg_by_id = {row.record_id: row for row in rows}
 
-                pending_chunks: list[tuple[ChatChunkIndex, list[ChatMessageIndex]]] = []
-
-                async def flush_pending_chunks() -> None:
-                    if not pending_chunks:
-                        return
+                chunk_groups = [group for group in _build_core_groups(rows) if group]
+                for start in range(0, len(chunk_groups), REBUILD_CHUNK_FLUSH_SIZE):
+                    batch = chunk_groups[start : start + REBUILD_CHUNK_FLUSH_SIZE]
+                    texts = [_chunk_text(group) for group in batch]
+                    keywords = await self._tokenizer.keywords(texts)
+                    chunks = [
+                        ChatChunkIndex(group_id=group_id, **_chunk_values(group, text, words))
+                        for group, text, words in zip(batch, texts, keywords)
+                    ]
+                    session.add_all(chunks)
                     await session.flush()
-                    for pending_chunk, pending_rows in pending_chunks:
-                        for order, pending_row in enumerate(pending_rows):
-                            pending_row.primary_chunk_id = pending_chunk.id
+                    for chunk, group in zip(chunks, batch):
+                        for order, row in enumerate(group):
+                            row.primary_chunk_id = chunk.id
                             session.add(ChatChunkMessage(
-                                chunk_id=pending_chunk.id,
-                                message_id=pending_row.record_id,
+                                chunk_id=chunk.id,
+                                message_id=row.record_id,
                                 role="core",
                                 message_order=order,
                             ))
-                    pending_chunks.clear()
                     await asyncio.sleep(0.01)
 
-                for group in _build_core_groups(rows):
-                    if not group:
-                        continue
-                    text = "\n".join(_message_lines(group))
-                    chunk = ChatChunkIndex(
-                        group_id=group_id,
-                        start_time=group[0].timestamp,
-                        end_time=group[-1].timestamp,
-                        chunk_text=text,
-                        keywords=_json_dumps(extract_keywords(text)),
-                        summary=_chunk_summary(text),
-                        participant_uids=_json_dumps(_participants(group)),
+                reply_targets = _reply_targets(rows)
+                span_groups = [span_rows for span_rows in _build_span_groups(rows) if span_rows]
+                vocab: dict[str, int] = {}
+                for start in range(0, len(span_groups), REBUILD_SPAN_FLUSH_SIZE):
+                    batch = span_groups[start : start + REBUILD_SPAN_FLUSH_SIZE]
+                    texts = [_span_text(span_rows, msg_by_id, reply_targets) for span_rows in batch]
+                    features = await self._tokenizer.span_features(texts, lexicon_terms)
+                    span_term_ids = await self._span_term_ids(session, group_id, [tokens for tokens, _ in features], vocab)
+                    spans = [
+                        ChatRetrievalSpan(group_id=group_id, **_span_values(span_rows, text, term_ids, keywords))
+                        for span_rows, text, term_ids, (_tokens, keywords) in zip(batch, texts, span_term_ids, features)
+                    ]
+                    session.add_all(spans)
+                    await session.flush()
+                    await self._add_span_postings(
+                        session,
+                        group_id,
+                        [(span.id, term_ids) for span, term_ids in zip(spans, span_term_ids)],
+                        index_delta,
                     )
-                    session.add(chunk)
-                    pending_chunks.append((chunk, group))
-                    if len(pending_chunks) >= REBUILD_CHUNK_FLUSH_SIZE:
-                        await flush_pending_chunks()
-                await flush_pending_chunks()
-
-                reply_targets: defaultdict[int, list[ChatMessageIndex]] = defaultdict(list)
-                for row in rows:
-                    if row.reply_to_record_id is not None:
-                        reply_targets[row.reply_to_record_id].append(row)
-
-                pending_span_count = 0
-                for span_rows in _build_span_groups(rows):
-                    if not span_rows:
-                        continue
-                    span_ids = {row.record_id for row in span_rows}
-                    lines = _message_lines(span_rows)
-                    anchor_rows: list[ChatMessageIndex] = []
-                    for row in span_rows:
-                        if row.reply_to_record_id and row.reply_to_record_id not in span_ids:
-                            target = msg_by_id.get(row.reply_to_record_id)
-                            if target is not None:
-                                anchor_rows.append(target)
-                        for reply_row in reply_targets.get(row.record_id, [])[:3]:
-                            if reply_row.record_id not in span_ids:
-                                anchor_rows.append(reply_row)
-                    if anchor_rows:
-                        seen: set[int] = set()
-                        lines.append("reply anchors:")
-                        for anchor in anchor_rows:
-                            if anchor.record_id in seen:
-                                continue
-                            seen.add(anchor.record_id)
-                            lines.append(_format_message(anchor, prefix="anchor"))
-                    text = "\n".join(lines)
-                    span_tokens = _bm25_tokens(text, lexicon_terms)
-                    chunk_ids = sorted({row.primary_chunk_id for row in span_rows if row.primary_chunk_id is not None})
-                    span = ChatRetrievalSpan(
-                        group_id=group_id,
-                        start_time=span_rows[0].timestamp,
-                        end_time=span_rows[-1].timestamp,
-                        span_text=text,
-                        keywords=_json_dumps(extract_keywords(text)),
-                        token_text=_json_dumps(span_tokens),
-                        token_count=len(span_tokens),
-                        participant_uids=_json_dumps(_participants(span_rows)),
-                        message_ids=_json_dumps([row.record_id for row in span_rows]),
-                        chunk_ids=_json_dumps(chunk_ids),
+                    await self._index_span_participants(
+                        session,
+                        group_id,
+                        [(span.id, _participants(span_rows)) for span, span_rows in zip(spans, batch)],
                     )
-                    session.add(span)
-                    pending_span_count += 1
-                    if pending_span_count >= REBUILD_SPAN_FLUSH_SIZE:
-                        await session.flush()
-                        pending_span_count = 0
-                        await asyncio.sleep(0.01)
-                if pending_span_count:
-                    await session.flush()
+                    await asyncio.sleep(0.01)
+                await self._apply_span_index_delta(session, group_id, index_delta)
+
+    async def _remove_span_postings(
+        self,
+        session: AsyncSession,
+        group_id: str,
+        span_ids: Select,
+        delta: _SpanIndexDelta,
+    ) -> None:
+        result = await session.execute(
+            select(ChatSpanPosting.term_id, func.count())
+            .where(ChatSpanPosting.group_id == group_id, ChatSpanPosting.span_id.in_(span_ids))
+            .group_by(ChatSpanPosting.term_id)
+        )
+        for term_id, docs in result.all():
+            delta.doc_freq[int(term_id)] -= int(docs)
+        span_count, token_total = (
+            await session.execute(
+                select(func.count(), func.coalesce(func.sum(ChatRetrievalSpan.token_count), 0))
+                .where(ChatRetrievalSpan.id.in_(span_ids))
+            )
+        ).one()
+        delta.span_count -= int(span_count)
+        delta.token_total -= int(token_total)
+        await session.execute(
+            delete(ChatSpanPosting).where(ChatSpanPosting.group_id == group_id, ChatSpanPosting.span_id.in_(span_ids))
+        )
+
+    async def _span_term_ids(
+        self,
+        session: AsyncSession,
+        group_id: str,
+        token_lists: list[list[str]],
+        vocab: dict[str, int],
+    ) -> list[list[int]]:
+        # vocab 缓存本事务里已经查到的词，词表里没有的新词接着当前最大 term_id 往后分配
+        missing = list(dict.fromkeys(
+            term for tokens in token_lists for term in map(_index_term, tokens) if term not in vocab
+        ))
+        for start in range(0, len(missing), SPAN_TERM_BATCH_SIZE):
+            result = await session.execute(
+                select(ChatSpanTerm.term, ChatSpanTerm.term_id).where(
+                    ChatSpanTerm.group_id == group_id,
+                    ChatSpanTerm.term.in_(missing[start : start + SPAN_TERM_BATCH_SIZE]),
+                )
+            )
+            vocab.update((term, int(term_id)) for term, term_id in result.all())
+        new_terms = [term for term in missing if term not in vocab]
+        if new_terms:
+            next_id = (
+                await session.scalar(select(func.max(ChatSpanTerm.term_id)).where(ChatSpanTerm.group_id == group_id))
+                or 0
+            ) + 1
+            rows: list[dict[str, Any]] = []
+            for term_id, term in enumerate(new_terms, start=next_id):
+                vocab[term] = term_id
+                rows.append({"group_id": group_id, "term_id": term_id, "term": term, "doc_freq": 0})
+            for start in range(0, len(rows), SPAN_TERM_BATCH_SIZE):
+                await session.execute(insert(ChatSpanTerm), rows[start : start + SPAN_TERM_BATCH_SIZE])
+        return [[vocab[_index_term(token)] for token in tokens] for tokens in token_lists]
+
+    async def _add_span_postings(
+        self,
+        session: AsyncSession,
+        group_id: str,
+        spans: list[tuple[int, list[int]]],
+        delta: _SpanIndexDelta,
+    ) -> None:
+        rows: list[dict[str, Any]] = []
+        for span_id, term_ids in spans:
+            term_freq = Counter(term_ids)
+            rows.extend(
+                {"group_id": group_id, "term_id": term_id, "span_id": span_id, "term_freq": freq}
+                for term_id, freq in term_freq.items()
+            )
+            delta.doc_freq.update(term_freq.keys())
+            delta.span_count += 1
+            delta.token_total += len(term_ids)
+        if rows:
+            await session.execute(insert(ChatSpanPosting), rows)
+
+    async def _index_span_participants(
+        self,
+        session: AsyncSession,
+        group_id: str,
+        spans: list[tuple[int, list[str]]],
+    ) -> None:
+        if not spans:
+            return
+        await session.execute(
+            delete(ChatSpanParticipant).where(ChatSpanParticipant.span_id.in_([span_id for span_id, _ in spans]))
+        )
+        rows = [
+            {"span_id": span_id, "user_id": user_id, "group_id": group_id}
+            for span_id, user_ids in spans
+            for user_id in user_ids
+        ]
+        if rows:
+            await session.execute(insert(ChatSpanParticipant), rows)
+
+    async def _apply_span_index_delta(self, session: AsyncSession, group_id: str, delta: _SpanIndexDelta) -> None:
+        changed_term_ids = [term_id for term_id, value in delta.doc_freq.items() if value]
+        for start in range(0, len(changed_term_ids), SPAN_TERM_BATCH_SIZE):
+            result = await session.execute(
+                select(ChatSpanTerm.term_id, ChatSpanTerm.doc_freq).where(
+                    ChatSpanTerm.group_id == group_id,
+                    ChatSpanTerm.term_id.in_(changed_term_ids[start : start + SPAN_TERM_BATCH_SIZE]),
+                )
+            )
+            # 词表行在分配 term_id 时就已写入，这里只改 doc_freq，降到 0 也不删
+            updates = [
+                {"group_id": group_id, "term_id": term_id, "doc_freq": max(0, int(doc_freq) + delta.doc_freq[term_id])}
+                for term_id, doc_freq in result.all()
+            ]
+            if updates:
+                await session.execute(update(ChatSpanTerm), updates)
+
+        stat = await session.get(ChatSpanIndexStat, group_id)
+        if stat is None:
+            stat = ChatSpanIndexStat(group_id=group_id, span_count=0, token_total=0)
+            session.add(stat)
+        stat.span_count = max(0, stat.span_count + delta.span_count)
+        stat.token_total = max(0, stat.token_total + delta.token_total)
+
+    async def rebuild_span_postings(self, group_id: str, batch_size: int = REBUILD_SPAN_FLUSH_SIZE) -> int:
+        batch_size = max(100, int(batch_size))
+        index_delta = _SpanIndexDelta()
+        last_id = 0
+        async with async_session_factory() as session:
+            async with session.begin():
+                await session.execute(delete(ChatSpanPosting).where(ChatSpanPosting.group_id == group_id))
+                await session.execute(
+                    update(ChatSpanTerm).where(ChatSpanTerm.group_id == group_id).values(doc_freq=0)
+                )
+                await session.execute(delete(ChatSpanIndexStat).where(ChatSpanIndexStat.group_id == group_id))
+                while True:
+                    result = await session.execute(
+                        select(ChatRetrievalSpan.id, ChatRetrievalSpan.token_ids)
+                        .where(ChatRetrievalSpan.group_id == group_id, ChatRetrievalSpan.id > last_id)
+                        .order_by(ChatRetrievalSpan.id.asc())
+                        .limit(batch_size)
+                    )
+                    rows = list(result.all())
+                    if not rows:
+                        break
+                    await self._add_span_postings(
+                        session,
+                        group_id,
+                        [(int(span_id), _unpack_ids(token_ids)) for span_id, token_ids in rows],
+                        index_delta,
+                    )
+                    last_id = int(rows[-1][0])
+                    await asyncio.sleep(0.01)
+                await self._apply_span_index_delta(session, group_id, index_delta)
+        return index_delta.span_count
+
+    async def rebuild_all_span_postings(self, progress_callback: ProgressCallback | None = None) -> None:
+        async with async_session_factory() as session:
+            result = await session.execute(select(ChatRetrievalSpan.group_id).distinct())
+            groups = list(result.scalars().all())
+        if progress_callback:
+            progress_callback("span_postings", 0, len(groups))
+        for index, group_id in enumerate(groups, start=1):
+            await self.rebuild_span_postings(group_id)
+            if progress_callback:
+                progress_callback("span_postings", index, len(groups))
 
     def _message_to_dict(self, row: ChatMessageIndex, role: str | None = None) -> dict[str, Any]:
         payload = {
@@ -1099,38 +1837,42 @@ class DataManager:
         end_ts = _parse_time_bound(time_end, is_end=True)
         lexicon_terms = await self._enabled_lexicon_terms(group_id)
         query_terms = _bm25_tokens(query, lexicon_terms)
+        filters = [ChatRetrievalSpan.group_id == group_id]
+        if start_ts is not None:
+            filters.append(ChatRetrievalSpan.end_time >= start_ts)
+        if end_ts is not None:
+            if strict_time_end:
+                filters.append(ChatRetrievalSpan.end_time <= end_ts)
+            else:
+                filters.append(ChatRetrievalSpan.start_time <= end_ts)
+        if users:
+            filters.append(ChatRetrievalSpan.id.in_(
+                select(ChatSpanParticipant.span_id).where(
+                    ChatSpanParticipant.group_id == group_id,
+                    ChatSpanParticipant.user_id.in_([str(user) for user in users]),
+                )
+            ))
+
         async with async_session_factory() as session:
-            stmt = select(ChatRetrievalSpan).where(ChatRetrievalSpan.group_id == group_id)
-            if start_ts is not None:
-                stmt = stmt.where(ChatRetrievalSpan.end_time >= start_ts)
-            if end_ts is not None:
-                if strict_time_end:
-                    stmt = stmt.where(ChatRetrievalSpan.end_time <= end_ts)
-                else:
-                    stmt = stmt.where(ChatRetrievalSpan.start_time <= end_ts)
-            if users:
-                user_filters = [ChatRetrievalSpan.participant_uids.like(f'%"{str(user)}"%') for user in users]
-                stmt = stmt.where(or_(*user_filters))
-            result = await session.execute(stmt.order_by(ChatRetrievalSpan.end_time.desc()).limit(BM25_CANDIDATE_LIMIT))
-            spans = list(result.scalars().all())
-
-        candidate_count = len(spans)
-        if query_terms:
-            documents: list[list[str]] = []
-            for span in spans:
-                tokens = [str(token) for token in _json_loads_list(getattr(span, "token_text", None))]
-                if not tokens:
-                    tokens = _bm25_tokens(span.span_text, lexicon_terms)
-                documents.append(tokens)
-            scores = _bm25_rank(query_terms, documents)
-            scored_spans = [
-                (span, score)
-                for span, score in zip(spans, scores)
-                if score > 0
-            ]
-            scored_spans = sorted(scored_spans, key=lambda item: (item[1], item[0].end_time), reverse=True)[:limit]
-        else:
-            scored_spans = [(span, 1.0) for span in spans[:limit]]
+            if query_terms:
+                scored_spans, candidate_count = await self._bm25_search_spans(session, group_id, query_terms, filters, limit)
+            else:
+                candidate_count = await session.scalar(
+                    select(func.count()).select_from(ChatRetrievalSpan).where(*filters)
+                ) or 0
+                recent_result = await session.execute(
+                    select(ChatRetrievalSpan).where(*filters).order_by(ChatRetrievalSpan.end_time.desc()).limit(limit)
+                )
+                scored_spans = [(span, 1.0) for span in recent_result.scalars().all()]
+            participants: defaultdict[int, list[str]] = defaultdict(list)
+            if scored_spans:
+                participant_result = await session.execute(
+                    select(ChatSpanParticipant.span_id, ChatSpanParticipant.user_id)
+                    .where(ChatSpanParticipant.span_id.in_([span.id for span, _score in scored_spans]))
+                    .order_by(ChatSpanParticipant.user_id.asc())
+                )
+                for span_id, user_id in participant_result.all():
+                    participants[span_id].append(user_id)
 
         records = []
         for span, bm25_score in scored_spans:
@@ -1142,9 +1884,9 @@ class DataManager:
                 "end_time": span.end_time,
                 "start": datetime.fromtimestamp(span.start_time).strftime("%Y-%m-%d %H:%M:%S"),
                 "end": datetime.fromtimestamp(span.end_time).strftime("%Y-%m-%d %H:%M:%S"),
-                "participant_uids": _json_loads_list(span.participant_uids),
-                "message_ids": _json_loads_list(span.message_ids),
-                "chunk_ids": _json_loads_list(span.chunk_ids),
+                "participant_uids": participants[span.id],
+                "message_ids": _unpack_ids(span.message_ids),
+                "chunk_ids": _unpack_ids(span.chunk_ids),
                 "keywords": _json_loads_list(span.keywords),
                 "score": round(bm25_score, 4),
                 "score_type": "bm25" if query_terms else "recency",
@@ -1152,18 +1894,66 @@ class DataManager:
             })
         return _json_dumps({
             "records": records,
-            "truncated": candidate_count >= BM25_CANDIDATE_LIMIT,
+            "truncated": False,
             "candidate_count": candidate_count,
             "query_terms": query_terms,
             "strict_time_end": bool(strict_time_end),
         })
 
+    async def _bm25_search_spans(
+        self,
+        session: AsyncSession,
+        group_id: str,
+        query_terms: list[str],
+        filters: list[Any],
+        limit: int,
+    ) -> tuple[list[tuple[ChatRetrievalSpan, float]], int]:
+        stat = await session.get(ChatSpanIndexStat, group_id)
+        if stat is None or stat.span_count <= 0 or stat.token_total <= 0:
+            return [], 0
+        avg_len = stat.token_total / stat.span_count
+        terms = list(dict.fromkeys(_index_term(term) for term in query_terms))
+        term_result = await session.execute(
+            select(ChatSpanTerm.term_id, ChatSpanTerm.doc_freq).where(
+                ChatSpanTerm.group_id == group_id,
+                ChatSpanTerm.term.in_(terms),
+                ChatSpanTerm.doc_freq > 0,
+            )
+        )
+        idf = {int(term_id): _bm25_idf(stat.span_count, int(doc_freq)) for term_id, doc_freq in term_result.all()}
+        if not idf:
+            return [], 0
+
+        posting_result = await session.execute(
+            select(
+                ChatSpanPosting.span_id,
+                ChatSpanPosting.term_id,
+                ChatSpanPosting.term_freq,
+                ChatRetrievalSpan.token_count,
+                ChatRetrievalSpan.end_time,
+            )
+            .join(ChatRetrievalSpan, ChatRetrievalSpan.id == ChatSpanPosting.span_id)
+            .where(ChatSpanPosting.group_id == group_id, ChatSpanPosting.term_id.in_(list(idf)), *filters)
+        )
+        scores: defaultdict[int, float] = defaultdict(float)
+        end_times: dict[int, int] = {}
+        for span_id, term_id, freq, doc_len, end_time in posting_result.all():
+            denominator = freq + BM25_K1 * (1 - BM25_B + BM25_B * doc_len / avg_len)
+            scores[span_id] += idf[term_id] * (freq * (BM25_K1 + 1)) / denominator
+            end_times[span_id] = end_time
+        top_ids = heapq.nlargest(limit, scores, key=lambda span_id: (scores[span_id], end_times[span_id]))
+        if not top_ids:
+            return [], 0
+        span_result = await session.execute(select(ChatRetrievalSpan).where(ChatRetrievalSpan.id.in_(top_ids)))
+        span_by_id = {span.id: span for span in span_result.scalars().all()}
+        return [(span_by_id[span_id], scores[span_id]) for span_id in top_ids if span_id in span_by_id], len(scores)
+
     async def fetch_span_messages(self, group_id: str, span_id: int) -> str:
         async with async_session_factory() as session:
             span = await session.get(ChatRetrievalSpan, int(span_id))
             if span is None or span.group_id != group_id:
                 return _json_dumps({"records": [], "error": "span not found"})
-            ids = [int(value) for value in _json_loads_list(span.message_ids)]
+            ids = _unpack_ids(span.message_ids)
             result = await session.execute(
                 select(ChatMessageIndex)
                 .where(ChatMessageIndex.record_id.in_(ids))
@@ -1421,6 +2211,8 @@ class DataManager:
 
 
 db = DataManager()
+# 插件加载时还没有事件循环和其他线程，在这里 fork 分词进程
+db.start_tokenizer()
 
 
 @get_driver().on_startup
@@ -1428,6 +2220,12 @@ async def _schedule_chat_history_indexes_repair() -> None:
     asyncio.create_task(_repair_chat_history_indexes_in_background())
 
 
+@get_driver().on_shutdown
+async def _flush_chat_history_live_indexes() -> None:
+    await db.flush_pending_live_indexes()
+    db.shutdown_tokenizer()
+
+
 async def _repair_chat_history_indexes_in_background() -> None:
     try:
         repaired = await db.repair_recent_indexes()
@@ -3,4 +3,6 @@ from pydantic import BaseModel
 
 class Config(BaseModel):
     """Plugin Config Here"""
+    # 分词工作进程数，0 表示在事件循环里直接分词
+    chat_history_tokenize_workers: int = 1
 
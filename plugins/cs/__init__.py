@@ -249,7 +249,7 @@ async def rank_function(message: GroupMessageEvent, args: Message = CommandArg()
                 if time_type not in config.allowed_time:
                     raise ValueError(f"无效的时间范围，支持的有 {config.allowed_time}")
                 token = await db_server.get_bot_token(str(message.group_id))
-                screenshot = await get_screenshot(f"/rank?rankName={rank_type}&timeType={time_type}", token)
+                screenshot = await get_screenshot(f"/rank?rankName={rank_type}&timeType={time_type}", token, cache_scope="cs")
                 if screenshot:
                     await rank.finish(MessageSegment.image(screenshot))
                 else:
@@ -535,14 +535,13 @@ async def updateall_function():
     cntwm = 0
     cntgp = 0
     cntfaceit = 0
-    for steamid in await db_val.get_all_steamid():
-        try:
-            result = await db_upd.update_stats(steamid)
-            cntwm += len(result[1])
-            cntgp += len(result[2])
-            cntfaceit += len(result[3])
-        except Exception as e:
-            logger.error(f"更新{steamid}失败：{e}")
+    for steamid, result in await db_upd.update_stats_many(await db_val.get_all_steamid()):
+        if isinstance(result, Exception):
+            logger.error(f"更新{steamid}失败：{result}")
+            continue
+        cntwm += len(result[1])
+        cntgp += len(result[2])
+        cntfaceit += len(result[3])
     await updateall.finish(f"更新完成 {cntwm} 场完美数据 {cntgp} 场官匹数据 {cntfaceit} 场 FACEIT 数据")
 
 @matchteammate.handle()
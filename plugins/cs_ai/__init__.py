@@ -22,7 +22,6 @@ require("cs_db_val")
 from ..cs_db_val import db as db_val
 from ..cs_db_val import valid_time,valid_rank
 from ..cs_db_val import gp_time
-from ..cs_db_val import NoValueError
 from ..cs_db_val import get_ladder_filter
 
 from openai import AsyncOpenAI
@@ -1606,13 +1605,7 @@ async def ai_ask_main(uid: str, sid: str, persona: str | None, text: str, chat_i
                     time_type = _pick_time(time_value) if time_value else rankconfig.default_time
                     if time_type not in rankconfig.allowed_time:
                         time_type = rankconfig.default_time
-                    vals = []
-                    for sid_item in await db_val.get_all_steamid():
-                        try:
-                            val = await rankconfig.func(sid_item, time_type)
-                            vals.append((sid_item, val))
-                        except NoValueError:
-                            continue
+                    vals = await db_val.get_rank_values(rank_type, await db_val.get_all_steamid(), time_type)
                     if not vals:
                         await add_event("tool", "无排名数据", tool_call_id=tool_call.id)
                     else:
@@ -12,13 +12,18 @@ require("utils")
 from ..utils import avatar_dir
 from ..utils import async_session_factory
 from ..utils import get_session
+from ..utils import bump_data_version
 
 require("models")
-from ..models import MemberSteamID, SteamBaseInfo, SteamDetailInfo, SteamExtraInfo, MatchStatsPW, MatchStatsPWExtra, MatchStatsGP, MatchStatsGPExtra, SteamFaceitID, MatchStatsFaceit
+from ..models import MemberSteamID, SteamBaseInfo, SteamDetailInfo, SteamExtraInfo, MatchStatsPW, MatchStatsPWExtra, MatchStatsPWAgg, MatchStatsGP, MatchStatsGPExtra, SteamFaceitID, MatchStatsFaceit
 require("cs_db_val")
 from ..cs_db_val import db as db_val
+from ..cs_db_val import get_mode_class, MODE_LADDER, MODE_CUSTOM, MODE_OTHER
 
-from sqlalchemy import select, delete, func
+from sqlalchemy import select, delete, func, insert, case, or_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 import time
@@ -26,6 +31,7 @@ import json
 import math
 import random
 import asyncio
+from collections import defaultdict
 from PIL import Image
 from PIL import UnidentifiedImageError
 from io import BytesIO
@@ -45,17 +51,91 @@ config = get_plugin_config(Config)
 SeasonId = config.cs_season_id
 lastSeasonId = config.cs_last_season_id
 
+class RateLimiter:
+    """多个协程共享的限速器，相邻两次放行至少间隔 1/qps 秒"""
+    def __init__(self, qps: float):
+        self.interval = 1 / qps if qps > 0 else 0.0
+        self.lock = asyncio.Lock()
+        self.next_time = 0.0
+
+    async def wait(self) -> None:
+        async with self.lock:
+            delay = self.next_time - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_time = time.monotonic() + self.interval
+
+wmpvp_limiter = RateLimiter(config.cs_wmpvp_qps)
+faceit_limiter = RateLimiter(config.faceit_qps)
+
 class TooFrequentError(Exception):
     def __init__(self, wait_time: int):
         self.wait_time = wait_time
         super().__init__(f"操作过于频繁，请等待 {wait_time} 秒后再试。")
 class LockingError(Exception):
     def __init__(self):
-        super().__init__("数据库正在使用中，请稍后再试。")
+        super().__init__("该玩家的数据正在更新中，请稍后再试。")
+
+def _match_agg_values(match: MatchStatsPW) -> dict:
+    """单场比赛对汇总表各累计列的贡献"""
+    return {
+        "cnt": 1,
+        "winCnt": int(match.winTeam == match.team),
+        "roundSum": match.score1 + match.score2,
+        "ratingSum": match.pwRating,
+        "ratingSqSum": match.pwRating * match.pwRating,
+        "weSum": match.we,
+        "weSqSum": match.we * match.we,
+        "adrSum": match.adpr,
+        "adrSqSum": match.adpr * match.adpr,
+        "scoreChangeSum": match.pvpScoreChange,
+        "scoreChangeSqSum": match.pvpScoreChange * match.pvpScoreChange,
+        "killSum": match.kill,
+        "deathSum": match.death,
+        "assistSum": match.assist,
+        "headShotSum": match.headShot,
+        "entryKillSum": match.entryKill,
+        "firstDeathSum": match.firstDeath,
+        "snipeSum": match.snipeNum,
+        "multiKillSum": match.twoKill + match.threeKill + match.fourKill + match.fiveKill,
+        "flashTeammateSum": match.flashTeammate,
+        "flashSuccessSum": match.flashSuccess,
+        "throwsSum": match.throwsCnt,
+    }
+
+def _match_agg_exprs() -> dict:
+    """与 _match_agg_values 对应的 SQL 聚合表达式，用于整表重建"""
+    return {
+        "cnt": func.count(MatchStatsPW.mid),
+        "winCnt": func.sum(case((MatchStatsPW.winTeam == MatchStatsPW.team, 1), else_=0)),
+        "roundSum": func.sum(MatchStatsPW.score1 + MatchStatsPW.score2),
+        "ratingSum": func.sum(MatchStatsPW.pwRating),
+        "ratingSqSum": func.sum(MatchStatsPW.pwRating * MatchStatsPW.pwRating),
+        "weSum": func.sum(MatchStatsPW.we),
+        "weSqSum": func.sum(MatchStatsPW.we * MatchStatsPW.we),
+        "adrSum": func.sum(MatchStatsPW.adpr),
+        "adrSqSum": func.sum(MatchStatsPW.adpr * MatchStatsPW.adpr),
+        "scoreChangeSum": func.sum(MatchStatsPW.pvpScoreChange),
+        "scoreChangeSqSum": func.sum(MatchStatsPW.pvpScoreChange * MatchStatsPW.pvpScoreChange),
+        "killSum": func.sum(MatchStatsPW.kill),
+        "deathSum": func.sum(MatchStatsPW.death),
+        "assistSum": func.sum(MatchStatsPW.assist),
+        "headShotSum": func.sum(MatchStatsPW.headShot),
+        "entryKillSum": func.sum(MatchStatsPW.entryKill),
+        "firstDeathSum": func.sum(MatchStatsPW.firstDeath),
+        "snipeSum": func.sum(MatchStatsPW.snipeNum),
+        "multiKillSum": func.sum(MatchStatsPW.twoKill + MatchStatsPW.threeKill + MatchStatsPW.fourKill + MatchStatsPW.fiveKill),
+        "flashTeammateSum": func.sum(MatchStatsPW.flashTeammate),
+        "flashSuccessSum": func.sum(MatchStatsPW.flashSuccess),
+        "throwsSum": func.sum(MatchStatsPW.throwsCnt),
+    }
 
 class DataManager:
     def __init__(self):
-        self.lock = asyncio.Lock()
+        # 每个玩家一把锁，不同玩家可以并行更新
+        self.locks: defaultdict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        # 正在由某个未提交事务写入的比赛，避免并行更新时重复抓取同一场比赛
+        self.claimed_mids: set[str] = set()
 
     async def bind(self, uid: str, steamid: str):
         """
@@ -74,6 +154,7 @@ class DataManager:
                 # 2. 不存在 -> 插入新记录
                 record = MemberSteamID(uid=uid, steamid=steamid)
                 await session.merge(record)
+        bump_data_version("cs")
 
     async def unbind(self, uid: str):
         """
@@ -85,6 +166,7 @@ class DataManager:
                 # 使用 delete 语句构造器
                 stmt = delete(MemberSteamID).where(MemberSteamID.uid == uid)
                 await session.execute(stmt)
+        bump_data_version("cs")
 
     def _faceit_headers(self) -> dict[str, str]:
         if not config.faceit_api_key:
@@ -96,6 +178,7 @@ class DataManager:
 
     async def _faceit_get(self, path: str, params: dict | None = None) -> dict:
         url = "https://open.faceit.com/data/v4" + path
+        await faceit_limiter.wait()
         async with get_session().get(url, headers=self._faceit_headers(), params=params) as resp:
             if resp.status == 404:
                 raise ValueError("FACEIT 数据不存在")
@@ -204,7 +287,6 @@ class DataManager:
 
         match_detail = await self._faceit_get(f"/matches/{mid}")
         match_stats = await self._faceit_get(f"/matches/{mid}/stats")
-        await asyncio.sleep(0.2)
 
         results = match_detail.get("results") if isinstance(match_detail, dict) else {}
         score = results.get("score") if isinstance(results, dict) else {}
@@ -311,31 +393,42 @@ class DataManager:
         )
         await session.merge(extra_info)
 
+    async def _calc_team_legacy(self, rows: list[tuple[str, str, int, int]], session: AsyncSession) -> dict[str, tuple[float, float]]:
+        """
+        rows 为 (mid, steamid, team, timeStamp)，一次查询取出所有人赛时的底蕴
+        返回每场比赛两队的平均底蕴，有一队没有任何底蕴数据的比赛不出现在结果中
+        """
+        scores = await db_val._get_legacy_scores([(steamid, ts) for _, steamid, _, ts in rows], session)
+        sums: dict[str, list[float]] = {}
+        for mid, steamid, team, ts in rows:
+            acc = sums.setdefault(mid, [.0, 0, .0, 0])
+            score = scores.get((steamid, ts))
+            if score is None or team not in (1, 2):
+                continue
+            acc[(team - 1) * 2] += score
+            acc[(team - 1) * 2 + 1] += 1
+        result: dict[str, tuple[float, float]] = {}
+        for mid, (team1sum, team1cnt, team2sum, team2cnt) in sums.items():
+            if team1cnt == 0 or team2cnt == 0:
+                logger.warning(f"match_extra_info 计算失败，队伍人数为0 {mid}")
+                continue
+            result[mid] = (team1sum / team1cnt, team2sum / team2cnt)
+        return result
+
     async def _update_match_gp_extra(self, mid: str, session: AsyncSession):
         extra_info = await session.get(MatchStatsGPExtra, mid)
         assert extra_info is not None
         if extra_info.team1Legacy is not None or extra_info.team2Legacy is not None:
             return
         logger.info(f"计算 match_gp_extra_info")
-        team1sum, team1cnt = .0, 0
-        team2sum, team2cnt = .0, 0
-        stmt = select(MatchStatsGP).where(MatchStatsGP.mid == mid)
-        result = await session.execute(stmt)
-        rows = result.scalars().all()
-        for row in rows:
-            if row.team == 1:
-                if res := await db_val._get_extra_info(row.steamid, session, timeStamp=row.timeStamp):
-                    team1sum += res.legacyScore
-                    team1cnt += 1
-            elif row.team == 2:
-                if res := await db_val._get_extra_info(row.steamid, session, timeStamp=row.timeStamp):
-                    team2sum += res.legacyScore
-                    team2cnt += 1
-        if team1cnt == 0 or team2cnt == 0:
-            logger.warning(f"match_extra_gp_info 计算失败，队伍人数为0 {mid}")
+        stmt = select(MatchStatsGP.mid, MatchStatsGP.steamid, MatchStatsGP.team, MatchStatsGP.timeStamp).where(MatchStatsGP.mid == mid)
+        legacy = await self._calc_team_legacy(
+            [(row.mid, row.steamid, row.team, row.timeStamp) for row in (await session.execute(stmt)).all()],
+            session,
+        )
+        if mid not in legacy:
             return
-        extra_info.team1Legacy = team1sum / team1cnt
-        extra_info.team2Legacy = team2sum / team2cnt
+        extra_info.team1Legacy, extra_info.team2Legacy = legacy[mid]
         await session.merge(extra_info)
     
     async def _check_match_gp_fetched_completed(self, mid: str, session: AsyncSession) -> tuple[bool, bool]:
@@ -347,45 +440,115 @@ class DataManager:
             return False, False
         return row[0] > 0, row[1] is not None and row[1] > 0
 
+    async def _update_match_extras(self, mids: list[str], session: AsyncSession) -> int:
+        """批量计算一批比赛的两队平均底蕴，已有记录的比赛跳过，返回新写入的条数"""
+        if len(mids) == 0:
+            return 0
+        done_stmt = select(MatchStatsPWExtra.mid).where(MatchStatsPWExtra.mid.in_(mids))
+        done = set((await session.execute(done_stmt)).scalars().all())
+        todo = [mid for mid in mids if mid not in done]
+        if len(todo) == 0:
+            return 0
+        logger.info(f"计算 match_extra_info count={len(todo)}")
+        rows_stmt = select(MatchStatsPW.mid, MatchStatsPW.steamid, MatchStatsPW.team, MatchStatsPW.timeStamp).where(MatchStatsPW.mid.in_(todo))
+        legacy = await self._calc_team_legacy(
+            [(row.mid, row.steamid, row.team, row.timeStamp) for row in (await session.execute(rows_stmt)).all()],
+            session,
+        )
+        session.add_all([
+            MatchStatsPWExtra(mid=mid, team1Legacy=team1, team2Legacy=team2)
+            for mid, (team1, team2) in legacy.items()
+        ])
+        return len(legacy)
+
     async def _update_match_extra(self, mid: str, session: AsyncSession):
-        extra_info = await session.get(MatchStatsPWExtra, mid)
-        if extra_info is not None:
-            return
-        logger.info(f"计算 match_extra_info")
-        team1sum, team1cnt = .0, 0
-        team2sum, team2cnt = .0, 0
-        stmt = select(MatchStatsPW).where(MatchStatsPW.mid == mid)
-        result = await session.execute(stmt)
-        rows = result.scalars().all()
-        for row in rows:
-            if row.team == 1:
-                if res := await db_val._get_extra_info(row.steamid, session, timeStamp=row.timeStamp):
-                    team1sum += res.legacyScore
-                    team1cnt += 1
-            elif row.team == 2:
-                if res := await db_val._get_extra_info(row.steamid, session, timeStamp=row.timeStamp):
-                    team2sum += res.legacyScore
-                    team2cnt += 1
-        if team1cnt == 0 or team2cnt == 0:
-            logger.warning(f"match_extra_info 计算失败，队伍人数为0 {mid}")
+        await self._update_match_extras([mid], session)
+
+    async def backfill_match_extra(self, batch_size: int = 500) -> int:
+        """为所有缺少 matches_extra 记录的比赛补算底蕴，按批提交"""
+        total = 0
+        # 按 mid 游标推进，无法计算（缺少底蕴数据）的比赛不会被反复扫描
+        last_mid = ""
+        while True:
+            async with async_session_factory() as session:
+                async with session.begin():
+                    stmt = (
+                        select(MatchStatsPW.mid)
+                        .outerjoin(MatchStatsPWExtra, MatchStatsPWExtra.mid == MatchStatsPW.mid)
+                        .where(MatchStatsPWExtra.mid.is_(None), MatchStatsPW.mid > last_mid)
+                        .group_by(MatchStatsPW.mid)
+                        .order_by(MatchStatsPW.mid)
+                        .limit(batch_size)
+                    )
+                    mids = list((await session.execute(stmt)).scalars().all())
+                    if len(mids) == 0:
+                        break
+                    added = await self._update_match_extras(mids, session)
+            total += added
+            last_mid = mids[-1]
+            logger.info(f"backfill_match_extra batch={len(mids)} added={added} total={total}")
+        return total
+
+    async def _add_match_aggs(self, matches: list[MatchStatsPW], session: AsyncSession):
+        """把一批新插入的比赛记录累加进汇总表，同一 (玩家, 赛季, 模式) 只写一次"""
+        grouped: dict[tuple[str, str, str], dict] = {}
+        for match in matches:
+            key = (match.steamid, match.seasonId, get_mode_class(match.mode))
+            values = _match_agg_values(match)
+            if key not in grouped:
+                grouped[key] = values
+            else:
+                for name, value in values.items():
+                    grouped[key][name] += value
+        if len(grouped) == 0:
             return
-        extra_info = MatchStatsPWExtra(
-            mid=mid,
-            team1Legacy=team1sum / team1cnt,
-            team2Legacy=team2sum / team2cnt
+        rows = [
+            {"steamid": steamid, "seasonId": season, "modeClass": mode_class, **values}
+            # 按主键排序，并行事务以相同顺序锁行
+            for (steamid, season, mode_class), values in sorted(grouped.items())
+        ]
+        # 并行更新的两个事务可能同时写同一玩家的第一场比赛，用 upsert 累加而不是先 UPDATE 再 INSERT
+        names = list(next(iter(grouped.values())).keys())
+        dialect = session.get_bind().dialect.name
+        if dialect == "mysql":
+            mysql_stmt = mysql_insert(MatchStatsPWAgg).values(rows)
+            await session.execute(mysql_stmt.on_duplicate_key_update({
+                name: getattr(MatchStatsPWAgg, name) + mysql_stmt.inserted[name] for name in names
+            }))
+        else:
+            upsert_stmt = (pg_insert if dialect == "postgresql" else sqlite_insert)(MatchStatsPWAgg).values(rows)
+            await session.execute(upsert_stmt.on_conflict_do_update(
+                index_elements=[MatchStatsPWAgg.steamid, MatchStatsPWAgg.seasonId, MatchStatsPWAgg.modeClass],
+                set_={name: getattr(MatchStatsPWAgg, name) + upsert_stmt.excluded[name] for name in names},
+            ))
+
+    async def rebuild_match_agg(self) -> int:
+        """按 matches 表整体重建汇总表，用于首次上线或数据修复"""
+        mode_class = case(
+            (or_(MatchStatsPW.mode.like("天梯%"), MatchStatsPW.mode == "PVP周末联赛"), MODE_LADDER),
+            (MatchStatsPW.mode == "PVP自定义", MODE_CUSTOM),
+            else_=MODE_OTHER,
         )
-        await session.merge(extra_info)
+        exprs = _match_agg_exprs()
+        source = (
+            select(MatchStatsPW.steamid, MatchStatsPW.seasonId, mode_class, *exprs.values())
+            .group_by(MatchStatsPW.steamid, MatchStatsPW.seasonId, mode_class)
+        )
+        async with async_session_factory() as session:
+            async with session.begin():
+                await session.execute(delete(MatchStatsPWAgg))
+                await session.execute(
+                    insert(MatchStatsPWAgg).from_select(["steamid", "seasonId", "modeClass", *exprs.keys()], source)
+                )
+            count = await session.scalar(select(func.count()).select_from(MatchStatsPWAgg))
+        logger.info(f"rebuild_match_agg done rows={count}")
+        return count or 0
 
-    async def _update_match(self, mid: str, timeStamp: int, season: str, session: AsyncSession):
-        logger.info(f"_update_match start mid={mid} season={season} timestamp={timeStamp}")
-        stmt = select(func.count()).select_from(MatchStatsPW).where(MatchStatsPW.mid == mid)
-        
-        result = await session.execute(stmt)
-        row = result.scalar()
-        if row is not None and row > 0:
-            logger.info(f"update_matchpw {mid} in db")
-            return 0
-        logger.info(f"update_matchpw {mid} not in db, fetching...")
+    def _release_claimed_mids(self, session: AsyncSession) -> None:
+        """事务结束后释放该会话认领的比赛"""
+        self.claimed_mids.difference_update(session.info.pop("claimed_mids", set()))
+
+    async def _fetch_match_detail(self, mid: str) -> dict:
         url = "https://api.wmpvp.com/api/v1/csgo/match"
         payload = {
             "matchId": mid,
@@ -394,12 +557,15 @@ class DataManager:
             "appversion": "3.5.4.172",
             "token":config.cs_wmtoken
         }
+        await wmpvp_limiter.wait()
         async with get_session().post(url,headers=header,json=payload) as resp:
             data = await resp.json()
-        await asyncio.sleep(0.2)
         if data["statusCode"] != 0:
             logger.error(f"爬取失败  {mid} {data}")
             raise RuntimeError("爬取失败：" + data.get("errorMessage", "未知错误"))
+        return data
+
+    def _build_match_entries(self, mid: str, timeStamp: int, season: str, data: dict) -> list[MatchStatsPW]:
         base = data['data']['base']
         count = {}
         for player in data['data']['players']:
@@ -407,8 +573,9 @@ class DataManager:
                 count[player['teamId']] = 0
             count[player['teamId']] += 1
             
+        entries: list[MatchStatsPW] = []
         for player in data['data']['players']:
-            match_entry = MatchStatsPW(
+            entries.append(MatchStatsPW(
                 # --- 核心主键 ---
                 mid=mid,
                 steamid=player['playerId'],
@@ -478,19 +645,64 @@ class DataManager:
                 # --- 进阶数据 ---
                 adpr=player['adpr'],
                 rws=player['rws']
-            )
+            ))
+        return entries
 
-            # 执行 Upsert 操作
-            await session.merge(match_entry)
+    async def _update_matches(self, matches: list[tuple[str, int, str]], session: AsyncSession) -> tuple[list[str], list[tuple[str, int, str]]]:
+        """
+        批量抓取并写入新比赛，返回 (实际新增的比赛 id, 因其他事务正在写入而跳过的比赛)
+        matches 为 (mid, timeStamp, season) 列表
+        详情请求在限速器下并发，涉及的玩家资料在整批中只刷新一次
+        """
+        if len(matches) == 0:
+            return [], []
+        logger.info(f"_update_matches start count={len(matches)}")
+        stmt = select(MatchStatsPW.mid).where(MatchStatsPW.mid.in_([mid for mid, _, _ in matches])).distinct()
+        in_db = set((await session.execute(stmt)).scalars().all())
+        pending: list[tuple[str, int, str]] = []
+        skipped: list[tuple[str, int, str]] = []
+        for mid, timeStamp, season in matches:
+            if mid in in_db:
+                logger.info(f"update_matchpw {mid} in db")
+                continue
+            if mid in self.claimed_mids:
+                logger.info(f"update_matchpw {mid} claimed by another update, skip")
+                skipped.append((mid, timeStamp, season))
+                continue
+            self.claimed_mids.add(mid)
+            session.info.setdefault("claimed_mids", set()).add(mid)
+            pending.append((mid, timeStamp, season))
+        if len(pending) == 0:
+            return [], skipped
+
+        logger.info(f"update_matchpw fetching {len(pending)} matches...")
+        sem = asyncio.Semaphore(config.cs_match_fetch_workers)
+        async def _fetch(mid: str) -> dict:
+            async with sem:
+                return await self._fetch_match_detail(mid)
+        results = await asyncio.gather(*[_fetch(mid) for mid, _, _ in pending], return_exceptions=True)
+        details: list[dict] = []
+        for detail in results:
+            if isinstance(detail, BaseException):
+                raise detail
+            details.append(detail)
+
+        entries: list[MatchStatsPW] = []
+        for (mid, timeStamp, season), data in zip(pending, details):
+            entries.extend(self._build_match_entries(mid, timeStamp, season, data))
+        session.add_all(entries)
+        await self._add_match_aggs(entries, session)
+
+        await self._refresh_players(list(dict.fromkeys(entry.steamid for entry in entries)), session)
+        await self._update_match_extras([mid for mid, _, _ in pending], session)
+        for mid, _, _ in pending:
+            logger.info(f"update_match {mid} success")
+        return [mid for mid, _, _ in pending], skipped
 
-            try:
-                await self._update_stats_card(player['playerId'], session)
-                await self._update_extra_info(player['playerId'], session)
-            except Exception as exc:
-                logger.warning(f"_update_match player update skipped mid={mid} player={player['playerId']} error={exc}")
-        await self._update_match_extra(mid, session)
-        logger.info(f"update_match {mid} success")
-        return 1
+    async def _update_match(self, mid: str, timeStamp: int, season: str, session: AsyncSession):
+        logger.info(f"_update_match start mid={mid} season={season} timestamp={timeStamp}")
+        added, _ = await self._update_matches([(mid, timeStamp, season)], session)
+        return len(added)
 
 
     async def _update_matchgp(self, mid: str, timeStamp: int, session: AsyncSession):
@@ -520,9 +732,9 @@ class DataManager:
             "token": config.cs_wmtoken
         }
         
+        await wmpvp_limiter.wait()
         async with get_session().post(url, headers=header, json=payload) as resp:
             data = await resp.json()
-        await asyncio.sleep(0.2)
 
         if data["statusCode"] != 0:
             logger.error(f"爬取失败 {mid} {data}")
@@ -738,76 +950,124 @@ class DataManager:
 
         await session.merge(detail_info)
 
-    async def _update_stats_card(self, steamid: str, session: AsyncSession, interval: int = 600):
-        logger.info(f"获取具体信息 for SteamID: {steamid}")
+    async def _fetch_stats_card_data(self, steamid: str, season: str) -> dict:
         url = "https://api.wmpvp.com/api/csgo/home/pvp/detailStats/v2"
         payload = {
             "mySteamId": config.cs_mysteam_id,
             "toSteamId": steamid,
-            "csgoSeasonId": SeasonId,
+            "csgoSeasonId": season,
         }
         header = {
             "appversion": "3.5.4.172",
             "token":config.cs_wmtoken
         }
-        result_info: SteamBaseInfo | None = await session.get(SteamBaseInfo, steamid)
-        if result_info is not None:
-            if time.time() - result_info.updateTime <= interval:
-                logger.warning(f"数据更新过于频繁 for SteamID: {steamid}")
-                raise TooFrequentError(int(interval - (time.time() - result_info.updateTime)))
-            result_info.updateTime = int(time.time())
-            await session.merge(result_info)
-        else:
-            record = SteamBaseInfo(
-                steamid=steamid,
-                name="",
-                updateTime=int(time.time()),
-                updateMatchTime=0,
-                avatarlink="",
-                lasttime=0,
-                ladderScore="[]"
-            )
-            result_info = await session.merge(record)
+        await wmpvp_limiter.wait()
         async with get_session().post(url,headers=header,json=payload) as result:
             data = await result.json()
         if data["statusCode"] != 0:
-            raise RuntimeError("爬取失败：" + data["errorMessage"])
-        if result_info.avatarlink != data["data"]["avatar"]:
-            try:
-                async with get_session().get(data["data"]["avatar"]) as resp:
-                    image_data = await resp.read()
-                # 缩小图片到128*128
-                img = Image.open(BytesIO(image_data))
-                img_small = img.resize((128, 128), Image.Resampling.LANCZOS)
-                img_small.save(avatar_dir / f"{steamid}.png", "PNG")
-            except UnidentifiedImageError:
-                logger.warning(f"头像格式无法识别，跳过头像保存: {steamid} {data['data']['avatar']}")
-            except Exception as exc:
-                logger.warning(f"头像下载或保存失败，跳过头像保存: {steamid}, {exc}")
-        result_info.name = data["data"]["name"]
+            prefix = "爬取失败：" if season == SeasonId else "上赛季爬取失败："
+            raise RuntimeError(prefix + data["errorMessage"])
+        return data["data"]
 
-        result_info.name = data["data"]["name"]
+    async def _save_avatar(self, steamid: str, avatar: str):
+        try:
+            async with get_session().get(avatar) as resp:
+                image_data = await resp.read()
+            # 缩小图片到128*128
+            img = Image.open(BytesIO(image_data))
+            img_small = img.resize((128, 128), Image.Resampling.LANCZOS)
+            img_small.save(avatar_dir / f"{steamid}.png", "PNG")
+        except UnidentifiedImageError:
+            logger.warning(f"头像格式无法识别，跳过头像保存: {steamid} {avatar}")
+        except Exception as exc:
+            logger.warning(f"头像下载或保存失败，跳过头像保存: {steamid}, {exc}")
+
+    async def _fetch_stats_card(self, steamid: str, avatarlink: str, need_last: bool) -> tuple[dict, dict | None]:
+        """只做网络请求，不碰 session，可以并发调用"""
+        data = await self._fetch_stats_card_data(steamid, SeasonId)
+        if avatarlink != data["avatar"]:
+            await self._save_avatar(steamid, data["avatar"])
+        last_data = await self._fetch_stats_card_data(steamid, lastSeasonId) if need_last else None
+        return data, last_data
+
+    async def _touch_base_info(self, steamid: str, result_info: SteamBaseInfo | None, session: AsyncSession) -> SteamBaseInfo:
+        """刷新前先记下更新时间，不存在则建一条空记录"""
+        if result_info is not None:
+            result_info.updateTime = int(time.time())
+            await session.merge(result_info)
+            return result_info
+        record = SteamBaseInfo(
+            steamid=steamid,
+            name="",
+            updateTime=int(time.time()),
+            updateMatchTime=0,
+            avatarlink="",
+            lasttime=0,
+            ladderScore="[]"
+        )
+        return await session.merge(record)
+
+    async def _write_stats_card(self, result_info: SteamBaseInfo, data: dict, last_data: dict | None, session: AsyncSession):
+        result_info.name = data["name"]
         result_info.updateTime = int(time.time())
-        result_info.avatarlink = data["data"]["avatar"]
-        result_info.ladderScore = json.dumps(data["data"]["ladderScoreList"])
+        result_info.avatarlink = data["avatar"]
+        result_info.ladderScore = json.dumps(data["ladderScoreList"])
 
         await session.merge(result_info)
-        await self._insert_detail_info(data["data"], session)
-        await asyncio.sleep(0.2)
-        result_detail: SteamDetailInfo | None = await session.get(SteamDetailInfo, (steamid, lastSeasonId))
-        if result_detail == None:
-            payload = {
-                "mySteamId": config.cs_mysteam_id,
-                "toSteamId": steamid,
-                "csgoSeasonId": lastSeasonId,
-            }
-            async with get_session().post(url,headers=header,json=payload) as result:
-                data = await result.json()
-            if data["statusCode"] != 0:
-                raise RuntimeError("上赛季爬取失败：" + data["errorMessage"])
-            await self._insert_detail_info(data["data"], session)
-            await asyncio.sleep(0.2)
-    
+        await self._insert_detail_info(data, session)
+        if last_data is not None:
+            await self._insert_detail_info(last_data, session)
+
+    async def _update_stats_card(self, steamid: str, session: AsyncSession, interval: int = 600):
+        logger.info(f"获取具体信息 for SteamID: {steamid}")
+        result_info: SteamBaseInfo | None = await session.get(SteamBaseInfo, steamid)
+        if result_info is not None and time.time() - result_info.updateTime <= interval:
+            logger.warning(f"数据更新过于频繁 for SteamID: {steamid}")
+            raise TooFrequentError(int(interval - (time.time() - result_info.updateTime)))
+        result_info = await self._touch_base_info(steamid, result_info, session)
+        need_last = (await session.get(SteamDetailInfo, (steamid, lastSeasonId))) is None
+        data, last_data = await self._fetch_stats_card(steamid, result_info.avatarlink, need_last)
+        await self._write_stats_card(result_info, data, last_data, session)
+
+    async def _refresh_players(self, steamids: list[str], session: AsyncSession, interval: int = 600):
+        """
+        批量刷新玩家资料与底蕴，等价于对每个玩家调用 _update_stats_card + _update_extra_info
+        网络请求并发进行，数据库写入仍在当前 session 中顺序执行
+        """
+        if len(steamids) == 0:
+            return
+        info_stmt = select(SteamBaseInfo).where(SteamBaseInfo.steamid.in_(steamids))
+        infos = {info.steamid: info for info in (await session.execute(info_stmt)).scalars().all()}
+        last_stmt = select(SteamDetailInfo.steamid).where(
+            SteamDetailInfo.steamid.in_(steamids),
+            SteamDetailInfo.seasonId == lastSeasonId,
+        )
+        has_last = set((await session.execute(last_stmt)).scalars().all())
+
+        targets: list[SteamBaseInfo] = []
+        for steamid in steamids:
+            info = infos.get(steamid)
+            if info is not None and time.time() - info.updateTime <= interval:
+                logger.info(f"_refresh_players skip recently updated steamid={steamid}")
+                continue
+            targets.append(await self._touch_base_info(steamid, info, session))
+
+        sem = asyncio.Semaphore(config.cs_match_fetch_workers)
+        async def _fetch(steamid: str, avatarlink: str) -> tuple[dict, dict | None]:
+            async with sem:
+                return await self._fetch_stats_card(steamid, avatarlink, steamid not in has_last)
+        cards = await asyncio.gather(
+            *[_fetch(info.steamid, info.avatarlink) for info in targets],
+            return_exceptions=True,
+        )
+
+        for info, card in zip(targets, cards):
+            if isinstance(card, BaseException):
+                logger.warning(f"_refresh_players player update skipped player={info.steamid} error={card}")
+                continue
+            await self._write_stats_card(info, card[0], card[1], session)
+            await self._update_extra_info(info.steamid, session)
+
     async def _update_extra_info(self, steamid: str, session: AsyncSession):
         logger.info(f"计算 extra_info for SteamID: {steamid}")
         base_info = await session.get(SteamBaseInfo, steamid)
@@ -859,7 +1119,6 @@ class DataManager:
         if latest_time > 0:
             params["from"] = latest_time + 1
         history = await self._faceit_get(f"/players/{bind.player_id}/history", params=params)
-        await asyncio.sleep(0.2)
         items = history.get("items") if isinstance(history, dict) else []
         if not isinstance(items, list):
             return []
@@ -878,9 +1137,10 @@ class DataManager:
 
     async def update_stats(self, steamid: str, interval: int=600) -> tuple[str, list[str], list[str], list[str]]:
         logger.info(f"update_stats start steamid={steamid} interval={interval}")
-        # 尝试获取锁，失败则抛出 LockingError
+        # 尝试获取该玩家的锁，失败则抛出 LockingError
+        lock = self.locks[steamid]
         try:
-            await asyncio.wait_for(self.lock.acquire(), timeout=0.1)
+            await asyncio.wait_for(lock.acquire(), timeout=0.1)
         except asyncio.TimeoutError:
             logger.warning(f"update_stats lock acquire timeout steamid={steamid}")
             raise LockingError()
@@ -918,9 +1178,10 @@ class DataManager:
             addMatchesGPList: list[str] = []
             addMatchesFaceitList: list[str] = []
 
-            async def _work(session: AsyncSession) -> None:
+            async def _collect() -> list[tuple[str, int, str]]:
+                """翻页收集上次更新之后的新比赛"""
                 nonlocal newLastTime
-                nonlocal addMatchesList
+                pending: list[tuple[str, int, str]] = []
                 for SeasonID in [SeasonId, lastSeasonId]:
                     logger.info(f"update_stats stage=match_list season={SeasonID} steamid={steamid}")
                     page = 1
@@ -939,22 +1200,30 @@ class DataManager:
                             "pvpType": -1,
                             "toSteamId": steamid
                         }
+                        await wmpvp_limiter.wait()
                         async with get_session().post(url, json=payload, headers=headers) as result:
                             ddata = await result.json()
                         if ddata["statusCode"] != 0:
                             logger.error(f"爬取失败 {steamid} {SeasonID} {page} {ddata}")
                             raise RuntimeError(ddata["errorMessage"])
-                        await asyncio.sleep(0.2)
                         for match in ddata['data']['matchList']:
                             newLastTime = max(newLastTime, match["timeStamp"])
                             if match["timeStamp"] > LastTime:
-                                if await self._update_match(match["matchId"], match["timeStamp"],SeasonID, session):
-                                    addMatchesList.append(match["matchId"])
+                                pending.append((match["matchId"], match["timeStamp"], SeasonID))
                             else:
-                                return
+                                return pending
                         if len(ddata['data']['matchList']) == 0:
                             break
                         page += 1
+                return pending
+            async def _work(session: AsyncSession) -> None:
+                nonlocal newLastTime
+                added, skipped = await self._update_matches(await _collect(), session)
+                addMatchesList.extend(added)
+                if skipped:
+                    # 跳过的比赛由其他事务写入，它回滚的话下次更新还要能重新抓到，lasttime 不能越过这些比赛
+                    newLastTime = min(newLastTime, min(timeStamp for _, timeStamp, _ in skipped) - 1)
+                    logger.info(f"update_stats hold lasttime={newLastTime} for {len(skipped)} claimed matches steamid={steamid}")
             async def _work_gp(session: AsyncSession) -> None:
                 nonlocal addMatchesGPList
                 logger.info(f"update_stats stage=match_list_gp steamid={steamid}")
@@ -970,23 +1239,26 @@ class DataManager:
                     "toSteamId": steamid
                 }
 
+                await wmpvp_limiter.wait()
                 async with get_session().post(url, json=payload, headers=headers) as result:
                     ddata = await result.json()
                 if ddata["statusCode"] != 0:
                     logger.error(f"gp爬取失败 {steamid} {ddata}")
                     raise RuntimeError(ddata["errorMessage"])
-                await asyncio.sleep(0.2)
                 if ddata['data']['dataPublic']:
                     for match in ddata['data']['matchList']:
                         if await self._update_matchgp(match["matchId"], match["timeStamp"], session):
                             addMatchesGPList.append(match["matchId"])
         
             async with async_session_factory() as session:
-                async with session.begin():
-                    logger.info(f"update_stats stage=write_match_list steamid={steamid}")
-                    await _work(session)
-                    base_info.lasttime = newLastTime
-                    await session.merge(base_info)
+                try:
+                    async with session.begin():
+                        logger.info(f"update_stats stage=write_match_list steamid={steamid}")
+                        await _work(session)
+                        base_info.lasttime = newLastTime
+                        await session.merge(base_info)
+                finally:
+                    self._release_claimed_mids(session)
 
                 async with session.begin():
                     logger.info(f"update_stats stage=write_match_list_gp steamid={steamid}")
@@ -995,16 +1267,37 @@ class DataManager:
                 async with session.begin():
                     logger.info(f"update_stats stage=write_match_list_faceit steamid={steamid}")
                     addMatchesFaceitList = await self._update_faceit_matches(steamid, session)
+            if addMatchesList or addMatchesGPList or addMatchesFaceitList:
+                bump_data_version("cs")
             logger.info(f"update_stats done steamid={steamid} pw_added={len(addMatchesList)} gp_added={len(addMatchesGPList)} faceit_added={len(addMatchesFaceitList)}")
             return base_info.name, addMatchesList, addMatchesGPList, addMatchesFaceitList
         finally:
             logger.info(f"update_stats release_lock steamid={steamid}")
-            self.lock.release()
+            lock.release()
+
+    async def update_stats_many(self, steamids: list[str], interval: int=600, workers: int | None=None) -> list[tuple[str, tuple[str, list[str], list[str], list[str]] | Exception]]:
+        """用有限个并发 worker 更新多名玩家，返回每个玩家的结果或异常"""
+        sem = asyncio.Semaphore(workers or config.cs_update_workers)
+
+        async def _one(steamid: str):
+            async with sem:
+                # 该玩家正被其他任务更新时等待其结束，而不是直接放弃
+                for _ in range(60):
+                    try:
+                        return steamid, await self.update_stats(steamid, interval)
+                    except LockingError:
+                        await asyncio.sleep(1)
+                    except Exception as e:
+                        return steamid, e
+                return steamid, LockingError()
+
+        return list(await asyncio.gather(*[_one(steamid) for steamid in steamids]))
     
 debug_update_stats_card = on_command("update_stats_card", priority=10, block=True, permission=SUPERUSER)
 debug_update_extra_info = on_command("update_extra_info", priority=10, block=True, permission=SUPERUSER)
 debug_update_matchgp = on_command("update_matchgp", priority=10, block=True, permission=SUPERUSER)
 debug_update_match = on_command("update_match", priority=10, block=True, permission=SUPERUSER)
+debug_backfill_match_extra = on_command("backfill_match_extra", priority=10, block=True, permission=SUPERUSER)
 
 
 def _split_args(args: Message) -> list[str]:
@@ -1063,8 +1356,17 @@ async def handle_debug_update_match(args: Message = CommandArg()):
         await debug_update_match.finish("timestamp 必须为整数")
     season = argv[2] if len(argv) >= 3 else SeasonId
     async with async_session_factory() as session:
-        async with session.begin():
-            changed = await db._update_match(mid, timestamp, season, session)
+        try:
+            async with session.begin():
+                changed = await db._update_match(mid, timestamp, season, session)
+        finally:
+            db._release_claimed_mids(session)
     await debug_update_match.finish(f"update_match 完成: mid={mid}, season={season}, changed={changed}")
+
+
+@debug_backfill_match_extra.handle()
+async def handle_debug_backfill_match_extra():
+    added = await db.backfill_match_extra()
+    await debug_backfill_match_extra.finish(f"backfill_match_extra 完成: added={added}")
   
 db = DataManager()
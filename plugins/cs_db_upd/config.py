@@ -8,3 +8,7 @@ class Config(BaseModel):
     cs_mysteam_id: int
     cs_wmtoken: str
     faceit_api_key: str | None = None
+    cs_wmpvp_qps: float = 5.0
+    faceit_qps: float = 5.0
+    cs_update_workers: int = 4
+    cs_match_fetch_workers: int = 8
@@ -11,8 +11,11 @@ from dataclasses import dataclass
 from typing import Callable, Awaitable
 import time
 import json
-from sqlalchemy import select, select, union_all, literal, func, text, or_, case, desc
+from sqlalchemy import select, select, union_all, literal, func, text, or_, case, desc, event
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import Session
 from itertools import groupby
+from bisect import bisect_left
 from collections import defaultdict
 from typing import Any
 
@@ -20,7 +23,7 @@ require("utils")
 from ..utils import async_session_factory
 from ..utils import get_today_start_timestamp
 require("models")
-from ..models import MemberSteamID, GroupMember, SteamBaseInfo, SteamDetailInfo, SteamExtraInfo, MatchStatsPW, MatchStatsPWExtra, MatchStatsGP, MatchStatsGPExtra, SteamFaceitID, MatchStatsFaceit
+from ..models import MemberSteamID, GroupMember, SteamBaseInfo, SteamDetailInfo, SteamExtraInfo, MatchStatsPW, MatchStatsPWExtra, MatchStatsPWAgg, MatchStatsGP, MatchStatsGPExtra, SteamFaceitID, MatchStatsFaceit
 
 from .config import Config
 
@@ -65,6 +68,7 @@ class ZeroIn(RangeGen):
 
 
 AsyncFloatFunc = Callable[[str, str], Awaitable[tuple[float, int]]]
+AsyncBatchFunc = Callable[[list[str], str], Awaitable[dict[str, tuple[float, int]]]]
 
 @dataclass
 class RankConfig:
@@ -75,6 +79,7 @@ class RankConfig:
     range_gen: RangeGen
     outputfmt: str
     func: AsyncFloatFunc
+    batch_func: AsyncBatchFunc | None = None
 
 valid_rank: list[str] = []
 
@@ -97,6 +102,36 @@ def get_time_sql(time_type: str) -> str:
     else:
         raise ValueError("err time")
 
+MODE_LADDER = "ladder"
+MODE_CUSTOM = "custom"
+MODE_OTHER = "other"
+
+MATCH_AGG_SUM_COLUMNS = [column.key for column in MatchStatsPWAgg.__table__.columns if not column.primary_key]
+
+
+def get_mode_class(mode: str) -> str:
+    """与 get_ladder_filter / get_custom_filter 的模式划分保持一致"""
+    if mode.startswith("天梯") or mode == "PVP周末联赛":
+        return MODE_LADDER
+    if mode == "PVP自定义":
+        return MODE_CUSTOM
+    return MODE_OTHER
+
+def get_agg_seasons(time_type: str) -> list[str] | None:
+    """
+    汇总表能直接回答的时间范围对应的赛季列表，空列表表示全部赛季
+    按天/周划分的时间范围返回 None，需要扫原始比赛表
+    """
+    if time_type == "本赛季":
+        return [SeasonId]
+    elif time_type == "上赛季":
+        return [lastSeasonId]
+    elif time_type == "两赛季":
+        return [SeasonId, lastSeasonId]
+    elif time_type == "全部":
+        return []
+    return None
+
 def get_ladder_filter(steamid: str, time_type: str) -> list:
     # 获取时间 SQL 片段
     time_sql_str = get_time_sql(time_type)
@@ -111,6 +146,16 @@ def get_ladder_filter(steamid: str, time_type: str) -> list:
         )
     ]
 
+def get_ladder_batch_filter(steamids: list[str], time_type: str) -> list:
+    return [
+        MatchStatsPW.steamid.in_(steamids),
+        text(get_time_sql(time_type)),
+        or_(
+            MatchStatsPW.mode.like("天梯%"),
+            MatchStatsPW.mode == "PVP周末联赛"
+        )
+    ]
+
 def get_custom_filter(steamid: str, time_type: str) -> list:
     # 获取时间 SQL 片段
     time_sql_str = get_time_sql(time_type)
@@ -121,10 +166,37 @@ def get_custom_filter(steamid: str, time_type: str) -> list:
         MatchStatsPW.mode == "PVP自定义"
     ]
 
+def get_custom_batch_filter(steamids: list[str], time_type: str) -> list:
+    return [
+        MatchStatsPW.steamid.in_(steamids),
+        text(get_time_sql(time_type)),
+        MatchStatsPW.mode == "PVP自定义"
+    ]
+
+def get_gp_batch_filter(steamids: list[str], time_type: str) -> list:
+    return [
+        MatchStatsGP.steamid.in_(steamids),
+        text(get_time_sql(time_type)),
+    ]
+
+
+# 身份缓存兜底过期时间，防止其他进程（脚本）写库后长期读到旧值
+IDENTITY_CACHE_TTL = 300
+
+def _copy_base_info(info: SteamBaseInfo) -> SteamBaseInfo:
+    """缓存里的对象不直接交给调用方，避免被就地修改"""
+    return SteamBaseInfo(**{attr.key: getattr(info, attr.key) for attr in sa_inspect(SteamBaseInfo).column_attrs})
+
 
 class DataManager:
     def __init__(self) -> None:
         self._registry: dict[str, RankConfig] = {}
+        # 身份缓存：绑定关系整表缓存，基础信息按 steamid 缓存，写入提交后失效
+        self._members: tuple[dict[str, str], dict[str, str]] | None = None
+        self._members_time = 0.0
+        self._base_infos: dict[str, tuple[float, SteamBaseInfo]] = {}
+        # 每次失效加一，读库期间发生失效则不回填缓存
+        self._identity_gen = 0
 
     def register(self, name: str, title: str, default_time: str, allowed_time: list[str] | None, reversed: bool, range_gen: RangeGen, outputfmt: str) -> Callable[[AsyncFloatFunc], AsyncFloatFunc]:
         if allowed_time is None:
@@ -139,11 +211,63 @@ class DataManager:
             return func
         return decorator
 
-    async def get_steamid(self, uid: str) -> str | None:
+    def register_batch(self, name: str) -> Callable[[AsyncBatchFunc], AsyncBatchFunc]:
+        """为已注册的排名类型附加批量版本，一次查询算出多名玩家的值"""
+        def decorator(func: AsyncBatchFunc) -> AsyncBatchFunc:
+            if name not in self._registry:
+                raise ValueError(f"未注册的排名类型: {name}")
+            self._registry[name].batch_func = func
+            return func
+        return decorator
+
+    async def get_rank_values(self, query_type: str, steamids: list[str], time_type: str) -> list[tuple[str, tuple[float, int]]]:
+        """
+        批量获取多名玩家的指标值，没有数据的玩家会被跳过
+        有批量版本时只查一次数据库，否则逐个调用单人版本
+        """
+        config = self.get_value_config(query_type)
+        if not steamids:
+            return []
+        if config.batch_func is not None:
+            values = await config.batch_func(steamids, time_type)
+            return [(steamid, values[steamid]) for steamid in steamids if steamid in values]
+        datas: list[tuple[str, tuple[float, int]]] = []
+        for steamid in steamids:
+            try:
+                datas.append((steamid, await config.func(steamid, time_type)))
+            except NoValueError:
+                pass
+        return datas
+
+    def invalidate_members(self) -> None:
+        self._identity_gen += 1
+        self._members = None
+
+    def invalidate_base_infos(self, steamids) -> None:
+        self._identity_gen += 1
+        for steamid in steamids:
+            self._base_infos.pop(steamid, None)
+
+    async def _get_members(self) -> tuple[dict[str, str], dict[str, str]]:
+        """返回 (uid -> steamid, steamid -> uid)"""
+        if self._members is not None and time.time() - self._members_time < IDENTITY_CACHE_TTL:
+            return self._members
+        gen = self._identity_gen
         async with async_session_factory() as session:
-            record = await session.get(MemberSteamID, uid)
-            
-            return record.steamid if record else None
+            rows = (await session.execute(select(MemberSteamID.uid, MemberSteamID.steamid))).all()
+        by_uid = {uid: steamid for uid, steamid in rows}
+        by_steamid: dict[str, str] = {}
+        for uid, steamid in rows:
+            by_steamid.setdefault(steamid, uid)
+        members = (by_uid, by_steamid)
+        if gen == self._identity_gen:
+            self._members = members
+            self._members_time = time.time()
+        return members
+
+    async def get_steamid(self, uid: str) -> str | None:
+        by_uid, _ = await self._get_members()
+        return by_uid.get(uid)
 
     async def get_faceit_bind(self, steamid: str) -> SteamFaceitID | None:
         async with async_session_factory() as session:
@@ -157,15 +281,34 @@ class DataManager:
 
     async def is_user(self, steamid: str) -> bool:
         """是否是群友"""
-        async with async_session_factory() as session:
-            stmt = select(func.count(MemberSteamID.steamid)).where(MemberSteamID.steamid == steamid)
-            result = await session.execute(stmt)
-            count = result.scalar_one()
-            return count > 0
+        _, by_steamid = await self._get_members()
+        return steamid in by_steamid
 
     async def get_base_info(self, steamid: str) -> SteamBaseInfo | None:
+        return (await self.get_base_infos([steamid])).get(steamid)
+
+    async def get_base_infos(self, steamids: list[str]) -> dict[str, SteamBaseInfo]:
+        """批量获取基础信息，缓存未命中的一次查询补齐，不存在的 steamid 不出现在结果中"""
+        now = time.time()
+        result: dict[str, SteamBaseInfo] = {}
+        missing: list[str] = []
+        for steamid in dict.fromkeys(steamids):
+            cached = self._base_infos.get(steamid)
+            if cached is not None and now - cached[0] < IDENTITY_CACHE_TTL:
+                result[steamid] = _copy_base_info(cached[1])
+            else:
+                missing.append(steamid)
+        if len(missing) == 0:
+            return result
+        gen = self._identity_gen
         async with async_session_factory() as session:
-            return await session.get(SteamBaseInfo, steamid)
+            stmt = select(SteamBaseInfo).where(SteamBaseInfo.steamid.in_(missing))
+            records = (await session.execute(stmt)).scalars().all()
+        for record in records:
+            if gen == self._identity_gen:
+                self._base_infos[record.steamid] = (now, record)
+            result[record.steamid] = _copy_base_info(record)
+        return result
 
     async def get_detail_info(self, steamid: str, seasonid: str = SeasonId) -> SteamDetailInfo | None:
         async with async_session_factory() as session:
@@ -194,6 +337,33 @@ class DataManager:
         result = await session.execute(stmt)
         return result.scalar_one_or_none()
 
+    async def _get_legacy_scores(self, pairs: list[tuple[str, int]], session) -> dict[tuple[str, int], float]:
+        """
+        _get_extra_info 的批量版本，一次查询解析多个 (steamid, timeStamp) 对应的底蕴
+        规则相同：优先取该时间之后最早的一条，否则取之前最近的一条；无记录的键不出现在结果中
+        """
+        if len(pairs) == 0:
+            return {}
+        steamids = list({steamid for steamid, _ in pairs})
+        stmt = (
+            select(SteamExtraInfo.steamid, SteamExtraInfo.timeStamp, SteamExtraInfo.legacyScore)
+            .where(SteamExtraInfo.steamid.in_(steamids))
+            .order_by(SteamExtraInfo.steamid, SteamExtraInfo.timeStamp)
+        )
+        history: dict[str, tuple[list[int], list[float]]] = {}
+        for steamid, ts, score in (await session.execute(stmt)).all():
+            times, scores = history.setdefault(steamid, ([], []))
+            times.append(ts)
+            scores.append(score)
+        result: dict[tuple[str, int], float] = {}
+        for steamid, timeStamp in pairs:
+            if steamid not in history:
+                continue
+            times, scores = history[steamid]
+            idx = bisect_left(times, timeStamp)
+            result[(steamid, timeStamp)] = scores[idx] if idx < len(times) else scores[-1]
+        return result
+
     async def get_extra_info(self, steamid: str, timeStamp: int = int(1e10)) -> SteamExtraInfo | None:
         async with async_session_factory() as session:
             return await self._get_extra_info(steamid, session, timeStamp)
@@ -259,6 +429,25 @@ class DataManager:
                 steamids.add(steamid)
         return list(steamids)
 
+    async def get_match_agg(self, steamids: list[str], time_type: str, mode_class: str = MODE_LADDER) -> dict[str, Any]:
+        """从汇总表读取多名玩家在赛季范围内的累计值，没有比赛的玩家不会出现在结果中"""
+        seasons = get_agg_seasons(time_type)
+        assert seasons is not None, "汇总表不支持该时间范围"
+        async with async_session_factory() as session:
+            stmt = (
+                select(
+                    MatchStatsPWAgg.steamid,
+                    *[func.sum(getattr(MatchStatsPWAgg, name)).label(name) for name in MATCH_AGG_SUM_COLUMNS]
+                )
+                .where(MatchStatsPWAgg.steamid.in_(steamids))
+                .where(MatchStatsPWAgg.modeClass == mode_class)
+                .group_by(MatchStatsPWAgg.steamid)
+            )
+            if seasons:
+                stmt = stmt.where(MatchStatsPWAgg.seasonId.in_(seasons))
+            rows = (await session.execute(stmt)).all()
+        return {row.steamid: row for row in rows if row.cnt}
+
     def get_value_config(self, query_type: str) -> RankConfig:
         if query_type not in self._registry:
             raise ValueError(f"无效的查询类型，支持的有 {list(self._registry.keys())}")
@@ -353,7 +542,7 @@ class DataManager:
         async with async_session_factory() as session:
             return await session.get(MatchStatsPWExtra, mid)
 
-    async def get_match_teammate(self, steamid: str, time_type: str, querys: list[str], top_k: int = 1) -> list[list[tuple[str, float, int]]]:
+    async def get_match_teammate(self, steamid: str, time_type: str, querys: list[str], top_k: int = 1, opponent: bool = False) -> list[list[tuple[str, float, int]]]:
         """
         获取队友信息
         参数:
@@ -368,67 +557,61 @@ class DataManager:
                 rt：一起打时自己 rt
                 rt2：一起打时对方 rt
                 用 _ 开头表示选择最小值，否则选择最大值
+            opponent: 为 True 时统计对手（同场不同队）而不是队友
         返回:
             包含元组 (steamid, value, count) 的列表，value 根据 querys 决定
         """
-        matches = await self.get_matches(steamid, time_type, only_ladder=True, limit=1000000000)
-        assert matches is not None, "无比赛数据"
-        match_info: dict[str, list[MatchStatsPW]] = {}
-        for match in matches:
-            teammates = await self.get_match_detail(match.mid)
-            assert teammates is not None, "无比赛详情数据"
-            match_info[match.mid] = [match]
-            for mate in teammates:
-                if mate.steamid != steamid and await self.steamid_in_db(mate.steamid) and mate.team == match.team:
-                    match_info[match.mid].append(mate)
-        result: list[list[tuple[str, float, int]]] = []
-        
-        teammate_count: dict[str, int] = defaultdict(int)
-        teammate_upscore: dict[str, int] = defaultdict(int)
-        teammate_upscore2: dict[str, int] = defaultdict(int)
-        teammate_we: dict[str, float] = defaultdict(float)
-        teammate_we2: dict[str, float] = defaultdict(float)
-        teammate_rt: dict[str, float] = defaultdict(float)
-        teammate_rt2: dict[str, float] = defaultdict(float)
-        for mates in match_info.values():
-            base_match = mates[0]
-            for mate in mates[1:]:
-                teammate_count[mate.steamid] += 1
-                teammate_upscore[mate.steamid] += base_match.pvpScoreChange
-                teammate_upscore2[mate.steamid] += mate.pvpScoreChange
-                teammate_we[mate.steamid] += base_match.we
-                teammate_we2[mate.steamid] += mate.we
-                teammate_rt[mate.steamid] += base_match.pwRating
-                teammate_rt2[mate.steamid] += mate.pwRating
+        mine = (
+            select(
+                MatchStatsPW.mid,
+                MatchStatsPW.team,
+                MatchStatsPW.pvpScoreChange,
+                MatchStatsPW.we,
+                MatchStatsPW.pwRating,
+            )
+            .where(*get_ladder_filter(steamid, time_type))
+        ).subquery("mine")
+        same_side = MatchStatsPW.team != mine.c.team if opponent else MatchStatsPW.team == mine.c.team
+        stmt = (
+            select(
+                MatchStatsPW.steamid,
+                func.count(MatchStatsPW.mid).label("cnt"),
+                func.sum(mine.c.pvpScoreChange).label("upscore"),
+                func.sum(MatchStatsPW.pvpScoreChange).label("upscore2"),
+                func.sum(mine.c.we).label("we"),
+                func.sum(MatchStatsPW.we).label("we2"),
+                func.sum(mine.c.pwRating).label("rt"),
+                func.sum(MatchStatsPW.pwRating).label("rt2"),
+            )
+            .join(mine, MatchStatsPW.mid == mine.c.mid)
+            .where(same_side)
+            .where(MatchStatsPW.steamid != steamid)
+            .where(MatchStatsPW.steamid.in_(select(MemberSteamID.steamid)))
+            .group_by(MatchStatsPW.steamid)
+            .order_by(MatchStatsPW.steamid)
+        )
+        async with async_session_factory() as session:
+            match_count = (await session.execute(select(func.count()).select_from(mine))).scalar_one()
+            assert match_count > 0, "无比赛数据"
+            rows = (await session.execute(stmt)).all()
 
-        
+        value_funcs: dict[str, Callable[[Any], float]] = {
+            "场次": lambda row: row.cnt,
+            "上分": lambda row: row.upscore,
+            "上分2": lambda row: row.upscore2,
+            "WE": lambda row: row.we / row.cnt,
+            "WE2": lambda row: row.we2 / row.cnt,
+            "rt": lambda row: row.rt / row.cnt,
+            "rt2": lambda row: row.rt2 / row.cnt,
+        }
+        result: list[list[tuple[str, float, int]]] = []
         for querytype in querys:
             reversed = not querytype.startswith("_")
             querytype = querytype.lstrip("_")
-            
-            if querytype == "场次":
-                best_steamids = sorted(teammate_count, key=lambda x: teammate_count[x], reverse=reversed)[:top_k]
-                result.append([(id, teammate_count[id], teammate_count[id]) for id in best_steamids])
-            elif querytype == "上分":
-                best_steamids = sorted(teammate_upscore, key=lambda x: teammate_upscore[x], reverse=reversed)[:top_k]
-                result.append([(id, teammate_upscore[id], teammate_count[id]) for id in best_steamids])
-            elif querytype == "上分2":
-                best_steamids = sorted(teammate_upscore2, key=lambda x: teammate_upscore2[x], reverse=reversed)[:top_k]
-                result.append([(id, teammate_upscore2[id], teammate_count[id]) for id in best_steamids])
-            elif querytype == "WE":
-                best_steamids = sorted(teammate_we, key=lambda x: teammate_we[x] / teammate_count[x], reverse=reversed)[:top_k]
-                result.append([(id, teammate_we[id] / teammate_count[id], teammate_count[id]) for id in best_steamids])
-            elif querytype == "WE2":
-                best_steamids = sorted(teammate_we2, key=lambda x: teammate_we2[x] / teammate_count[x], reverse=reversed)[:top_k]
-                result.append([(id, teammate_we2[id] / teammate_count[id], teammate_count[id]) for id in best_steamids])
-            elif querytype == "rt":
-                best_steamids = sorted(teammate_rt, key=lambda x: teammate_rt[x] / teammate_count[x], reverse=reversed)[:top_k]
-                result.append([(id, teammate_rt[id] / teammate_count[id], teammate_count[id]) for id in best_steamids])
-            elif querytype == "rt2":
-                best_steamids = sorted(teammate_rt2, key=lambda x: teammate_rt2[x] / teammate_count[x], reverse=reversed)[:top_k]
-                result.append([(id, teammate_rt2[id] / teammate_count[id], teammate_count[id]) for id in best_steamids])
-            else:
-                assert False, "未知的查询类型"
+            assert querytype in value_funcs, "未知的查询类型"
+            value_func = value_funcs[querytype]
+            best_rows = sorted(rows, key=value_func, reverse=reversed)[:top_k]
+            result.append([(row.steamid, value_func(row), row.cnt) for row in best_rows])
         return result
 
     async def get_matches_gp(self, steamid: str, time_type: str, limit: int = 20, offset: int = 0) -> list[MatchStatsGP] | None:
@@ -671,17 +854,11 @@ class DataManager:
             return matches_list
 
     async def steamid_in_db(self, steamid: str) -> bool:
-        async with async_session_factory() as session:
-            stmt = select(MemberSteamID).where(MemberSteamID.steamid == steamid)
-            result = await session.execute(stmt)
-            record = result.scalar()
-            return record is not None
+        return await self.is_user(steamid)
     
     async def get_uid_by_steamid(self, steamid: str) -> str | None:
-        async with async_session_factory() as session:
-            stmt = select(MemberSteamID.uid).where(MemberSteamID.steamid == steamid).limit(1)
-            result = await session.execute(stmt)
-            return result.scalar_one_or_none()
+        _, by_steamid = await self._get_members()
+        return by_steamid.get(steamid)
 
     async def get_username(self, uid: str) -> str | None:
         if steamid := await self.get_steamid(uid):
@@ -701,6 +878,42 @@ class DataManager:
 db = DataManager()
 
 
+# 任何会话写入绑定关系或基础信息并提交后，让身份缓存失效
+@event.listens_for(Session, "after_flush")
+def _collect_identity_changes(session: Session, flush_context) -> None:
+    for obj in [*session.new, *session.dirty, *session.deleted]:
+        if isinstance(obj, SteamBaseInfo):
+            session.info.setdefault("dirty_base_infos", set()).add(obj.steamid)
+        elif isinstance(obj, MemberSteamID):
+            session.info["dirty_members"] = True
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_identity_statements(orm_execute_state) -> None:
+    # update()/delete() 语句不经过 flush，单独处理
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    for mapper in orm_execute_state.all_mappers:
+        if mapper.class_ is MemberSteamID:
+            orm_execute_state.session.info["dirty_members"] = True
+        elif mapper.class_ is SteamBaseInfo:
+            orm_execute_state.session.info["dirty_base_infos_all"] = True
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_identity_cache(session: Session) -> None:
+    if session.info.pop("dirty_members", False):
+        db.invalidate_members()
+    if session.info.pop("dirty_base_infos_all", False):
+        session.info.pop("dirty_base_infos", None)
+        db.invalidate_base_infos(list(db._base_infos))
+    elif steamids := session.info.pop("dirty_base_infos", None):
+        db.invalidate_base_infos(steamids)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_identity_changes(session: Session) -> None:
+    for key in ("dirty_members", "dirty_base_infos", "dirty_base_infos_all"):
+        session.info.pop(key, None)
+
+
 
 valid_time = ["今日", "昨日", "本周", "本赛季", "两赛季", "上赛季", "全部"]
 gp_time = ["今日", "昨日", "本周", "全部"]
@@ -709,6 +922,125 @@ gp_time = ["今日", "昨日", "本周", "全部"]
 class NoValueError(Exception):
     pass
 
+
+async def _batch_aggregate(model: Any, filters: list, columns: list, *where) -> list[Any]:
+    """按 steamid 分组聚合，返回 (steamid, *columns, 场次)"""
+    async with async_session_factory() as session:
+        stmt = (
+            select(model.steamid, *columns, func.count(model.mid))
+            .where(*filters)
+            .where(*where)
+            .group_by(model.steamid)
+        )
+        return list((await session.execute(stmt)).all())
+
+def _register_batch_avg(name: str, value: Any, *where, model: Any = MatchStatsPW, filter_func: Callable[[list[str], str], list] = get_ladder_batch_filter) -> None:
+    @db.register_batch(name)
+    async def batch(steamids: list[str], time_type: str) -> dict[str, tuple[float, int]]:
+        rows = await _batch_aggregate(model, filter_func(steamids, time_type), [func.avg(value)], *where)
+        return {steamid: (float(avg), cnt) for steamid, avg, cnt in rows if cnt > 0 and avg is not None}
+
+def _register_batch_count(name: str, *where, model: Any = MatchStatsPW, filter_func: Callable[[list[str], str], list] = get_ladder_batch_filter) -> None:
+    @db.register_batch(name)
+    async def batch(steamids: list[str], time_type: str) -> dict[str, tuple[float, int]]:
+        rows = await _batch_aggregate(model, filter_func(steamids, time_type), [], *where)
+        return {steamid: (float(cnt), cnt) for steamid, cnt in rows if cnt > 0}
+
+def _register_batch_per_round(name: str, value: Any, *, model: Any = MatchStatsPW, filter_func: Callable[[list[str], str], list] = get_ladder_batch_filter) -> None:
+    @db.register_batch(name)
+    async def batch(steamids: list[str], time_type: str) -> dict[str, tuple[float, int]]:
+        rows = await _batch_aggregate(
+            model,
+            filter_func(steamids, time_type),
+            [func.sum(value), func.sum(model.score1 + model.score2)],
+        )
+        return {
+            steamid: (float(total or 0) / int(rounds), cnt)
+            for steamid, total, rounds, cnt in rows
+            if cnt > 0 and rounds is not None and rounds > 0
+        }
+
+def _register_agg(name: str, calc: Callable[[Any], float | None], mode_class: str = MODE_LADDER) -> None:
+    """赛季粒度的时间范围改为读汇总表，按天/周的时间范围仍扫原始比赛表"""
+    config = db.get_value_config(name)
+    scan_func = config.func
+    scan_batch = config.batch_func
+
+    async def batch(steamids: list[str], time_type: str) -> dict[str, tuple[float, int]]:
+        if get_agg_seasons(time_type) is None:
+            if scan_batch is not None:
+                return await scan_batch(steamids, time_type)
+            values: dict[str, tuple[float, int]] = {}
+            for steamid in steamids:
+                try:
+                    values[steamid] = await scan_func(steamid, time_type)
+                except NoValueError:
+                    pass
+            return values
+        values = {}
+        for steamid, agg in (await db.get_match_agg(steamids, time_type, mode_class)).items():
+            value = calc(agg)
+            if value is not None:
+                values[steamid] = (float(value), int(agg.cnt))
+        return values
+
+    async def single(steamid: str, time_type: str) -> tuple[float, int]:
+        if get_agg_seasons(time_type) is None:
+            return await scan_func(steamid, time_type)
+        values = await batch([steamid], time_type)
+        if steamid not in values:
+            raise NoValueError()
+        return values[steamid]
+
+    config.func = single
+    config.batch_func = batch
+
+def _agg_var(total: float, sq_total: float, cnt: int) -> float | None:
+    if cnt <= 1:
+        return None
+    return max(0.0, (sq_total - total * total / cnt) / (cnt - 1))
+
+def _register_ladder_variance(name: str, title: str, value: Any, agg_sum: str, agg_sq_sum: str, outputfmt: str) -> None:
+    """
+    注册天梯方差类指标，一次扫描同时取和与平方和算样本方差
+    赛季粒度的时间范围读汇总表中对应的两列
+    """
+    async def batch(steamids: list[str], time_type: str) -> dict[str, tuple[float, int]]:
+        rows = await _batch_aggregate(
+            MatchStatsPW,
+            get_ladder_batch_filter(steamids, time_type),
+            [func.sum(value), func.sum(value * value)],
+        )
+        values: dict[str, tuple[float, int]] = {}
+        for steamid, total, sq_total, cnt in rows:
+            var = _agg_var(float(total), float(sq_total), cnt)
+            if var is not None:
+                values[steamid] = (var, cnt)
+        return values
+
+    @db.register(name, title, "两赛季", valid_time, True, Fix(0), outputfmt)
+    async def single(steamid: str, time_type: str) -> tuple[float, int]:
+        values = await batch([steamid], time_type)
+        if steamid not in values:
+            raise NoValueError()
+        return values[steamid]
+
+    db.register_batch(name)(batch)
+    _register_agg(name, lambda a: _agg_var(getattr(a, agg_sum), getattr(a, agg_sq_sum), a.cnt))
+
+def _register_batch_detail(name: str, getter: Callable[[SteamDetailInfo], float]) -> None:
+    @db.register_batch(name)
+    async def batch(steamids: list[str], time_type: str) -> dict[str, tuple[float, int]]:
+        assert(time_type == "本赛季")
+        async with async_session_factory() as session:
+            stmt = (
+                select(SteamDetailInfo)
+                .where(SteamDetailInfo.steamid.in_(steamids))
+                .where(SteamDetailInfo.seasonId == SeasonId)
+            )
+            records = (await session.execute(stmt)).scalars().all()
+        return {record.steamid: (getter(record), record.cnt) for record in records if record.cnt != 0}
+
 @db.register("ELO", "天梯分数", "本赛季", ["本赛季", "上赛季"], True, MinAdd(-10), "d0")
 async def get_elo(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -738,6 +1070,25 @@ async def get_elo(steamid: str, time_type: str) -> tuple[float, int]:
 
         return float(current_elo), total_count
 
+@db.register_batch("ELO")
+async def get_elo_batch(steamids: list[str], time_type: str) -> dict[str, tuple[float, int]]:
+    async with async_session_factory() as session:
+        ranked = (
+            select(
+                MatchStatsPW.steamid,
+                MatchStatsPW.pvpScore,
+                func.row_number().over(
+                    partition_by=MatchStatsPW.steamid,
+                    order_by=MatchStatsPW.timeStamp.desc()
+                ).label("rn"),
+                func.count().over(partition_by=MatchStatsPW.steamid).label("cnt"),
+            )
+            .where(*get_ladder_batch_filter(steamids, time_type))
+        ).subquery()
+        stmt = select(ranked.c.steamid, ranked.c.pvpScore, ranked.c.cnt).where(ranked.c.rn == 1)
+        rows = (await session.execute(stmt)).all()
+    return {steamid: (float(elo), cnt) for steamid, elo, cnt in rows if elo and cnt}
+
 @db.register("rt", "rating", "本赛季", valid_time, True, MinAdd(-0.05), "d2")
 async def get_rt(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -754,6 +1105,9 @@ async def get_rt(steamid: str, time_type: str) -> tuple[float, int]:
             
     raise NoValueError()
 
+_register_batch_avg("rt", MatchStatsPW.pwRating)
+_register_agg("rt", lambda a: a.ratingSum / a.cnt)
+
 @db.register("底蕴", "天梯底蕴", "全部", None, True, MinAdd(-1), "d0")
 async def get_legacy(steamid: str, time_type: str) -> tuple[float, int]:
     assert(time_type == "全部")
@@ -788,6 +1142,28 @@ async def get_legacy_diff(steamid: str, time_type: str) -> tuple[float, int]:
             return (res[0] / res[1], res[1])
     raise NoValueError()
 
+@db.register_batch("底蕴差")
+async def get_legacy_diff_batch(steamids: list[str], time_type: str) -> dict[str, tuple[float, int]]:
+    async with async_session_factory() as session:
+        stmt = (
+            select(
+                MatchStatsPW.steamid,
+                func.sum(
+                    case(
+                        (MatchStatsPW.team == 1, 1),
+                        else_=-1
+                    ) * (MatchStatsPWExtra.team1Legacy - MatchStatsPWExtra.team2Legacy)
+                ),
+                func.count(MatchStatsPWExtra.mid)
+            )
+            .select_from(MatchStatsPW)
+            .join(MatchStatsPWExtra, MatchStatsPW.mid == MatchStatsPWExtra.mid)
+            .where(*get_ladder_batch_filter(steamids, time_type))
+            .group_by(MatchStatsPW.steamid)
+        )
+        rows = (await session.execute(stmt)).all()
+    return {steamid: (total / cnt, cnt) for steamid, total, cnt in rows if cnt}
+
 @db.register("WE", "WE", "本赛季", valid_time, True, MinAdd(-1), "d2")
 async def get_we(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -799,6 +1175,9 @@ async def get_we(steamid: str, time_type: str) -> tuple[float, int]:
         if row[1] > 0: return (float(row[0]), row[1])
     raise NoValueError()
 
+_register_batch_avg("WE", MatchStatsPW.we)
+_register_agg("WE", lambda a: a.weSum / a.cnt)
+
 @db.register("ADR", "ADR", "本赛季", valid_time, True, MinAdd(-10), "d2")
 async def get_adr(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -811,6 +1190,9 @@ async def get_adr(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(row[0]), row[1])
     raise NoValueError()
 
+_register_batch_avg("ADR", MatchStatsPW.adpr)
+_register_agg("ADR", lambda a: a.adrSum / a.cnt)
+
 @db.register("场次", "场次", "本赛季", valid_time, True, Fix(0), "d0")
 async def get_matches_cnt(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -823,6 +1205,9 @@ async def get_matches_cnt(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(result), result)
     raise NoValueError()
 
+_register_batch_count("场次")
+_register_agg("场次", lambda a: a.cnt)
+
 @db.register("胜率", "胜率", "本赛季", valid_time, True, Fix(0), "p2")
 async def get_winrate(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -836,6 +1221,9 @@ async def get_winrate(steamid: str, time_type: str) -> tuple[float, int]:
         if row[1] > 0: return (float(row[0]), row[1])
     raise NoValueError()
 
+_register_batch_avg("胜率", case((MatchStatsPW.winTeam == MatchStatsPW.team, 1), else_=0))
+_register_agg("胜率", lambda a: a.winCnt / a.cnt)
+
 @db.register("首杀", "首杀率", "本赛季", None, True, Fix(0), "p0")
 async def get_ekrate(steamid: str, time_type: str) -> tuple[float, int]:
     assert(time_type == "本赛季")
@@ -844,6 +1232,8 @@ async def get_ekrate(steamid: str, time_type: str) -> tuple[float, int]:
         return result.firstRate, result.cnt
     raise NoValueError()
 
+_register_batch_detail("首杀", lambda info: info.firstRate)
+
 @db.register("尝试突破率", "尝试突破率", "两赛季", ["本赛季", "上赛季", "两赛季"], True, Fix(0), "p1")
 async def get_first_rate(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -862,6 +1252,10 @@ async def get_first_rate(steamid: str, time_type: str) -> tuple[float, int]:
         return float(row[0]) / int(row[1]), row[2]
     raise NoValueError()
     
+
+_register_batch_per_round("尝试突破率", MatchStatsPW.entryKill + MatchStatsPW.firstDeath)
+_register_agg("尝试突破率", lambda a: (a.entryKillSum + a.firstDeathSum) / a.roundSum if a.roundSum > 0 else None)
+
 @db.register("爆头", "爆头率", "本赛季", valid_time, True, Fix(0), "p0")
 async def get_hsrate(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -879,6 +1273,20 @@ async def get_hsrate(steamid: str, time_type: str) -> tuple[float, int]:
             return (int(row[0]) / int(row[1]), row[2])
     raise NoValueError()
 
+@db.register_batch("爆头")
+async def get_hsrate_batch(steamids: list[str], time_type: str) -> dict[str, tuple[float, int]]:
+    rows = await _batch_aggregate(
+        MatchStatsPW,
+        get_ladder_batch_filter(steamids, time_type),
+        [func.sum(MatchStatsPW.headShot), func.sum(MatchStatsPW.kill)],
+    )
+    return {
+        steamid: (int(hs) / int(kills), cnt)
+        for steamid, hs, kills, cnt in rows
+        if cnt > 0 and kills and kills > 0
+    }
+_register_agg("爆头", lambda a: a.headShotSum / a.killSum if a.killSum > 0 else None)
+
 @db.register("1v1", "1v1胜率", "本赛季", None, True, Fix(0), "p0")
 async def get_1v1wr(steamid: str, time_type: str) -> tuple[float, int]:
     assert(time_type == "本赛季")
@@ -887,6 +1295,8 @@ async def get_1v1wr(steamid: str, time_type: str) -> tuple[float, int]:
         return result.v1WinPercentage, result.cnt
     raise NoValueError()
 
+_register_batch_detail("1v1", lambda info: info.v1WinPercentage)
+
 @db.register("击杀", "场均击杀", "本赛季", valid_time, True, MinAdd(-0.1), "d2")
 async def get_kills(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -899,6 +1309,9 @@ async def get_kills(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(row[0]), row[1])
     raise NoValueError()
 
+_register_batch_avg("击杀", MatchStatsPW.kill)
+_register_agg("击杀", lambda a: a.killSum / a.cnt)
+
 @db.register("死亡", "场均死亡", "本赛季", valid_time, True, MinAdd(-0.1), "d2")
 async def get_deaths(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -911,6 +1324,9 @@ async def get_deaths(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(row[0]), row[1])
     raise NoValueError()
 
+_register_batch_avg("死亡", MatchStatsPW.death)
+_register_agg("死亡", lambda a: a.deathSum / a.cnt)
+
 @db.register("助攻", "场均助攻", "本赛季", valid_time, True, MinAdd(-0.1), "d2")
 async def get_assists(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -923,6 +1339,9 @@ async def get_assists(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(row[0]), row[1])
     raise NoValueError()
 
+_register_batch_avg("助攻", MatchStatsPW.assist)
+_register_agg("助攻", lambda a: a.assistSum / a.cnt)
+
 @db.register("尽力", "未胜利平均rt", "两赛季", valid_time, True, MinAdd(-0.05), "d2")
 async def get_tryhard(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -936,6 +1355,8 @@ async def get_tryhard(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(row[0]), row[1])
     raise NoValueError()
 
+_register_batch_avg("尽力", MatchStatsPW.pwRating, MatchStatsPW.winTeam != MatchStatsPW.team)
+
 @db.register("带飞", "胜利平均rt", "两赛季", valid_time, True, MinAdd(-0.05), "d2")
 async def get_carry(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -949,6 +1370,8 @@ async def get_carry(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(row[0]), row[1])
     raise NoValueError()
 
+_register_batch_avg("带飞", MatchStatsPW.pwRating, MatchStatsPW.winTeam == MatchStatsPW.team)
+
 @db.register("炸鱼", "小分平均rt", "两赛季", valid_time, True, MinAdd(-0.05), "d2")
 async def get_fish(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -963,6 +1386,8 @@ async def get_fish(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(row[0]), row[1])
     raise NoValueError()
 
+_register_batch_avg("炸鱼", MatchStatsPW.pwRating, MatchStatsPW.winTeam == MatchStatsPW.team, func.least(MatchStatsPW.score1, MatchStatsPW.score2) <= 6)
+
 @db.register("演员", "组排平均rt", "两赛季", valid_time, False, MinAdd(-0.05), "d2")
 async def get_duoqi(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -976,6 +1401,8 @@ async def get_duoqi(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(row[0]), row[1])
     raise NoValueError()
 
+_register_batch_avg("演员", MatchStatsPW.pwRating, MatchStatsPW.isgroup == 1)
+
 @db.register("鼓励", "单排场次", "两赛季", valid_time, True, Fix(0), "d0")
 async def get_solo_cnt(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -989,6 +1416,8 @@ async def get_solo_cnt(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(result), result)
     raise NoValueError()
 
+_register_batch_count("鼓励", MatchStatsPW.isgroup == 0)
+
 @db.register("悲情", ">1.2rt未胜利场次", "两赛季", valid_time, True, Fix(0), "d0")
 async def get_sad_cnt(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -1003,6 +1432,8 @@ async def get_sad_cnt(steamid: str, time_type: str) -> tuple[float, int]:
             return float(result), result
     raise NoValueError()
 
+_register_batch_count("悲情", MatchStatsPW.pwRating > 1.2, MatchStatsPW.winTeam != MatchStatsPW.team)
+
 @db.register("内战", "pvp自定义平均rt", "两赛季", valid_time, True, MinAdd(-0.05), "d2")
 async def get_pvp_rt(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -1015,6 +1446,9 @@ async def get_pvp_rt(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(row[0]), row[1])
     raise NoValueError()
 
+_register_batch_avg("内战", MatchStatsPW.pwRating, filter_func=get_custom_batch_filter)
+_register_agg("内战", lambda a: a.ratingSum / a.cnt, MODE_CUSTOM)
+
 @db.register("内战场次", "pvp自定义场次", "两赛季", valid_time, True, Fix(0), "d0")
 async def get_pvp_cnt(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -1027,6 +1461,9 @@ async def get_pvp_cnt(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(row), row)
     raise NoValueError()
 
+_register_batch_count("内战场次", filter_func=get_custom_batch_filter)
+_register_agg("内战场次", lambda a: a.cnt, MODE_CUSTOM)
+
 @db.register("内战胜率", "pvp自定义胜率", "两赛季", valid_time, True, Fix(0), "p2")
 async def get_pvp_wr(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -1040,6 +1477,9 @@ async def get_pvp_wr(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(row[0]), row[1])
     raise NoValueError()
 
+_register_batch_avg("内战胜率", case((MatchStatsPW.winTeam == MatchStatsPW.team, 1), else_=0), filter_func=get_custom_batch_filter)
+_register_agg("内战胜率", lambda a: a.winCnt / a.cnt, MODE_CUSTOM)
+
 @db.register("上分", "上分", "本周", valid_time, True, ZeroIn(-1), "d0")
 async def get_upscore(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -1052,6 +1492,16 @@ async def get_upscore(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(row[0]) if row[0] else 0.0, row[1])
     raise NoValueError()
 
+@db.register_batch("上分")
+async def get_upscore_batch(steamids: list[str], time_type: str) -> dict[str, tuple[float, int]]:
+    rows = await _batch_aggregate(
+        MatchStatsPW,
+        get_ladder_batch_filter(steamids, time_type),
+        [func.sum(MatchStatsPW.pvpScoreChange)],
+    )
+    return {steamid: (float(total) if total else 0.0, cnt) for steamid, total, cnt in rows if cnt > 0}
+_register_agg("上分", lambda a: a.scoreChangeSum)
+
 @db.register("回均首杀", "平均每回合首杀", "本赛季", valid_time, True, MinAdd(-0.01), "d2")
 async def get_rpek(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -1068,6 +1518,9 @@ async def get_rpek(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(row[0]) / int(row[1]), row[2])
     raise NoValueError()
 
+_register_batch_per_round("回均首杀", MatchStatsPW.entryKill)
+_register_agg("回均首杀", lambda a: a.entryKillSum / a.roundSum if a.roundSum > 0 else None)
+
 @db.register("回均首死", "平均每回合首死", "本赛季", valid_time, True, MinAdd(-0.01), "d2")
 async def get_rpfd(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -1084,6 +1537,9 @@ async def get_rpfd(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(row[0]) / int(row[1]), row[2])
     raise NoValueError()
 
+_register_batch_per_round("回均首死", MatchStatsPW.firstDeath)
+_register_agg("回均首死", lambda a: a.firstDeathSum / a.roundSum if a.roundSum > 0 else None)
+
 @db.register("回均狙杀", "平均每回合狙杀", "本赛季", valid_time, True, MinAdd(-0.01), "d2")
 async def get_rpsn(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -1100,6 +1556,9 @@ async def get_rpsn(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(row[0]) / int(row[1]), row[2])
     raise NoValueError()
 
+_register_batch_per_round("回均狙杀", MatchStatsPW.snipeNum)
+_register_agg("回均狙杀", lambda a: a.snipeSum / a.roundSum if a.roundSum > 0 else None)
+
 @db.register("多杀", "多杀回合占比", "本赛季", valid_time, True, MinAdd(-0.01), "p0")
 async def get_rpmk(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -1116,6 +1575,9 @@ async def get_rpmk(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(row[0]) / int(row[1]), row[2])
     raise NoValueError()
 
+_register_batch_per_round("多杀", MatchStatsPW.twoKill + MatchStatsPW.threeKill + MatchStatsPW.fourKill + MatchStatsPW.fiveKill)
+_register_agg("多杀", lambda a: a.multiKillSum / a.roundSum if a.roundSum > 0 else None)
+
 @db.register("内鬼", "场均闪白队友", "本赛季", valid_time, True, MinAdd(-0.5), "d1")
 async def get_rpft(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -1128,6 +1590,9 @@ async def get_rpft(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(row[0]), row[1])
     raise NoValueError()
 
+_register_batch_avg("内鬼", MatchStatsPW.flashTeammate)
+_register_agg("内鬼", lambda a: a.flashTeammateSum / a.cnt)
+
 @db.register("投掷", "场均道具投掷数", "本赛季", valid_time, True, MinAdd(-0.5), "d1")
 async def get_rptr(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -1140,6 +1605,9 @@ async def get_rptr(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(row[0]), row[1])
     raise NoValueError()
 
+_register_batch_avg("投掷", MatchStatsPW.throwsCnt)
+_register_agg("投掷", lambda a: a.throwsSum / a.cnt)
+
 @db.register("闪白", "场均闪白数", "本赛季", valid_time, True, MinAdd(-0.5), "d1")
 async def get_rpfs(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -1152,6 +1620,9 @@ async def get_rpfs(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(row[0]), row[1])
     raise NoValueError()
 
+_register_batch_avg("闪白", MatchStatsPW.flashSuccess)
+_register_agg("闪白", lambda a: a.flashSuccessSum / a.cnt)
+
 @db.register("白给", "平均每回合首杀-首死", "本赛季", valid_time, False, ZeroIn(-0.01), "d2")
 async def get_rpbg(steamid: str, time_type: str) -> tuple[float, int]:
     async with async_session_factory() as session:
@@ -1169,49 +1640,13 @@ async def get_rpbg(steamid: str, time_type: str) -> tuple[float, int]:
             return ((float(row[0]) - float(row[1])) / int(row[2]), row[3])
     raise NoValueError()
 
-@db.register("方差rt", "rt方差", "两赛季", valid_time, True, Fix(0) , "d2")
-async def get_var_rt(steamid: str, time_type: str) -> tuple[float, int]:
-    async with async_session_factory() as session:
-        avg_stmt = select(func.avg(MatchStatsPW.pwRating)).where(*get_ladder_filter(steamid, time_type))
-        avg_val = (await session.execute(avg_stmt)).scalar()
-        
-        if avg_val is None:
-            raise NoValueError()
-            
-        stmt = (
-            select(
-                func.sum((MatchStatsPW.pwRating - avg_val) * (MatchStatsPW.pwRating - avg_val)),
-                func.count(MatchStatsPW.pwRating)
-            )
-            .where(*get_ladder_filter(steamid, time_type))
-        )
-        row = (await session.execute(stmt)).one()
-        
-        if row[1] > 1:
-            return (float(row[0]) / (row[1] - 1), row[1])
-    raise NoValueError()
+_register_batch_per_round("白给", MatchStatsPW.entryKill - MatchStatsPW.firstDeath)
+_register_agg("白给", lambda a: (a.entryKillSum - a.firstDeathSum) / a.roundSum if a.roundSum > 0 else None)
 
-@db.register("方差ADR", "ADR方差", "两赛季", valid_time, True, Fix(0) , "d0")
-async def get_var_adr(steamid: str, time_type: str) -> tuple[float, int]:
-    async with async_session_factory() as session:
-        avg_stmt = select(func.avg(MatchStatsPW.adpr)).where(*get_ladder_filter(steamid, time_type))
-        avg_val = (await session.execute(avg_stmt)).scalar()
-        
-        if avg_val is None:
-            raise NoValueError()
-
-        stmt = (
-            select(
-                func.sum((MatchStatsPW.adpr - avg_val) * (MatchStatsPW.adpr - avg_val)),
-                func.count(MatchStatsPW.adpr)
-            )
-            .where(*get_ladder_filter(steamid, time_type))
-        )
-        row = (await session.execute(stmt)).one()
-        
-        if row[1] > 1:
-            return (float(row[0]) / (row[1] - 1), row[1])
-    raise NoValueError()
+_register_ladder_variance("方差rt", "rt方差", MatchStatsPW.pwRating, "ratingSum", "ratingSqSum", "d2")
+_register_ladder_variance("方差ADR", "ADR方差", MatchStatsPW.adpr, "adrSum", "adrSqSum", "d0")
+_register_ladder_variance("方差WE", "WE方差", MatchStatsPW.we, "weSum", "weSqSum", "d2")
+_register_ladder_variance("方差上分", "单场上分方差", MatchStatsPW.pvpScoreChange, "scoreChangeSum", "scoreChangeSqSum", "d0")
 
 @db.register("受益", "胜率-期望胜率", "两赛季", valid_time, True, ZeroIn(-0.01), "p0")
 async def get_benefit(steamid: str, time_type: str) -> tuple[float, int]:
@@ -1231,6 +1666,8 @@ async def get_benefit(steamid: str, time_type: str) -> tuple[float, int]:
             return (float(row[0]) if row[0] is not None else 0.0, row[1])
     raise NoValueError()
 
+_register_batch_avg("受益", case((MatchStatsPW.winTeam == MatchStatsPW.team, 1), else_=0) - func.greatest(0, (MatchStatsPW.we - 2.29) / (16 - 2.29)))
+
 @db.register("火力", "火力分", "本赛季", None, True, Fix(0), "d0")
 async def get_firepower(steamid: str, time_type: str) -> tuple[float, int]:
     assert(time_type == "本赛季")
@@ -1239,6 +1676,8 @@ async def get_firepower(steamid: str, time_type: str) -> tuple[float, int]:
         return result.firePowerScore, result.cnt
     raise NoValueError()
 
+_register_batch_detail("火力", lambda info: info.firePowerScore)
+
 @db.register("枪法", "枪法分", "本赛季", None, True, Fix(0), "d0")
 async def get_marksmanship(steamid: str, time_type: str) -> tuple[float, int]:
     assert(time_type == "本赛季")
@@ -1247,6 +1686,8 @@ async def get_marksmanship(steamid: str, time_type: str) -> tuple[float, int]:
         return result.marksmanshipScore, result.cnt
     raise NoValueError()
 
+_register_batch_detail("枪法", lambda info: info.marksmanshipScore)
+
 @db.register("补枪", "补枪分", "本赛季", None, True, Fix(0), "d0")
 async def get_follow_up_shot_score(steamid: str, time_type: str) -> tuple[float, int]:
     assert(time_type == "本赛季")
@@ -1255,6 +1696,8 @@ async def get_follow_up_shot_score(steamid: str, time_type: str) -> tuple[float,
         return result.followUpShotScore, result.cnt
     raise NoValueError()
 
+_register_batch_detail("补枪", lambda info: info.followUpShotScore)
+
 @db.register("突破", "突破分", "本赛季", None, True, Fix(0), "d0")
 async def get_breakthrough_score(steamid: str, time_type: str) -> tuple[float, int]:
     assert(time_type == "本赛季")
@@ -1263,6 +1706,8 @@ async def get_breakthrough_score(steamid: str, time_type: str) -> tuple[float, i
         return result.firstScore, result.cnt
     raise NoValueError()
 
+_register_batch_detail("突破", lambda info: info.firstScore)
+
 @db.register("残局", "残局分", "本赛季", None, True, Fix(0), "d0")
 async def get_endgame_score(steamid: str, time_type: str) -> tuple[float, int]:
     assert(time_type == "本赛季")
@@ -1271,6 +1716,8 @@ async def get_endgame_score(steamid: str, time_type: str) -> tuple[float, int]:
         return result.oneVnScore, result.cnt
     raise NoValueError()
 
+_register_batch_detail("残局", lambda info: info.oneVnScore)
+
 @db.register("道具", "道具分", "本赛季", None, True, Fix(0), "d0")
 async def get_utility_score(steamid: str, time_type: str) -> tuple[float, int]:
     assert(time_type == "本赛季")
@@ -1279,6 +1726,8 @@ async def get_utility_score(steamid: str, time_type: str) -> tuple[float, int]:
         return result.itemScore, result.cnt
     raise NoValueError()
 
+_register_batch_detail("道具", lambda info: info.itemScore)
+
 @db.register("狙击", "狙击分", "本赛季", None, True, Fix(0), "d0")
 async def get_sniper_score(steamid: str, time_type: str) -> tuple[float, int]:
     assert(time_type == "本赛季")
@@ -1287,6 +1736,8 @@ async def get_sniper_score(steamid: str, time_type: str) -> tuple[float, int]:
         return result.sniperScore, result.cnt
     raise NoValueError()
 
+_register_batch_detail("狙击", lambda info: info.sniperScore)
+
 @db.register("好人", "CTrt-Trt", "本赛季", None, True, ZeroIn(-0.01), "d2")
 async def get_good_person(steamid: str, time_type: str) -> tuple[float, int]:
     assert(time_type == "本赛季")
@@ -1295,6 +1746,8 @@ async def get_good_person(steamid: str, time_type: str) -> tuple[float, int]:
         return result.pwRatingCtAvg - result.pwRatingTAvg, result.cnt
     raise NoValueError()
 
+_register_batch_detail("好人", lambda info: info.pwRatingCtAvg - info.pwRatingTAvg)
+
 @db.register("gprt", "官匹rating", "全部", gp_time, True, ZeroIn(-0.01), "d2")
 async def get_gprt(steamid: str, time_type: str) -> tuple[float, int]:
     time_sql = get_time_sql(time_type)
@@ -1312,6 +1765,8 @@ async def get_gprt(steamid: str, time_type: str) -> tuple[float, int]:
             return result[0], result[1]
     raise NoValueError()
 
+_register_batch_avg("gprt", MatchStatsGP.rating, model=MatchStatsGP, filter_func=get_gp_batch_filter)
+
 @db.register("gp场次", "官匹场次", "全部", gp_time, True, Fix(0), "d0")
 async def get_gp_matches_cnt(steamid: str, time_type: str) -> tuple[float, int]:
     time_sql = get_time_sql(time_type)
@@ -1327,6 +1782,8 @@ async def get_gp_matches_cnt(steamid: str, time_type: str) -> tuple[float, int]:
             return result, result
     raise NoValueError()
 
+_register_batch_count("gp场次", model=MatchStatsGP, filter_func=get_gp_batch_filter)
+
 @db.register("gp回均首杀", "官匹平均每回合首杀", "全部", gp_time, True, MinAdd(-0.01), "d2")
 async def get_gp_rpek(steamid: str, time_type: str) -> tuple[float, int]:
     time_sql = get_time_sql(time_type)
@@ -1350,6 +1807,8 @@ async def get_gp_rpek(steamid: str, time_type: str) -> tuple[float, int]:
             return (int(tot_ek) / int(tot_rounds), row[2])
     raise NoValueError()
 
+_register_batch_per_round("gp回均首杀", MatchStatsGP.entryKill, model=MatchStatsGP, filter_func=get_gp_batch_filter)
+
 @db.register("gp回均首死", "官匹平均每回合首死", "全部", gp_time, True, MinAdd(-0.01), "d2")
 async def get_gp_rpfd(steamid: str, time_type: str) -> tuple[float, int]:
     time_sql = get_time_sql(time_type)
@@ -1371,6 +1830,8 @@ async def get_gp_rpfd(steamid: str, time_type: str) -> tuple[float, int]:
             return (int(tot_fd) / int(tot_rounds), row[2])
     raise NoValueError()
 
+_register_batch_per_round("gp回均首死", MatchStatsGP.entryDeath, model=MatchStatsGP, filter_func=get_gp_batch_filter)
+
 @db.register("gp回均狙杀", "官匹平均每回合狙杀", "全部", gp_time, True, MinAdd(-0.01), "d2")
 async def get_gp_rpsn(steamid: str, time_type: str) -> tuple[float, int]:
     time_sql = get_time_sql(time_type)
@@ -1392,6 +1853,8 @@ async def get_gp_rpsn(steamid: str, time_type: str) -> tuple[float, int]:
             return (int(tot_awp) / int(tot_rounds), row[2])
     raise NoValueError()
 
+_register_batch_per_round("gp回均狙杀", MatchStatsGP.awpKill, model=MatchStatsGP, filter_func=get_gp_batch_filter)
+
 @db.register("gp白给", "官匹平均每回合首杀-首死", "全部", gp_time, False, ZeroIn(-0.01), "d2")
 async def get_gp_rpbg(steamid: str, time_type: str) -> tuple[float, int]:
     time_sql = get_time_sql(time_type)
@@ -1413,6 +1876,8 @@ async def get_gp_rpbg(steamid: str, time_type: str) -> tuple[float, int]:
             return (int(diff) / int(tot_rounds), row[2])
     raise NoValueError()
 
+_register_batch_per_round("gp白给", MatchStatsGP.entryKill - MatchStatsGP.entryDeath, model=MatchStatsGP, filter_func=get_gp_batch_filter)
+
 @db.register("gp击杀", "官匹场均击杀", "全部", gp_time, True, MinAdd(-0.1), "d2")
 async def get_gp_kills(steamid: str, time_type: str) -> tuple[float, int]:
     time_sql = get_time_sql(time_type)
@@ -1427,6 +1892,8 @@ async def get_gp_kills(steamid: str, time_type: str) -> tuple[float, int]:
             return row[0], row[1]
     raise NoValueError()
 
+_register_batch_avg("gp击杀", MatchStatsGP.kill, model=MatchStatsGP, filter_func=get_gp_batch_filter)
+
 @db.register("gp死亡", "官匹场均死亡", "全部", gp_time, True, MinAdd(-0.1), "d2")
 async def get_gp_deaths(steamid: str, time_type: str) -> tuple[float, int]:
     time_sql = get_time_sql(time_type)
@@ -1441,6 +1908,8 @@ async def get_gp_deaths(steamid: str, time_type: str) -> tuple[float, int]:
             return row[0], row[1]
     raise NoValueError()
 
+_register_batch_avg("gp死亡", MatchStatsGP.death, model=MatchStatsGP, filter_func=get_gp_batch_filter)
+
 @db.register("gp助攻", "官匹场均助攻", "全部", gp_time, True, MinAdd(-0.1), "d2")
 async def get_gp_assists(steamid: str, time_type: str) -> tuple[float, int]:
     time_sql = get_time_sql(time_type)
@@ -1455,6 +1924,8 @@ async def get_gp_assists(steamid: str, time_type: str) -> tuple[float, int]:
             return row[0], row[1]
     raise NoValueError()
 
+_register_batch_avg("gp助攻", MatchStatsGP.assist, model=MatchStatsGP, filter_func=get_gp_batch_filter)
+
 @db.register("gp尽力", "官匹未胜利平均rt", "全部", gp_time, True, MinAdd(-0.05), "d2")
 async def get_gp_tryhard(steamid: str, time_type: str) -> tuple[float, int]:
     time_sql = get_time_sql(time_type)
@@ -1470,6 +1941,8 @@ async def get_gp_tryhard(steamid: str, time_type: str) -> tuple[float, int]:
             return row[0], row[1]
     raise NoValueError()
 
+_register_batch_avg("gp尽力", MatchStatsGP.rating, MatchStatsGP.winTeam != MatchStatsGP.team, model=MatchStatsGP, filter_func=get_gp_batch_filter)
+
 @db.register("gp带飞", "官匹胜利平均rt", "全部", gp_time, True, MinAdd(-0.05), "d2")
 async def get_gp_carry(steamid: str, time_type: str) -> tuple[float, int]:
     time_sql = get_time_sql(time_type)
@@ -1485,6 +1958,8 @@ async def get_gp_carry(steamid: str, time_type: str) -> tuple[float, int]:
             return row[0], row[1]
     raise NoValueError()
 
+_register_batch_avg("gp带飞", MatchStatsGP.rating, MatchStatsGP.winTeam == MatchStatsGP.team, model=MatchStatsGP, filter_func=get_gp_batch_filter)
+
 @db.register("gp炸鱼", "官匹小分平均rt", "全部", gp_time, True, MinAdd(-0.05), "d2")
 async def get_gp_fish(steamid: str, time_type: str) -> tuple[float, int]:
     time_sql = get_time_sql(time_type)
@@ -1502,6 +1977,8 @@ async def get_gp_fish(steamid: str, time_type: str) -> tuple[float, int]:
             return row[0], row[1]
     raise NoValueError()
 
+_register_batch_avg("gp炸鱼", MatchStatsGP.rating, MatchStatsGP.winTeam == MatchStatsGP.team, func.least(MatchStatsGP.score1, MatchStatsGP.score2) <= 6, model=MatchStatsGP, filter_func=get_gp_batch_filter)
+
 @db.register("皮蛋", "官匹场均下包数", "全部", gp_time, True, Fix(0), "d2")
 async def get_gp_c4(steamid: str, time_type: str) -> tuple[float, int]:
     time_sql = get_time_sql(time_type)
@@ -1515,3 +1992,5 @@ async def get_gp_c4(steamid: str, time_type: str) -> tuple[float, int]:
         if row is not None and row[1] > 0:
             return row[0], row[1]
     raise NoValueError()
+
+_register_batch_avg("皮蛋", MatchStatsGP.bombPlanted, model=MatchStatsGP, filter_func=get_gp_batch_filter)
@@ -20,11 +20,9 @@ from ..utils import output
 
 require("cs_db_val")
 from ..cs_db_val import db as db_val
-from ..cs_db_val import NoValueError
 
 require("cs_db_upd")
 from ..cs_db_upd import db as db_upd
-from ..cs_db_upd import LockingError
 
 require("cs_ai")
 from ..cs_ai import ai_ask_main
@@ -74,13 +72,9 @@ async def get_report_part(rank_type, time_type, steamids, reverse, fmt, n=3, fil
         time_type = config.default_time
     if time_type not in config.allowed_time:
         raise ValueError(f"无效的时间范围，支持的有 {config.allowed_time}")
-    for steamid in steamids:
-        try:
-            val = await config.func(steamid, time_type)
-            if filter(val[0]):
-                datas.append((steamid, val))
-        except NoValueError as e:
-            pass
+    for steamid, val in await db_val.get_rank_values(rank_type, steamids, time_type):
+        if filter(val[0]):
+            datas.append((steamid, val))
     datas = sorted(datas, key=lambda x: x[1][0], reverse=reverse)
     if len(datas) == 0:
         return "没有人类了\n"
@@ -126,17 +120,9 @@ async def dayreport_function(message: MessageEvent):
 @scheduler.scheduled_job("cron", hour="23", minute="30", id="dayreport")
 @send_day_report.handle()
 async def send_day_report_function():
-    for steamid in await db_val.get_all_steamid():
-        while True:
-            try:
-                await db_upd.update_stats(steamid)
-                break
-            except LockingError:
-                logger.info(f"db busy, waiting to update daily report player: {steamid}")
-                await asyncio.sleep(1)
-            except Exception as exc:
-                logger.warning(f"daily report update failed, skip player: {steamid}, {exc}")
-                break
+    for steamid, result in await db_upd.update_stats_many(await db_val.get_all_steamid()):
+        if isinstance(result, Exception):
+            logger.warning(f"daily report update failed, skip player: {steamid}, {result}")
     bot = get_bot()
     for groupid in config.cs_group_list:
         sid = f"group_{groupid}_?"
@@ -17,6 +17,7 @@ import aiohttp
 import psutil
 import asyncio
 import uuid
+from collections import OrderedDict
 import hashlib
 from pathlib import Path
 from fastapi import FastAPI, Body, HTTPException, Depends
@@ -27,25 +28,25 @@ from PIL import Image, ImageOps, UnidentifiedImageError
 from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError
 from pydantic import BaseModel, Field
-from pyppeteer import launch
 from ..major_hw.playoff_homework import (
     PLAYOFF_CATEGORIES,
     PLAYOFF_CATEGORY_SLOTS,
     PLAYOFF_STATUS_LABELS,
     playoff_category_status,
 )
+from ..major_hw.history import HomeworkHistory
 
 require("nonebot_plugin_apscheduler")
 from nonebot_plugin_apscheduler import scheduler
 
 require("utils")
-from ..utils import async_session_factory, local_storage, get_session
+from ..utils import async_session_factory, local_storage, get_session, browser_pool, get_data_version
 require("models")
-from ..models import AuthSession, GroupMember, MajorHWSnapshot, MemberSteamID, SteamBaseInfo, SteamExtraInfo, UserInfo
+from ..models import AuthSession, GroupMember, MajorHWHistory, MemberSteamID, SteamBaseInfo, SteamExtraInfo, UserInfo
 from ..models import MatchStatsPW, MatchStatsGP, MatchStatsFaceit
 require("cs_db_val")
 from ..cs_db_val import db as db_val
-from ..cs_db_val import valid_time, gp_time, NoValueError
+from ..cs_db_val import valid_time, gp_time
 from ..cs_db_val import SteamDetailInfo
 require("cs_db_upd")
 from ..cs_db_upd import db as db_upd
@@ -59,6 +60,7 @@ from ..major_hw import config as major_hw_config
 from ..major_hw import db as db_major_hw
 from ..major_hw import get_name as get_major_team_name
 from ..major_hw import major_teams, major_stage_name
+from ..major_hw import homework_what_if
 
 require("allmsg")
 from ..allmsg import get_msg_status
@@ -290,14 +292,74 @@ async def get_user_name(uid: str, interval: int = config.user_name_cache_expirat
 
 LOCAL_URL = os.getenv("CS_SCREENSHOT_BASE_URL") or f"http://localhost:{os.getenv('PORT', '1234')}"
 
-async def get_screenshot(path: str, token: str, width:int = 1000) -> bytes | None:
-    browser = None
-    screenshot = None
+class ScreenshotCache:
+    """按 (路径, token, 宽度, 数据版本) 缓存渲染结果，带过期时间和总大小上限的 LRU"""
+    def __init__(self, ttl: int, max_bytes: int):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.items: OrderedDict[tuple, tuple[float, bytes]] = OrderedDict()
+        self.size = 0
+        self.pending: dict[tuple, asyncio.Future] = {}
+
+    def get(self, key: tuple) -> bytes | None:
+        item = self.items.get(key)
+        if item is None:
+            return None
+        if time.time() - item[0] > self.ttl:
+            self._pop(key)
+            return None
+        self.items.move_to_end(key)
+        return item[1]
+
+    def put(self, key: tuple, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        self._pop(key)
+        self.items[key] = (time.time(), data)
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            self._pop(next(iter(self.items)))
+
+    def _pop(self, key: tuple) -> None:
+        item = self.items.pop(key, None)
+        if item is not None:
+            self.size -= len(item[1])
+
+screenshot_cache = ScreenshotCache(config.cs_screenshot_cache_ttl, config.cs_screenshot_cache_mb * 1024 * 1024)
+
+async def get_screenshot(path: str, token: str, width:int = 1000, cache_scope: str | None = None) -> bytes | None:
+    """
+    渲染页面截图
+    cache_scope 不为空时按该类数据的版本缓存结果，同一页面的并发请求只渲染一次
+    """
+    if cache_scope is None:
+        return await _render_screenshot(path, token, width)
+    key = (path, token, width, cache_scope, get_data_version(cache_scope))
+    if (cached := screenshot_cache.get(key)) is not None:
+        return cached
+    if key in screenshot_cache.pending:
+        return await asyncio.shield(screenshot_cache.pending[key])
+    future = asyncio.get_running_loop().create_future()
+    screenshot_cache.pending[key] = future
     try:
-        # 启动浏览器
-        browser = await launch(headless=True, args=['--no-sandbox'])
-        page = await browser.newPage()
-        
+        screenshot = await _render_screenshot(path, token, width)
+        if screenshot:
+            screenshot_cache.put(key, screenshot)
+        future.set_result(screenshot)
+        return screenshot
+    except BaseException as exc:
+        if isinstance(exc, asyncio.CancelledError):
+            future.cancel()
+        else:
+            future.set_exception(exc)
+            # 没有其他等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+        raise
+    finally:
+        screenshot_cache.pending.pop(key, None)
+
+async def _render_screenshot(path: str, token: str, width: int) -> bytes | None:
+    async with browser_pool.page() as page:
         # 使用 cookie 设置 token（替代 localStorage）
         await page.setCookie({'name': 'token', 'value': token, 'url': f'{LOCAL_URL}', 'path': '/', 'httpOnly': False, 'secure': False})
 
@@ -308,12 +370,12 @@ async def get_screenshot(path: str, token: str, width:int = 1000) -> bytes | Non
         await page.goto(f"{LOCAL_URL}{final_path}", waitUntil='networkidle0')
 
         await asyncio.sleep(0.2)
-        
+
         await page.setViewport({'width': width, 'height': 100})
 
         # 获取.main-container的高度
         height = await page.evaluate('document.querySelector(".content").scrollHeight + 50')
-        
+
         # 设置视口大小
         await page.setViewport({'width': width, 'height': int(height)})
 
@@ -341,15 +403,9 @@ async def get_screenshot(path: str, token: str, width:int = 1000) -> bytes | Non
                 wait(5000),
             ]);
         }""")
-        
+
         # 截图
-        screenshot = await page.screenshot({'fullPage': True})
-            
-    finally:
-        # 确保浏览器被关闭
-        if browser:
-            await browser.close()
-    return screenshot
+        return await page.screenshot({'fullPage': True})
 
 async def get_match_user_team(players: list[tuple[str, int]]) -> int | None:
     team1_users = False
@@ -372,6 +428,10 @@ async def get_nickname(steamid: str) -> str:
     base_info = await db_val.get_base_info(steamid)
     return base_info.name if base_info else "未知玩家"
 
+async def get_nicknames(steamids: list[str]) -> dict[str, str]:
+    base_infos = await db_val.get_base_infos(steamids)
+    return {steamid: base_infos[steamid].name if steamid in base_infos else "未知玩家" for steamid in steamids}
+
 async def get_legacy_score(steamid: str, timeStamp: int) -> float | None:
     extra_info = await db_val.get_extra_info(steamid, timeStamp=timeStamp)
     return extra_info.legacyScore if extra_info else None
@@ -1624,11 +1684,12 @@ async def get_match_info(matchId: str = Body(..., embed=True), _ = Depends(get_c
     if not match_detail:
         raise HTTPException(status_code=404, detail="Match not found")
     match_extra = await db_val.get_match_extra(matchId)
+    nicknames = await get_nicknames([player.steamid for player in match_detail])
     async def build_player_info(player: MatchStatsPW) -> MatchPWPlayerInfo:
         display_score, is_predicted = await get_display_pvp_score(player)
         return MatchPWPlayerInfo(
             steamId=player.steamid,
-            nickname=await get_nickname(player.steamid),
+            nickname=nicknames[player.steamid],
             team=player.team,
             rating=player.pwRating,
             we=player.we,
@@ -1768,6 +1829,7 @@ async def get_match_gp_info(matchId: str = Body(..., embed=True), _ = Depends(ge
     if not match_detail:
         raise HTTPException(status_code=404, detail="Match not found")
     match_extra = await db_val.get_match_gp_extra(matchId)
+    nicknames = await get_nicknames([player.steamid for player in match_detail])
     return MatchGPInfo(
         matchId=matchId,
         timestamp=match_detail[0].timeStamp,
@@ -1782,7 +1844,7 @@ async def get_match_gp_info(matchId: str = Body(..., embed=True), _ = Depends(ge
         players=[
             MatchGPPlayerInfo(
                 steamId=player.steamid,
-                nickname=await get_nickname(player.steamid),
+                nickname=nicknames[player.steamid],
                 team=player.team,
                 rating=player.rating,
                 adr=player.adpr,
@@ -2492,6 +2554,25 @@ class MajorHomeworkPersonalResponse(BaseModel):
     categories: list[str] = Field(..., description="Pick categories")
     rows: list[MajorHomeworkPersonalRow] = Field(..., description="Personal homework history")
 
+class MajorHomeworkWhatIfOutcome(BaseModel):
+    winner: str = Field(..., description="Team assumed to win this match")
+    winnerLogo: str | None = Field(None, description="Winner logo URL")
+    chance: float = Field(..., description="Simulated probability of this outcome")
+    probability: float | None = Field(None, description="Probability of passing the homework under this outcome")
+    expected: float | None = Field(None, description="Expected correct picks under this outcome")
+
+class MajorHomeworkWhatIfMatch(BaseModel):
+    teamA: str = Field(..., description="First team")
+    teamB: str = Field(..., description="Second team")
+    outcomes: list[MajorHomeworkWhatIfOutcome] = Field(..., description="Team A wins, then team B wins")
+
+class MajorHomeworkWhatIfResponse(BaseModel):
+    stage: str = Field(..., description="Major stage")
+    uid: str = Field(..., description="QQ user id")
+    probability: float | None = Field(None, description="Current probability of passing the homework")
+    expected: float | None = Field(None, description="Current expected correct picks")
+    matches: list[MajorHomeworkWhatIfMatch] = Field(..., description="Unfinished matches of the current round")
+
 MAJOR_TEAM_LOGOS: dict[str, str] = {
     "Vitality": "vita.png",
     "The MongolZ": "mong.png",
@@ -2783,15 +2864,27 @@ async def _major_playoff_homework_members(state: dict[str, object]) -> list[Majo
             for category in MAJOR_PLAYOFF_CATEGORIES
         }
         score = sum(1 for status in round_statuses.values() if status == "correct")
+        # 待定的轮次显示 major_hw 算出的达标概率，期望为各轮达标概率之和
+        round_probabilities: dict[str, float] = {}
+        for category in MAJOR_PLAYOFF_CATEGORIES:
+            row = rows_by_stage[category].get(uid)
+            if round_statuses[category] == "correct":
+                round_probabilities[category] = 1.0
+            elif round_statuses[category] == "pending" and row is not None and _major_safe_float(row.winrate) is not None:
+                round_probabilities[category] = row.winrate
+            else:
+                round_probabilities[category] = 0.0
         status_parts = [
-            PLAYOFF_STATUS_LABELS[round_statuses[category]]
+            f"{round_probabilities[category]:.0%}"
+            if round_statuses[category] == "pending" and 0.0 < round_probabilities[category] < 1.0
+            else PLAYOFF_STATUS_LABELS[round_statuses[category]]
             for category in MAJOR_PLAYOFF_CATEGORIES
         ]
         players.append(MajorHomeworkRankItem(
             uid=uid,
             avatar=f"https://q1.qlogo.cn/g?b=qq&nk={uid}&s=100",
             probability=None,
-            expected=float(score),
+            expected=sum(round_probabilities.values()),
             score=float(score),
             scoreLabel=" / ".join(status_parts),
             picks=grouped,
@@ -2801,6 +2894,7 @@ async def _major_playoff_homework_members(state: dict[str, object]) -> list[Majo
         players,
         key=lambda player: (
             player.score or 0.0,
+            player.expected or 0.0,
             sum(1 for pick in player.picks.get("冠军", []) if pick.status == "pending"),
             sum(1 for pick in player.picks.get("2强", []) if pick.status == "pending"),
             sum(1 for pick in player.picks.get("4强", []) if pick.status == "pending"),
@@ -2886,19 +2980,9 @@ async def get_rank_list(
     if timeType not in rank_config.allowed_time:
         raise HTTPException(status_code=400, detail="Invalid time type")
     
-    async def get_nickname(steamId: str) -> str:
-        base_info = await db_val.get_base_info(steamId)
-        return base_info.name if base_info else "未知玩家"
     steamids = await db_val.get_group_member_steamid(info.group_id)
-    datas = []
-    for steamid in steamids:
-        try:
-            val = await rank_config.func(steamid, timeType)
-            print(val)
-            datas.append((steamid, val))
-        except NoValueError:
-            pass
-    print(datas)
+    datas = await db_val.get_rank_values(rankName, steamids, timeType)
+    nicknames = await get_nicknames([steamid for steamid, _ in datas])
     datas = sorted(datas, key=lambda x: x[1][0], reverse=rank_config.reversed)
     if len(datas) == 0:
         raise HTTPException(status_code=404, detail="No ranking data found")
@@ -2911,7 +2995,7 @@ async def get_rank_list(
         players=[
             RankItem(
                 steamId=steamid,
-                nickname=await get_nickname(steamid),
+                nickname=nicknames[steamid],
                 value=val[0],
                 count=val[1]
             ) for steamid, val in datas
@@ -2977,22 +3061,26 @@ async def get_major_homework_rank(_ = Depends(get_current_user)):
 async def get_major_homework_history(_ = Depends(get_current_user)):
     async with async_session_factory() as session:
         stmt = (
-            select(MajorHWSnapshot)
-            .where(MajorHWSnapshot.stage == major_stage_name)
-            .order_by(MajorHWSnapshot.uid, MajorHWSnapshot.homework_text, MajorHWSnapshot.match_count)
+            select(MajorHWHistory)
+            .where(MajorHWHistory.stage == major_stage_name)
+            .order_by(MajorHWHistory.uid)
         )
         result = await session.execute(stmt)
-        snapshots = list(result.scalars().all())
+        histories = list(result.scalars().all())
 
     grouped: dict[str, list[MajorHomeworkHistoryPoint]] = {}
-    for snapshot in snapshots:
-        grouped.setdefault(snapshot.uid, []).append(MajorHomeworkHistoryPoint(
-            matchCount=snapshot.match_count,
-            createdAt=snapshot.created_at,
-            homeworkText=snapshot.homework_text,
-            probability=_major_safe_float(snapshot.winrate),
-            expected=_major_safe_float(snapshot.expval),
-        ))
+    for history in histories:
+        rows = HomeworkHistory.decode(history.homework_texts, history.points).rows()
+        grouped[history.uid] = [
+            MajorHomeworkHistoryPoint(
+                matchCount=match_count,
+                createdAt=created_at,
+                homeworkText=homework_text,
+                probability=_major_safe_float(winrate),
+                expected=_major_safe_float(expval),
+            )
+            for match_count, created_at, homework_text, winrate, expval in sorted(rows, key=lambda row: (row[2], row[0]))
+        ]
 
     return MajorHomeworkHistoryResponse(
         stage=major_stage_name,
@@ -3006,6 +3094,53 @@ async def get_major_homework_history(_ = Depends(get_current_user)):
         ],
     )
 
+@app.post(
+    "/api/major/homework/whatif",
+    response_model=MajorHomeworkWhatIfResponse,
+    summary="Get Major homework what-if odds",
+    description="Return the homework's conditional probabilities for both outcomes of every unfinished match in the current round.",
+)
+async def get_major_homework_what_if(
+    uid: str | None = Body(None, embed=True),
+    info: AuthSession = Depends(get_current_user),
+):
+    if not info.user_id:
+        raise HTTPException(status_code=401, detail="未绑定 QQ")
+    if major_hw_config.major_stage == "playoffs":
+        raise HTTPException(status_code=400, detail="Playoffs homework what-if is not supported")
+    target_uid = str(uid).strip() if uid else info.user_id
+    if not target_uid:
+        raise HTTPException(status_code=400, detail="Invalid target user")
+
+    what_if = await homework_what_if(target_uid)
+    if what_if is None:
+        raise HTTPException(status_code=404, detail="No homework or simulation result for the latest match")
+    (probability, expected), outcomes = what_if
+    matches = []
+    for outcome in outcomes:
+        team_a, team_b = outcome["teams"]
+        matches.append(MajorHomeworkWhatIfMatch(
+            teamA=team_a,
+            teamB=team_b,
+            outcomes=[
+                MajorHomeworkWhatIfOutcome(
+                    winner=winner,
+                    winnerLogo=_major_team_logo(winner),
+                    chance=outcome["win_probability"][index],
+                    probability=_major_safe_float(outcome["prob_ge5"][index]),
+                    expected=_major_safe_float(outcome["expected"][index]),
+                )
+                for index, winner in enumerate((team_a, team_b))
+            ],
+        ))
+    return MajorHomeworkWhatIfResponse(
+        stage=major_stage_name,
+        uid=target_uid,
+        probability=_major_safe_float(probability),
+        expected=_major_safe_float(expected),
+        matches=matches,
+    )
+
 @app.post(
     "/api/major/homework/personal",
     response_model=MajorHomeworkPersonalResponse,
@@ -3026,21 +3161,15 @@ async def get_major_homework_personal(
 
     games = json.loads(await local_storage.get(f"hltvresult{major_hw_config.major_event_id}", default="[]"))
     async with async_session_factory() as session:
-        stmt = (
-            select(MajorHWSnapshot)
-            .where(MajorHWSnapshot.stage == major_stage_name)
-            .where(MajorHWSnapshot.uid == target_uid)
-            .order_by(MajorHWSnapshot.match_count, MajorHWSnapshot.created_at, MajorHWSnapshot.homework_text)
-        )
-        result = await session.execute(stmt)
-        snapshots = list(result.scalars().all())
+        history = await session.get(MajorHWHistory, (major_stage_name, target_uid))
+    snapshots = HomeworkHistory.decode(history.homework_texts, history.points).rows() if history else []
 
     rows: list[MajorHomeworkPersonalRow] = []
     previous_probability: float | None = None
     previous_match_count: int | None = None
     previous_homework_text: str | None = None
-    for snapshot in snapshots:
-        probability = _major_safe_float(snapshot.winrate)
+    for match_count, created_at, homework_text, winrate, expval in snapshots:
+        probability = _major_safe_float(winrate)
         probability_change = None
         match_event: tuple[str, str, str] | None = None
         if probability is not None and previous_probability is not None:
@@ -3048,31 +3177,31 @@ async def get_major_homework_personal(
 
         if previous_match_count is None:
             event = "初始作业"
-        elif snapshot.match_count == previous_match_count and snapshot.homework_text != previous_homework_text:
+        elif match_count == previous_match_count and homework_text != previous_homework_text:
             event = "修改作业"
         else:
-            match_event = _major_match_event_detail(games, snapshot.match_count)
-            event = _major_match_event(games, snapshot.match_count) or "初始作业"
+            match_event = _major_match_event_detail(games, match_count)
+            event = _major_match_event(games, match_count) or "初始作业"
 
-        records = _major_records_at_count(games, snapshot.match_count)
+        records = _major_records_at_count(games, match_count)
         rows.append(MajorHomeworkPersonalRow(
-            matchCount=snapshot.match_count,
-            createdAt=snapshot.created_at,
+            matchCount=match_count,
+            createdAt=created_at,
             event=event,
             eventWinner=match_event[0] if match_event else None,
             eventWinnerLogo=_major_team_logo(match_event[0]) if match_event else None,
             eventLoser=match_event[1] if match_event else None,
             eventLoserLogo=_major_team_logo(match_event[1]) if match_event else None,
             eventScore=match_event[2] if match_event else None,
-            homeworkText=snapshot.homework_text,
+            homeworkText=homework_text,
             probability=probability,
             probabilityChange=probability_change,
-            expected=_major_safe_float(snapshot.expval),
-            picks=_major_homework_text_to_grouped_picks(snapshot.homework_text, records),
+            expected=_major_safe_float(expval),
+            picks=_major_homework_text_to_grouped_picks(homework_text, records),
         ))
         previous_probability = probability
-        previous_match_count = snapshot.match_count
-        previous_homework_text = snapshot.homework_text
+        previous_match_count = match_count
+        previous_homework_text = homework_text
 
     return MajorHomeworkPersonalResponse(
         stage=major_stage_name,
@@ -23,6 +23,7 @@ from nonebot_plugin_apscheduler import scheduler
 from ..cs_db_val import db as db_val
 from ..cs_db_upd import db as db_upd
 from ..cs_db_upd import LockingError, TooFrequentError
+from ..cs_db_upd import config as cs_db_upd_config
 from ..cs_server import db as db_server
 from ..cs_server import get_screenshot
 from ..cs_server import _fetch_steam_status_payload
@@ -116,15 +117,15 @@ async def sendMatches(pwlist, gplist, faceitlist):
         for gid in config.cs_group_list:
             token = await db_server.get_bot_token(str(gid))
             for mid in pwlist:
-                screenshot = await get_screenshot(f"/match?id={mid}", token)
+                screenshot = await get_screenshot(f"/match?id={mid}", token, cache_scope="cs")
                 if screenshot:
                     await bot.send_group_msg(group_id=gid, message=Message(MessageSegment.image(screenshot)))
             for mid in gplist:
-                screenshot = await get_screenshot(f"/match-gp?id={mid}", token)
+                screenshot = await get_screenshot(f"/match-gp?id={mid}", token, cache_scope="cs")
                 if screenshot:
                     await bot.send_group_msg(group_id=gid, message=Message(MessageSegment.image(screenshot)))
             for mid in faceitlist:
-                screenshot = await get_screenshot(f"/match-faceit?id={mid}", token)
+                screenshot = await get_screenshot(f"/match-faceit?id={mid}", token, cache_scope="cs")
                 if screenshot:
                     await bot.send_group_msg(group_id=gid, message=Message(MessageSegment.image(screenshot)))
     else:
@@ -180,5 +181,6 @@ driver = get_driver()
 
 @driver.on_startup
 async def startup_queue_processor():
-    """在应用启动时启动队列处理循环"""
-    asyncio.create_task(db.process_update_queue())
+    """在应用启动时启动队列处理循环，多个 worker 并行消费"""
+    for _ in range(cs_db_upd_config.cs_update_workers):
+        asyncio.create_task(db.process_update_queue())
@@ -5,4 +5,4 @@ class Config(BaseModel):
     """Plugin Config Here"""
     cs_steamkey: str
     cs_proxy: str | None = None
-    cs_group_list: list[int]
\ No newline at end of file
+    cs_group_list: list[int]
@@ -10,26 +10,31 @@ from nonebot import require
 from nonebot import logger
 
 require("models")
-from ..models import MajorHW, MajorHWSnapshot, MajorSimulationSnapshot
+from ..models import MajorHW, MajorHWHistory, MajorSimulationSnapshot
 
 require("utils")
 from ..utils import async_session_factory
 from ..utils import local_storage
 from ..utils import getcard
+from ..utils import bump_data_version
 
 from thefuzz import process
 from unicodedata import normalize
 import json
 import asyncio
-import gzip
 import time
+from collections import defaultdict
+from typing import Any
 from pathlib import Path
-from sqlalchemy import update, select
+from sqlalchemy import insert, update, select
 
 from .gen_win_matrix import gen_win_matrix
-from .simulate import simulate
-from .verify import parse_simulation_results, evaluate_combination
-from .playoff_homework import validate_playoff_bracket
+from .simulate import simulate, condition_simulation_result, load_win_matrix_from_csv, what_if_simulation_result
+from .verify import parse_simulation_results, evaluate_combination, evaluate_combinations, SimulationResults
+from .verify import archive_simulation_results, convert_text_results
+from .playoff_homework import validate_playoff_bracket, playoff_category_status, playoff_outcomes
+from .playoff_homework import playoff_category_probability, playoff_round_probabilities
+from .history import HomeworkHistory
 
 from .config import Config
 
@@ -44,6 +49,10 @@ config = get_plugin_config(Config)
 
 
 class DataManager:
+    def __init__(self) -> None:
+        # 作业历史按场次读出、改完再写回，同一场次的写入必须排队，否则并发的快照会互相覆盖
+        self.history_locks: defaultdict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
     async def add_hw(self, uid: str, stage: str, teams: str):
         """
         对应 INSERT OR REPLACE
@@ -60,6 +69,7 @@ class DataManager:
                     expval=0.0
                 )
                 await session.merge(new_hw)
+        bump_data_version("major")
 
     async def get_uid_hw(self, uid: str, stage: str) -> MajorHW | None:
         async with async_session_factory() as session:
@@ -80,6 +90,22 @@ class DataManager:
                     .values(winrate=new_winrate, expval=new_expval)
                 )
                 await session.execute(stmt)
+        bump_data_version("major")
+
+    async def set_uid_vals(self, stage: str, rows: list[tuple[str, float, float]]):
+        """批量写回多份作业的 (uid, winrate, expval)，一次提交"""
+        if not rows:
+            return
+        async with async_session_factory() as session:
+            async with session.begin():
+                await session.execute(
+                    update(MajorHW),
+                    [
+                        {"uid": uid, "stage": stage, "winrate": winrate, "expval": expval}
+                        for uid, winrate, expval in rows
+                    ],
+                )
+        bump_data_version("major")
 
     async def get_all_hw(self, stage: str) -> list[MajorHW]:
         async with async_session_factory() as session:
@@ -96,30 +122,63 @@ class DataManager:
         total_weight: float,
         homework_rows: list[tuple[str, str, float, float]],
         result_size: int = 0,
+        replace_homework: bool = False,
     ) -> None:
+        """
+        保存模拟快照，并把每份作业的 (作业文本, winrate, expval) 追加到作业历史
+        replace_homework 时先清掉该场次已有的作业历史点
+        """
         created_at = int(time.time())
-        async with async_session_factory() as session:
-            async with session.begin():
-                await session.merge(MajorSimulationSnapshot(
-                    stage=stage,
-                    match_count=match_count,
-                    event_id=event_id,
-                    latest_match_id=latest_match_id,
-                    created_at=created_at,
-                    total_weight=total_weight,
-                    result_size=result_size,
-                    result_gzip=b"",
-                ))
-                for uid, homework_text, winrate, expval in homework_rows:
-                    await session.merge(MajorHWSnapshot(
+        async with self.history_locks[stage]:
+            async with async_session_factory() as session:
+                async with session.begin():
+                    await session.merge(MajorSimulationSnapshot(
                         stage=stage,
                         match_count=match_count,
-                        uid=uid,
-                        homework_text=homework_text,
+                        event_id=event_id,
+                        latest_match_id=latest_match_id,
                         created_at=created_at,
-                        winrate=winrate,
-                        expval=expval,
+                        total_weight=total_weight,
+                        result_size=result_size,
+                        result_gzip=b"",
                     ))
+                    await self._append_hw_history(session, stage, match_count, created_at, homework_rows, replace_homework)
+        bump_data_version("major")
+
+    async def _append_hw_history(
+        self,
+        session,
+        stage: str,
+        match_count: int,
+        created_at: int,
+        homework_rows: list[tuple[str, str, float, float]],
+        replace: bool = False,
+    ) -> None:
+        # 一次读出涉及的历史行，在内存里追加后批量写回；调用方持有该场次的 history_locks
+        stmt = select(MajorHWHistory).where(MajorHWHistory.stage == stage)
+        if not replace:
+            stmt = stmt.where(MajorHWHistory.uid.in_([uid for uid, _, _, _ in homework_rows]))
+        existing = {row.uid: row for row in (await session.execute(stmt)).scalars().all()}
+        if not existing and not homework_rows:
+            return
+
+        histories = {uid: HomeworkHistory.decode(row.homework_texts, row.points) for uid, row in existing.items()}
+        if replace:
+            for history in histories.values():
+                history.drop_match_count(match_count)
+        for uid, homework_text, winrate, expval in homework_rows:
+            histories.setdefault(uid, HomeworkHistory()).upsert(match_count, created_at, homework_text, winrate, expval)
+
+        updates: list[dict[str, Any]] = []
+        inserts: list[dict[str, Any]] = []
+        for uid, history in histories.items():
+            homework_texts, points = history.encode()
+            values = {"stage": stage, "uid": uid, "homework_texts": homework_texts, "points": points, "updated_at": created_at}
+            (updates if uid in existing else inserts).append(values)
+        if updates:
+            await session.execute(update(MajorHWHistory), updates)
+        if inserts:
+            await session.execute(insert(MajorHWHistory), inserts)
 
 db = DataManager()
 
@@ -148,15 +207,18 @@ def get_name(wuzzyname):
     match, _ = process.extractOne(wuzzyname, alias2full.keys())
     return alias2full[match]
 
-file_path = "result.txt"
+file_path = "result.bin"
 _simulation_update_task: asyncio.Task | None = None
 _simulation_update_queue: list[list[tuple[str, str, str, str]]] = []
 
 
 logger.info(f"{major_stage_name}, {major_teams}")
-results = {}
+results = SimulationResults()
 total_simulations = 0.0
 try:
+    if not Path(file_path).exists() and Path("result.txt").exists():
+        # 旧版本留下的文本结果，转换一次
+        convert_text_results("result.txt", file_path)
     results, total_simulations = parse_simulation_results(file_path)
     logger.info(f"已加载 {total_simulations} 个模拟结果")
 except:
@@ -176,12 +238,10 @@ def homework_teams_text(teams_json: str) -> str:
     return json.dumps(normalized, ensure_ascii=False, separators=(",", ":"))
 
 
-def save_simulation_result_file(match_count: int, result_bytes: bytes) -> Path:
+def save_simulation_result_file(match_count: int, result_path: str | Path = file_path) -> Path:
     simulation_result_dir.mkdir(parents=True, exist_ok=True)
-    path = simulation_result_dir / f"{match_count}.txt.gz"
-    tmp_path = path.with_suffix(path.suffix + ".tmp")
-    tmp_path.write_bytes(gzip.compress(result_bytes, compresslevel=9))
-    tmp_path.replace(path)
+    path = simulation_result_dir / f"{match_count}.bin.gz"
+    archive_simulation_results(path, result_path)
     return path
 
 
@@ -206,6 +266,7 @@ hwsee = on_command("查看作业", priority=10, block=True)
 hwrank = on_command("作业排名", priority=10, block=True)
 hwdetail = on_command("作业详情", priority=10, block=True)
 allrank = on_command("赛事作业结果", priority=10, block=True)
+hwwhatif = on_command("作业假设", priority=10, block=True)
 hwupd = on_command("更新作业", priority=10, block=True, permission=SUPERUSER)
 simupd = on_command("更新模拟", priority=10, block=True, permission=SUPERUSER)
 hwout = on_command("作业导出", priority=10, block=True, permission=SUPERUSER)
@@ -218,6 +279,11 @@ def to_emoji(val):
     else:
         return "❔"
 
+def playoff_odds_text(val):
+    if val == 1.0 or val == 0.0 or val != val:
+        return ""
+    return f"达标概率 {val:.2%}"
+
 @hwhelp.handle()
 async def hwhelp_funtion():
     if config.major_stage == "playoffs":
@@ -242,69 +308,120 @@ async def hwhelp_funtion():
 查看当前作业排名
 /作业详情 [@某人]
 查看自己或某人的正确率变化截图
+/作业假设 [@某人]
+查看本轮每场比赛两种结果下作业的概率
 /赛事作业结果
 查看赛事整体结果""")
 
+PLAYOFF_STAGES = {"4强": "-quad", "2强": "-semi", "冠军": "-final"}
+
+
+def playoff_start_match_count() -> int:
+    try:
+        with open(teamfile, "r", encoding="utf-8") as f:
+            return int(json.load(f).get("playoff_start_match_count", 33))
+    except Exception:
+        return 33
+
+
+def playoff_rating_source(finished_matches: list[tuple[str, str, str, str]]) -> tuple[Path, list[tuple[str, str, str, str]]] | None:
+    """
+    淘汰赛胜率矩阵的评分来源和需要重放的场次（最新的在前）
+    队伍文件带评分时只重放淘汰赛场次；否则用 stage3 的评分重放整个赛事的场次
+    """
+    try:
+        with open(teamfile, "r", encoding="utf-8") as f:
+            if "systems" in json.load(f):
+                return teamfile, finished_matches[:max(0, len(finished_matches) - playoff_start_match_count())]
+    except Exception:
+        pass
+    previous = Path(".") / "assets" / f"{config.major_name}-stage3.json"
+    if previous.exists():
+        return previous, finished_matches
+    return None
+
+
+async def calc_playoff_vals(uids: set[str] | None = None, win_matrix: dict[str, dict[str, float]] | None = None) -> int:
+    """
+    用胜率矩阵精确计算淘汰赛每份作业各轮达标的概率和猜对数期望并批量写回
+    已经确定对错的轮次直接写 1 / 0，uids 为空时计算所有人，返回作业份数
+    win_matrix 为空时读 win_matrix.csv
+    """
+    result: list[tuple[str, str, str, str]] = json.loads(await local_storage.get(f"hltvresult{config.major_event_id}", default="[]"))
+    result.reverse()
+    playoff_games = result[playoff_start_match_count():][:7]
+    finished = [(get_name(team1), get_name(team2)) for team1, team2, _, _ in playoff_games]
+    rounds = {"4强": finished[:4], "2强": finished[4:6], "冠军": finished[6:7]}
+    winners = {category: [winner for winner, _ in games] for category, games in rounds.items()}
+    eliminated = {loser for _, loser in finished}
+
+    if win_matrix is None:
+        try:
+            win_matrix = load_win_matrix_from_csv("win_matrix.csv")
+        except Exception:
+            logger.exception("未能加载胜率矩阵，淘汰赛按五五开计算")
+            win_matrix = {}
+    outcomes = playoff_outcomes(playoff_matchups, win_matrix, finished)
+    for team, probabilities in sorted(playoff_round_probabilities(outcomes).items(), key=lambda item: -item[1]["冠军"]):
+        logger.info(f"{team} " + " ".join(f"{category} {prob:.4f}" for category, prob in probabilities.items()))
+
+    count = 0
+    for category, suffix in PLAYOFF_STAGES.items():
+        rows = []
+        for member in await db.get_all_hw(major_stage_name + suffix):
+            if uids is not None and member.uid not in uids:
+                continue
+            teams = json.loads(member.teams)
+            prob_pass, expected = playoff_category_probability(teams, category, outcomes)
+            status = playoff_category_status(teams, category, winners, eliminated)
+            if status == "correct":
+                prob_pass = 1.0
+            elif status == "wrong":
+                prob_pass = 0.0
+            rows.append((member.uid, prob_pass, expected))
+        await db.set_uid_vals(major_stage_name + suffix, rows)
+        count = max(count, len(rows))
+    return count
+
+
 async def calc_val(uid: str) -> tuple[float, float] | None:
     if config.major_stage == "playoffs":
-        result: list[tuple[str, str, str, str]] = json.loads(await local_storage.get(f"hltvresult{config.major_event_id}", default="[]"))
-        result.reverse()
-        playoff_start = 33
-        if res := await db.get_uid_hw(uid, major_stage_name + "-quad"):
-            teams = json.loads(res.teams)
-            win_teams = [get_name(team1) for team1, _, _, _ in result[playoff_start:playoff_start + 4]]
-            loss_teams = [get_name(team2) for _, team2, _, _ in result[playoff_start:playoff_start + 4]]
-            if len(result) >= 37:
-                correct = float(sum(1 for team in teams if team in win_teams))
-            else:
-                correct = float('nan')
-            prob_ge2 = float("nan")
-            if sum(1 for team in teams if team in loss_teams) > 2:
-                prob_ge2 = 0.0
-            if sum(1 for team in teams if team in win_teams) >= 2:
-                prob_ge2 = 1.0
-            await db.set_uid_val(uid, major_stage_name + "-quad", prob_ge2, correct)
-        if res := await db.get_uid_hw(uid, major_stage_name + "-semi"):
-            teams = json.loads(res.teams)
-            win_teams = [get_name(team1) for team1, _, _, _ in result[playoff_start + 4:playoff_start + 6]]
-            loss_teams = [get_name(team2) for _, team2, _, _ in result[playoff_start:playoff_start + 6]]
-            if len(result) >= 39:
-                correct = sum(1 for team in teams if team in win_teams)
-            else:
-                correct = float('nan')
-            prob_ge1 = float("nan")
-            if sum(1 for team in teams if team in loss_teams) > 1:
-                prob_ge1 = 0.0
-            if sum(1 for team in teams if team in win_teams) >= 1:
-                prob_ge1 = 1.0
-            await db.set_uid_val(uid, major_stage_name + "-semi", prob_ge1, correct)
-        if res := await db.get_uid_hw(uid, major_stage_name + "-final"):
-            teams = json.loads(res.teams)
-            win_teams = [get_name(team1) for team1, _, _, _ in result[playoff_start + 6:playoff_start + 7]]
-            loss_teams = [get_name(team2) for _, team2, _, _ in result[playoff_start:playoff_start + 7]]
-            if len(result) >= 40:
-                correct = sum(1 for team in teams if team in win_teams)
-            else:
-                correct = float('nan')
-            prob_ge1 = float("nan")
-            if sum(1 for team in teams if team in loss_teams) > 0:
-                prob_ge1 = 0.0
-            if sum(1 for team in teams if team in win_teams) >= 1:
-                prob_ge1 = 1.0
-            await db.set_uid_val(uid, major_stage_name + "-final", prob_ge1, correct)
+        await calc_playoff_vals({uid})
     else:
         if res := await db.get_uid_hw(uid, major_stage_name):
-            teams = json.loads(res.teams)
-            combo = {
-                '3-0': teams[: 2],
-                '3-1/3-2': teams[2: 8],
-                '0-3': teams[8: ]
-            }
+            combo = homework_combo(json.loads(res.teams))
             correct_counts, prob_ge5, expected_value = evaluate_combination(combo, results)
             await db.set_uid_val(uid, major_stage_name, prob_ge5, expected_value)
             return prob_ge5, expected_value
     return None
 
+def homework_combo(teams: list[str]) -> dict[str, list[str]]:
+    return {
+        '3-0': teams[: 2],
+        '3-1/3-2': teams[2: 8],
+        '0-3': teams[8: ]
+    }
+
+
+async def calc_all_val() -> list[tuple[str, str, float, float]]:
+    """
+    重新计算当前阶段所有作业，瑞士轮阶段一次向量化评估并批量写回
+    返回 (uid, 作业文本, winrate, expval) 列表，季后赛阶段返回空列表
+    """
+    if config.major_stage == "playoffs":
+        await calc_playoff_vals()
+        return []
+
+    members = await db.get_all_hw(major_stage_name)
+    combos = [homework_combo(json.loads(member.teams)) for member in members]
+    prob_ge5, expected_value = evaluate_combinations(combos, results)
+    rows = [
+        (member.uid, homework_teams_text(member.teams), float(winrate), float(expval))
+        for member, winrate, expval in zip(members, prob_ge5, expected_value)
+    ]
+    await db.set_uid_vals(major_stage_name, [(uid, winrate, expval) for uid, _, winrate, expval in rows])
+    return rows
+
 @hwadd.handle()
 async def hwadd_function(message: MessageEvent, arg: Message = CommandArg()):
     if len(major_teams) == 0:
@@ -349,9 +466,9 @@ async def hwsee_function(message: MessageEvent):
         if quad := await db.get_uid_hw(uid, major_stage_name + "-quad"):
             if semi := await db.get_uid_hw(uid, major_stage_name + "-semi"):
                 if final := await db.get_uid_hw(uid, major_stage_name + "-final"):
-                    text = f"{to_emoji(quad.winrate)}四强：{json.loads(quad.teams)}\n"
-                    text += f"{to_emoji(semi.winrate)}决赛：{json.loads(semi.teams)}\n"
-                    text += f"{to_emoji(final.winrate)}冠军：{json.loads(final.teams)}\n"
+                    text = f"{to_emoji(quad.winrate)}四强：{json.loads(quad.teams)} {playoff_odds_text(quad.winrate)}\n"
+                    text += f"{to_emoji(semi.winrate)}决赛：{json.loads(semi.teams)} {playoff_odds_text(semi.winrate)}\n"
+                    text += f"{to_emoji(final.winrate)}冠军：{json.loads(final.teams)} {playoff_odds_text(final.winrate)}\n"
                     await hwsee.finish(text.strip())
     else:
         if res := await db.get_uid_hw(uid, major_stage_name):
@@ -396,6 +513,50 @@ async def hwdetail_function(bot: Bot, message: GroupMessageEvent):
         await hwdetail.finish(MessageSegment.image(screenshot))
     await hwdetail.finish("生成作业详情截图失败，请稍后重试")
 
+async def homework_what_if(uid: str) -> tuple[tuple[float, float], list[dict]] | None:
+    """
+    本轮每场未完赛对阵两种结果下该作业的条件概率，直接用上次模拟保存的细分分布
+    没有作业、淘汰赛阶段或模拟结果尚未跟上最新赛果时返回 None
+    """
+    if config.major_stage == "playoffs":
+        return None
+    res = await db.get_uid_hw(uid, major_stage_name)
+    if res is None:
+        return None
+    finished_matches = json.loads(await local_storage.get(f"hltvresult{config.major_event_id}", default="[]"))
+    return await asyncio.to_thread(
+        what_if_simulation_result,
+        teamfile,
+        homework_combo(json.loads(res.teams)),
+        finished_matches,
+        True,
+    )
+
+@hwwhatif.handle()
+async def hwwhatif_function(message: MessageEvent):
+    uid = message.get_user_id()
+    for seg in message.get_message():
+        if seg.type == "at" and seg.data['qq'] != 'all':
+            uid = seg.data['qq']
+    if config.major_stage == "playoffs":
+        await hwwhatif.finish("淘汰赛阶段暂不支持作业假设")
+    if await db.get_uid_hw(uid, major_stage_name) is None:
+        await hwwhatif.finish("该用户未提交作业")
+    what_if = await homework_what_if(uid)
+    if what_if is None:
+        await hwwhatif.finish("模拟结果还没跟上最新赛果，请稍后再试")
+    (prob_ge5, expected_value), outcomes = what_if
+    text = f"当前 >= 5 的概率 = {prob_ge5:.4f}，正确数期望 = {expected_value:.4f}"
+    for outcome in outcomes:
+        team_a, team_b = outcome["teams"]
+        win_a, win_b = outcome["win_probability"]
+        prob_a, prob_b = outcome["prob_ge5"]
+        expected_a, expected_b = outcome["expected"]
+        text += f"\n{team_a} vs {team_b}"
+        text += f"\n  {team_a} 胜({win_a:.1%})：{prob_a:.4f}，期望 {expected_a:.4f}"
+        text += f"\n  {team_b} 胜({win_b:.1%})：{prob_b:.4f}，期望 {expected_b:.4f}"
+    await hwwhatif.finish(text)
+
 @hwupd.handle()
 async def hwupd_function():
     global results
@@ -404,11 +565,9 @@ async def hwupd_function():
     results, total_simulations = parse_simulation_results(file_path)
     logger.info(f"已加载 {total_simulations} 个模拟结果")
 
-    res = await db.get_all_hw(major_stage_name)
     await hwupd.send("开始重新计算所有作业")
-    for member in res:
-        await calc_val(member.uid)
-    await hwupd.finish(f"成功计算 {len(res)} 份作业")
+    rows = await calc_all_val()
+    await hwupd.finish(f"成功计算 {len(rows)} 份作业")
 
 @simupd.handle()
 async def calc_simulate():
@@ -435,7 +594,7 @@ async def _get_major_rank_screenshot(group_id: str | int) -> bytes | None:
         from ..cs_server import get_screenshot
 
         token = await server_db.get_bot_token(str(group_id))
-        return await get_screenshot("/major-homework", token, width=760)
+        return await get_screenshot("/major-homework", token, width=760, cache_scope="major")
     except Exception:
         logger.exception("failed to create major homework ranking screenshot")
         return None
@@ -447,7 +606,7 @@ async def _get_major_detail_screenshot(group_id: str | int, uid: str | int) -> b
         from ..cs_server import get_screenshot
 
         token = await server_db.get_bot_token(str(group_id))
-        return await get_screenshot(f"/major-homework/user/{uid}", token, width=1040)
+        return await get_screenshot(f"/major-homework/user/{uid}", token, width=1040, cache_scope="major")
     except Exception:
         logger.exception("failed to create major homework detail screenshot")
         return None
@@ -476,27 +635,32 @@ async def _run_major_simulation_once(bot: Bot, finished_matches: list[tuple[str,
     await _send_major_groups(bot, "开始重新模拟")
     if finished_matches is None:
         finished_matches = json.loads(await local_storage.get(f"hltvresult{config.major_event_id}", default="[]"))
-    await asyncio.to_thread(gen_win_matrix, str(teamfile),
-                            finished_matches,
-                            newest_first=True)
-    await asyncio.to_thread(simulate, teamfile, "result.txt", finished_matches, True)
+
+    # 新赛果是上次模拟时本轮未完赛的场次时，先用上次的分布取条件结果发出排名，再做完整模拟
+    try:
+        conditioned = await asyncio.to_thread(condition_simulation_result, teamfile, file_path, finished_matches, True)
+    except Exception:
+        logger.exception("failed to condition previous simulation result")
+        conditioned = False
+    if conditioned:
+        results, total_simulations = parse_simulation_results(file_path)
+        homework_rows = await calc_all_val()
+        await _send_major_rank_groups(bot, f"已按上次模拟结果先行更新 {len(homework_rows)} 份作业，完整模拟完成后会再次更新，当前作业排名")
+
+    win_matrix = await asyncio.to_thread(gen_win_matrix, str(teamfile),
+                                         finished_matches,
+                                         newest_first=True)
+    await asyncio.to_thread(simulate, teamfile, file_path, finished_matches, True, win_matrix=win_matrix)
     await _send_major_groups(bot, "新结果模拟完成")
 
     results, total_simulations = parse_simulation_results(file_path)
     logger.info(f"已加载 {total_simulations} 个模拟结果")
 
-    res = await db.get_all_hw(major_stage_name)
-    homework_rows: list[tuple[str, str, float, float]] = []
-    for member in res:
-        calc_result = await calc_val(member.uid)
-        if calc_result is not None:
-            prob_ge5, expected_value = calc_result
-            homework_rows.append((member.uid, homework_teams_text(member.teams), prob_ge5, expected_value))
+    homework_rows = await calc_all_val()
     latest_match_id = None
     if finished_matches and len(finished_matches[0]) >= 4:
         latest_match_id = str(finished_matches[0][3])
-    result_bytes = Path(file_path).read_bytes()
-    save_simulation_result_file(len(finished_matches), result_bytes)
+    save_simulation_result_file(len(finished_matches))
     await db.save_simulation_snapshot(
         stage=major_stage_name,
         event_id=config.major_event_id,
@@ -504,13 +668,13 @@ async def _run_major_simulation_once(bot: Bot, finished_matches: list[tuple[str,
         latest_match_id=latest_match_id,
         total_weight=total_simulations,
         homework_rows=homework_rows,
-        result_size=len(result_bytes),
+        result_size=Path(file_path).stat().st_size,
     )
     logger.info(
         f"已保存 {major_stage_name} 第 {len(finished_matches)} 场后的模拟快照，"
         f"作业快照 {len(homework_rows)} 条"
     )
-    await _send_major_rank_groups(bot, f"成功计算 {len(res)} 份作业，当前作业排名")
+    await _send_major_rank_groups(bot, f"成功计算 {len(homework_rows)} 份作业，当前作业排名")
 
 
 async def _run_queued_major_simulation(bot: Bot):
@@ -551,10 +715,14 @@ async def event_update(event_id, finished_matches: list[tuple[str, str, str, str
         bot = get_bot()
         
         if config.major_stage == "playoffs":
-            res = await db.get_all_hw(major_stage_name + "-quad")
-            for member in res:
-                await calc_val(member.uid)
-            await _send_major_rank_groups(bot, f"成功计算 {len(res)} 份作业，当前作业排名")
+            if finished_matches is None:
+                finished_matches = json.loads(await local_storage.get(f"hltvresult{config.major_event_id}", default="[]"))
+            win_matrix = None
+            if source := playoff_rating_source(finished_matches):
+                rating_file, rating_matches = source
+                win_matrix = await asyncio.to_thread(gen_win_matrix, str(rating_file), rating_matches, newest_first=True, pin_finished=False)
+            count = await calc_playoff_vals(win_matrix=win_matrix.to_dict() if win_matrix is not None else None)
+            await _send_major_rank_groups(bot, f"成功计算 {count} 份作业，当前作业排名")
         else:
             await _enqueue_major_simulation(bot, finished_matches)
 
@@ -1,9 +1,10 @@
+from collections import OrderedDict
 from dataclasses import dataclass, replace
-from functools import lru_cache
+import hashlib
 import json
-import sys
 import csv
 from pathlib import Path
+import numpy as np
 from nonebot import logger
 from thefuzz import process
 
@@ -24,6 +25,7 @@ RECENT_WEIGHT_MAX = 1.25
 UPSET_BONUS_SCALE = 0.9
 UPSET_BONUS_CAP = 1.35
 BO3_CLEAN_WIN_BONUS = 0.05
+WIN_MATRIX_CACHE_SIZE = 16
 
 
 @dataclass(frozen=True)
@@ -50,61 +52,53 @@ class Team:
         return self.id
 
 
-@lru_cache(maxsize=None)
-def win_probability(
-    a: Team,
-    b: Team,
-    sigma: tuple[int, ...] = (SIGMA, SIGMA),
-    hltv_exp: float = HLTV_EXP,
-) -> float:
+@dataclass(frozen=True)
+class WinMatrix:
+    """
+    胜率矩阵
+    Attributes:
+        teams: 队伍名，顺序与队伍文件一致
+        probabilities: probabilities[i, j] 为 teams[i] 单图战胜 teams[j] 的概率，对角线为 nan
+    """
+    teams: tuple[str, ...]
+    probabilities: np.ndarray
+
+    def to_dict(self) -> dict[str, dict[str, float]]:
+        values = self.probabilities.tolist()
+        return {
+            team: {opponent: values[i][j] for j, opponent in enumerate(self.teams) if i != j}
+            for i, team in enumerate(self.teams)
+        }
+
+
+# 按 (队伍文件, 已完赛场次, 模型参数) 的摘要缓存胜率矩阵
+_win_matrix_cache: OrderedDict[str, WinMatrix] = OrderedDict()
+# 每个队伍文件已解析过的赛果：(原始赛果, 解析后的 (胜方, 负方, 比分))，多一场赛果时只解析新增的部分
+_resolved_matches: dict[str, tuple[list[list[str]], list[tuple[str, str, str]]]] = {}
+# 最近一次写出 win_matrix.csv 时的缓存键
+_written_key: str | None = None
+
+
+def calculate_win_matrix_array(teams: list[Team], hltv_exp: float = HLTV_EXP) -> np.ndarray:
     """
-    计算队伍a战胜队伍b的概率
+    一次算出所有队伍之间的胜率，p[i, j] 为 teams[i] 单图战胜 teams[j] 的概率，对角线为 nan
 
     Args:
-        a: 队伍a
-        b: 队伍b
-        sigma: Elo公式的sigma
+        teams: 队伍列表
         hltv_exp: HLTV 比值的指数（原本固定为 0.67）
     """
-    # 获取两支队伍的VRS和HLTV评分
-    v1, h1 = a.rating[0], max(a.rating[1], MIN_RATING)
-    v2, h2 = b.rating[0], max(b.rating[1], MIN_RATING)
-
+    v = np.array([team.rating[0] for team in teams], dtype=np.float64)
+    h = np.maximum(np.array([team.rating[1] for team in teams], dtype=np.float64), MIN_RATING)
     # 使用Elo公式计算VRS胜率
-    d = sigma[0]
-    p_vrs = 1 / (1 + 10 ** ((v2 - v1) / d))
-
-    # ⭐ HLTV 指数已可调
-    p_hltv = 1 / (1 + (h2 / h1) ** hltv_exp)
-
+    p_vrs = 1 / (1 + 10 ** ((v[None, :] - v[:, None]) / SIGMA))
+    p_hltv = 1 / (1 + (h[None, :] / h[:, None]) ** hltv_exp)
     # 加权平均胜率
     p = VRS_WEIGHT * p_vrs + HLTV_WEIGHT * p_hltv
     p /= (VRS_WEIGHT + HLTV_WEIGHT) if (VRS_WEIGHT + HLTV_WEIGHT) > 0 else 1
-
+    np.fill_diagonal(p, np.nan)
     return p
 
 
-def calculate_win_matrix(
-    teams: list[Team],
-    sigma: tuple[int, ...] = (SIGMA, SIGMA),
-    hltv_exp: float = HLTV_EXP,
-) -> dict[str, dict[str, float]]:
-    """
-    计算所有队伍之间的胜率矩阵
-    """
-    win_matrix: dict[str, dict[str, float]] = {}
-
-    for team1 in teams:
-        win_matrix[team1.name] = {}
-        for team2 in teams:
-            if team1 != team2:
-                win_matrix[team1.name][team2.name] = win_probability(
-                    team1, team2, sigma, hltv_exp
-                )
-
-    return win_matrix
-
-
 def print_win_matrix(win_matrix: dict[str, dict[str, float]], teams: list[Team]) -> None:
     """
     打印胜率矩阵
@@ -207,17 +201,26 @@ def apply_finished_matches_to_ratings(
     newest_first: bool = False,
 ) -> list[Team]:
     """Recalculate live ratings from finished match results before simulation."""
-    team_by_name = {team.name: team for team in teams}
     matches = list(reversed(finish_match)) if newest_first else list(finish_match)
 
     def get_name(wuzzyname):
         match, _ = process.extractOne(wuzzyname, alias2full.keys())
         return alias2full[match]
 
+    resolved = [(get_name(winner_raw), get_name(loser_raw), score) for winner_raw, loser_raw, score, _ in matches]
+    return replay_ratings(teams, system_names, resolved)
+
+
+def replay_ratings(
+    teams: list[Team],
+    system_names: list[str],
+    matches: list[tuple[str, str, str]],
+) -> list[Team]:
+    """按时间顺序重放已解析出队名的 (胜方, 负方, 比分)，越新的场次权重越大"""
+    team_by_name = {team.name: team for team in teams}
+
     match_count = len(matches)
-    for match_index, (winner_raw, loser_raw, score, _) in enumerate(matches):
-        winner_name = get_name(winner_raw)
-        loser_name = get_name(loser_raw)
+    for match_index, (winner_name, loser_name, score) in enumerate(matches):
         winner = team_by_name[winner_name]
         loser = team_by_name[loser_name]
         winner_ratings = list(winner.rating)
@@ -253,7 +256,7 @@ def apply_finished_matches_to_ratings(
     return [team_by_name[team.name] for team in teams]
 
 
-def save_win_matrix_to_csv(win_matrix: dict[str, dict[str, float]], teams: list[Team], file_path: str) -> None:
+def save_win_matrix_to_csv(win_matrix: WinMatrix, file_path: str) -> None:
     """
     将胜率矩阵输出为 CSV 文件，方便在 Excel 打开
     """
@@ -261,28 +264,30 @@ def save_win_matrix_to_csv(win_matrix: dict[str, dict[str, float]], teams: list[
         writer = csv.writer(f)
 
         # 写表头
-        header = ["Team"] + [team.name for team in teams]
+        header = ["Team"] + list(win_matrix.teams)
         writer.writerow(header)
 
         # 写每一行
-        for team1 in teams:
-            row = [team1.name]
-            for team2 in teams:
-                if team1 == team2:
+        for i, team1 in enumerate(win_matrix.teams):
+            row = [team1]
+            for j in range(len(win_matrix.teams)):
+                if i == j:
                     row.append("-")
                 else:
-                    row.append(f"{win_matrix[team1.name][team2.name]:.4f}")
+                    row.append(f"{win_matrix.probabilities[i, j]:.4f}")
             writer.writerow(row)
 
 
-def gen_win_matrix(
-    file_path: Path | str,
-    finish_match: list[tuple[str, str, str, str]],
-    newest_first: bool = False,
-):
-
-    teams = load_teams(file_path)
-    system_names = load_system_names(file_path)
+def _resolve_matches(
+    file_digest: str,
+    teams: list[Team],
+    matches: list[list[str]],
+) -> list[tuple[str, str, str]]:
+    """把按时间顺序的原始赛果模糊匹配成队名，和上次调用相同的前缀直接复用"""
+    cached_raw, cached_resolved = _resolved_matches.get(file_digest, ([], []))
+    prefix = 0
+    while prefix < min(len(cached_raw), len(matches)) and cached_raw[prefix] == matches[prefix]:
+        prefix += 1
 
     alias2full = {}
     for team in teams:
@@ -293,26 +298,67 @@ def gen_win_matrix(
         # 模糊匹配得到准确名称
         match, _ = process.extractOne(wuzzyname, alias2full.keys())
         return alias2full[match]
-    teams = apply_finished_matches_to_ratings(
-        teams,
-        system_names,
-        finish_match,
-        alias2full,
-        newest_first=newest_first,
-    )
-    win_probability.cache_clear()
-
-    # ⭐ 现在你可以在这里调节 HLTV 指数
-    win_matrix = calculate_win_matrix(teams, hltv_exp=HLTV_EXP)
-
-    for teama, teamb, _, _ in finish_match:
-        teama = get_name(teama)
-        teamb = get_name(teamb)
-        win_matrix[teama][teamb] = 1
-        win_matrix[teamb][teama] = 0
-        
-
-    # print_win_matrix(win_matrix, teams)
-    save_win_matrix_to_csv(win_matrix, teams, "win_matrix.csv")
-    logger.info("胜率矩阵已保存为 win_matrix.csv")
 
+    resolved = cached_resolved[:prefix] + [
+        (get_name(winner_raw), get_name(loser_raw), score)
+        for winner_raw, loser_raw, score, *_ in matches[prefix:]
+    ]
+    _resolved_matches[file_digest] = (matches, resolved)
+    return resolved
+
+
+def gen_win_matrix(
+    file_path: Path | str,
+    finish_match: list[tuple[str, str, str, str]],
+    newest_first: bool = False,
+    pin_finished: bool = True,
+    output_path: Path | str = "win_matrix.csv",
+) -> WinMatrix:
+    """
+    重放已完赛场次更新评分后生成胜率矩阵，直接返回给模拟器使用，同时导出 win_matrix.csv
+    同样的队伍文件、赛果和模型参数命中缓存；多一场赛果时只解析新增场次的队名，
+    评分的近期权重和场次总数有关，仍按全部场次重放
+    pin_finished 时把已交手的对阵固定为 1 / 0（瑞士轮不会重赛）；淘汰赛可能重赛，需要关掉
+    """
+    global _written_key
+
+    raw = Path(file_path).read_bytes()
+    file_digest = hashlib.sha1(raw).hexdigest()
+    matches = [[str(value) for value in match] for match in (reversed(finish_match) if newest_first else finish_match)]
+    key = hashlib.sha1(json.dumps([
+        file_digest,
+        matches,
+        pin_finished,
+        [VRS_WEIGHT, HLTV_WEIGHT, SIGMA, HLTV_EXP, RATING_K_FACTORS, MIN_RATING],
+        [RECENT_WEIGHT_MIN, RECENT_WEIGHT_MAX, UPSET_BONUS_SCALE, UPSET_BONUS_CAP, BO3_CLEAN_WIN_BONUS],
+    ], ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+    win_matrix = _win_matrix_cache.get(key)
+    if win_matrix is not None:
+        _win_matrix_cache.move_to_end(key)
+    else:
+        teams = load_teams(file_path)
+        system_names = load_system_names(file_path)
+        resolved = _resolve_matches(file_digest, teams, matches)
+        teams = replay_ratings(teams, system_names, resolved)
+
+        # ⭐ 现在你可以在这里调节 HLTV 指数
+        probabilities = calculate_win_matrix_array(teams, hltv_exp=HLTV_EXP)
+        if pin_finished:
+            index = {team.name: i for i, team in enumerate(teams)}
+            for winner, loser, _ in resolved:
+                probabilities[index[winner], index[loser]] = 1
+                probabilities[index[loser], index[winner]] = 0
+        # 缓存里的矩阵会交给所有调用方，设为只读防止被改坏
+        probabilities.setflags(write=False)
+        win_matrix = WinMatrix(tuple(team.name for team in teams), probabilities)
+        _win_matrix_cache[key] = win_matrix
+        while len(_win_matrix_cache) > WIN_MATRIX_CACHE_SIZE:
+            _win_matrix_cache.popitem(last=False)
+
+    # print_win_matrix(win_matrix.to_dict(), teams)
+    if key != _written_key or not Path(output_path).exists():
+        save_win_matrix_to_csv(win_matrix, str(output_path))
+        _written_key = key
+        logger.info(f"胜率矩阵已保存为 {output_path}")
+    return win_matrix
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import json
+
+import numpy as np
+
+# 作业概率历史的列式存储：每个阶段每个用户一行（MajorHWHistory），
+# 作业文本去重后存成 JSON 列表，每个点是一条定长记录，按场次追加
+HISTORY_POINT_DTYPE = np.dtype([
+    ("match_count", "<i4"),
+    ("created_at", "<i8"),
+    ("homework", "<i4"),  # homework_texts 中的下标
+    ("winrate", "<f8"),
+    ("expval", "<f8"),
+])
+
+
+class HomeworkHistory:
+    """
+    一个用户在一个阶段的作业概率历史
+    同一场次同一份作业只保留最新的点，改作业时同一场次会有多个点
+    """
+    def __init__(self, homework_texts: list[str] | None = None, points: np.ndarray | None = None):
+        self.homework_texts: list[str] = homework_texts or []
+        self.points = points if points is not None else np.zeros(0, dtype=HISTORY_POINT_DTYPE)
+
+    @classmethod
+    def decode(cls, homework_texts: str, points: bytes) -> HomeworkHistory:
+        return cls(json.loads(homework_texts), np.frombuffer(points, dtype=HISTORY_POINT_DTYPE).copy())
+
+    def encode(self) -> tuple[str, bytes]:
+        return (
+            json.dumps(self.homework_texts, ensure_ascii=False, separators=(",", ":")),
+            self.points.tobytes(),
+        )
+
+    def upsert(self, match_count: int, created_at: int, homework_text: str, winrate: float, expval: float) -> None:
+        if homework_text not in self.homework_texts:
+            self.homework_texts.append(homework_text)
+        homework = self.homework_texts.index(homework_text)
+        same = np.nonzero((self.points["match_count"] == match_count) & (self.points["homework"] == homework))[0]
+        if len(same):
+            self.points[same[-1]] = (match_count, created_at, homework, winrate, expval)
+            return
+        point = np.array([(match_count, created_at, homework, winrate, expval)], dtype=HISTORY_POINT_DTYPE)
+        self.points = np.concatenate([self.points, point])
+
+    def drop_match_count(self, match_count: int) -> None:
+        self.points = self.points[self.points["match_count"] != match_count]
+
+    def rows(self) -> list[tuple[int, int, str, float, float]]:
+        """按 (场次, 时间, 作业文本) 排好的 (场次, 时间, 作业文本, winrate, expval)"""
+        rows = [
+            (match_count, created_at, self.homework_texts[homework], winrate, expval)
+            for match_count, created_at, homework, winrate, expval in self.points.tolist()
+        ]
+        return sorted(rows, key=lambda row: (row[0], row[1], row[2]))
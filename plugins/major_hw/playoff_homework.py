@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+from math import comb
+
 PLAYOFF_CATEGORIES = ["4强", "2强", "冠军"]
 PLAYOFF_CATEGORY_SLOTS = {
     "4强": 4,
@@ -11,6 +13,14 @@ PLAYOFF_STATUS_LABELS = {
     "wrong": "错",
     "pending": "待定",
 }
+# 八强赛、半决赛、决赛的赛制（BO 几），决定单图胜率如何换算成系列赛胜率
+PLAYOFF_BEST_OF = {
+    "4强": 3,
+    "2强": 3,
+    "冠军": 5,
+}
+
+PlayoffOutcome = tuple[float, dict[str, frozenset[str]]]
 
 
 def playoff_category_status(
@@ -71,3 +81,96 @@ def validate_playoff_bracket(
     if final[0] not in semi:
         return "冠军必须从你选择的2强队伍中产生"
     return None
+
+
+def series_win_probability(p: float, best_of: int) -> float:
+    # 先拿到 need 张图的一方获胜：对输掉的图数求和
+    need = best_of // 2 + 1
+    total = 0.0
+    for lost in range(need):
+        total += comb(need - 1 + lost, lost) * p ** need * (1 - p) ** lost
+    return total
+
+
+def _map_win_probability(win_matrix: dict[str, dict[str, float]], team_a: str, team_b: str) -> float:
+    if team_b in win_matrix.get(team_a, {}):
+        return win_matrix[team_a][team_b]
+    if team_a in win_matrix.get(team_b, {}):
+        return 1 - win_matrix[team_b][team_a]
+    # 胜率矩阵里没有的对阵按五五开
+    return 0.5
+
+
+def playoff_outcomes(
+    matchups: list[list[str]],
+    win_matrix: dict[str, dict[str, float]],
+    finished: list[tuple[str, str]],
+) -> list[PlayoffOutcome]:
+    """
+    精确枚举淘汰赛 7 场比赛的全部结果（最多 128 种）
+    matchups 为八强对阵，1/2 场胜者、3/4 场胜者分别在半决赛相遇
+    finished 为已完赛的 (胜方, 负方)，对应场次按确定结果处理
+    返回 (概率, {轮次: 该轮胜者集合}) 列表，概率为 0 的分支不返回
+    """
+    decided = set(finished)
+
+    def match_probability(team_a: str, team_b: str, category: str) -> float:
+        if (team_a, team_b) in decided:
+            return 1.0
+        if (team_b, team_a) in decided:
+            return 0.0
+        return series_win_probability(_map_win_probability(win_matrix, team_a, team_b), PLAYOFF_BEST_OF[category])
+
+    def play(pairs: list[tuple[str, str]], category: str) -> list[tuple[float, list[str]]]:
+        branches: list[tuple[float, list[str]]] = [(1.0, [])]
+        for team_a, team_b in pairs:
+            p = match_probability(team_a, team_b, category)
+            next_branches = []
+            for prob, winners in branches:
+                if p > 0:
+                    next_branches.append((prob * p, winners + [team_a]))
+                if p < 1:
+                    next_branches.append((prob * (1 - p), winners + [team_b]))
+            branches = next_branches
+        return branches
+
+    outcomes: list[PlayoffOutcome] = []
+    for quad_prob, quad in play([(team_a, team_b) for team_a, team_b in matchups], "4强"):
+        for semi_prob, semi in play([(quad[0], quad[1]), (quad[2], quad[3])], "2强"):
+            for final_prob, final in play([(semi[0], semi[1])], "冠军"):
+                outcomes.append((quad_prob * semi_prob * final_prob, {
+                    "4强": frozenset(quad),
+                    "2强": frozenset(semi),
+                    "冠军": frozenset(final),
+                }))
+    return outcomes
+
+
+def playoff_round_probabilities(outcomes: list[PlayoffOutcome]) -> dict[str, dict[str, float]]:
+    # 每支队伍进入各轮（4强 / 2强 / 冠军）的概率
+    probabilities: dict[str, dict[str, float]] = {}
+    for prob, winners in outcomes:
+        for category, teams in winners.items():
+            for team in teams:
+                team_probabilities = probabilities.setdefault(team, {name: 0.0 for name in PLAYOFF_CATEGORIES})
+                team_probabilities[category] += prob
+    return probabilities
+
+
+def playoff_category_probability(
+    teams: list[str],
+    category: str,
+    outcomes: list[PlayoffOutcome],
+) -> tuple[float, float]:
+    """返回 (该轮作业猜对数达到要求的概率, 猜对数期望)"""
+    slots = PLAYOFF_CATEGORY_SLOTS[category]
+    required = (slots + 1) // 2
+    picked = set(teams[:slots])
+    prob_pass = 0.0
+    expected = 0.0
+    for prob, winners in outcomes:
+        correct = len(picked & winners[category])
+        expected += prob * correct
+        if correct >= required:
+            prob_pass += prob
+    return prob_pass, expected
@@ -2,31 +2,167 @@ from __future__ import annotations
 
 import json
 import csv
-from dataclasses import dataclass
-from functools import lru_cache, partial
+from dataclasses import dataclass, field
+from functools import lru_cache
 from multiprocessing import Pool
 from os import cpu_count
 import os
 from time import perf_counter_ns
-from typing import TYPE_CHECKING, Callable
+from typing import TYPE_CHECKING
 import numpy as np
 from nonebot import logger
 from pathlib import Path
 import tqdm
 
+from .verify import SimulationResults, evaluate_combination_given, write_simulation_results
+
 MAX_SIMULATION_CORES = int(os.getenv("MAJOR_SIMULATION_CORES", "1"))
 MAX_EXACT_OUTCOMES = int(os.getenv("MAJOR_EXACT_OUTCOMES", "200000"))
+MAX_EXACT_REMAINING_MATCHES = int(os.getenv("MAJOR_EXACT_REMAINING_MATCHES", "20"))
 DEFAULT_SIMULATION_ITERATIONS = int(os.getenv("MAJOR_SIMULATION_ITERATIONS", "200000"))
+BRANCH_RESULT_PATH = "result_branches.npz"
 SWISS_TOTAL_MATCHES = 33
+VECTOR_CHUNK_SIZE = 20000
+
+# 第四轮和第五轮的优先级匹配模式（组内排名下标）
+PRIORITY_PATTERNS = [
+    [(0,5), (1,4), (2,3)],  # 1v6 2v5 3v4
+    [(0,5), (1,3), (2,4)],  # 1v6 2v4 3v5
+    [(0,4), (1,5), (2,3)],  # 1v5 2v6 3v4
+    [(0,4), (1,3), (2,5)],  # 1v5 2v4 3v6
+    [(0,3), (1,5), (2,4)],  # 1v4 2v6 3v5
+    [(0,3), (1,4), (2,5)],  # 1v4 2v5 3v6
+    [(0,5), (1,2), (3,4)],  # 1v6 2v3 4v5
+    [(0,4), (1,2), (3,5)],  # 1v5 2v3 4v6
+    [(0,2), (1,5), (3,4)],  # 1v3 2v6 4v5
+    [(0,2), (1,4), (3,5)],  # 1v3 2v5 4v6
+    [(0,3), (1,2), (4,5)],  # 1v4 2v3 5v6
+    [(0,2), (1,3), (4,5)],  # 1v3 2v4 5v6
+    [(0,1), (2,5), (3,4)],  # 1v2 3v6 4v5
+    [(0,1), (2,4), (3,5)],  # 1v2 3v5 4v6
+    [(0,1), (2,3), (4,5)],  # 1v2 3v4 5v6
+]
+
+# 进程池工作进程的模拟状态 (引擎, 初始胜场, 初始负场, 已交手矩阵, 起始轮次, 本轮未完赛对阵)，
+# 由 _init_worker 在每个进程启动时设置一次，任务只传迭代次数和随机种子
+_worker_state: tuple[VectorSwiss, np.ndarray, np.ndarray, np.ndarray, int, list[tuple[int, int]]] | None = None
+
+
+def _init_worker(
+    engine: VectorSwiss,
+    wins0: np.ndarray,
+    losses0: np.ndarray,
+    faced0: np.ndarray,
+    start_round: int,
+    branch_matches: list[tuple[int, int]],
+) -> None:
+    global _worker_state
+    _worker_state = (engine, wins0, losses0, faced0, start_round, branch_matches)
+
+
+def _worker_task(args: tuple[int, np.random.SeedSequence]) -> tuple[int, np.ndarray, np.ndarray, np.ndarray]:
+    iterations, seed = args
+    assert _worker_state is not None
+    return (iterations, *_simulate_histogram(*_worker_state, iterations, np.random.default_rng(seed)))
+
+
+def _merge_histograms(keys: np.ndarray, counts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """合并 (k, m) 键数组里相同的行，次数相加"""
+    if len(keys) == 0:
+        return keys, counts
+    order = np.lexsort(keys.T[::-1])
+    keys = keys[order]
+    counts = counts[order]
+    starts = np.nonzero(np.concatenate([[True], (keys[1:] != keys[:-1]).any(axis=1)]))[0]
+    return keys[starts], np.add.reduceat(counts, starts)
+
+
+class _Histogram:
+    """
+    累加 _simulate_histogram 的结果
+    新块先攒着，攒到和已合并部分一样多时再一起合并，避免每来一块就把全部组合重排一遍
+    """
+    def __init__(self, n_teams: int) -> None:
+        self.team_counts = np.zeros((3, n_teams), dtype=np.int64)
+        self.keys = np.zeros((0, 4), dtype=np.uint64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self._pending: list[tuple[np.ndarray, np.ndarray]] = []
+        self._pending_rows = 0
+
+    def add(self, team_counts: np.ndarray, keys: np.ndarray, counts: np.ndarray) -> None:
+        self.team_counts += team_counts
+        self._pending.append((keys, counts))
+        self._pending_rows += len(keys)
+        if self._pending_rows >= len(self.keys):
+            self.merge()
+
+    def merge(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if self._pending:
+            self.keys, self.counts = _merge_histograms(
+                np.concatenate([self.keys] + [keys for keys, _ in self._pending]),
+                np.concatenate([self.counts] + [counts for _, counts in self._pending]),
+            )
+            self._pending = []
+            self._pending_rows = 0
+        return self.team_counts, self.keys, self.counts
+
+
+def _simulate_histogram(
+    engine: VectorSwiss,
+    wins0: np.ndarray,
+    losses0: np.ndarray,
+    faced0: np.ndarray,
+    start_round: int,
+    branch_matches: list[tuple[int, int]],
+    n: int,
+    rng: np.random.Generator,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    模拟 n 次，返回 (3, 队伍数) 的 3-0 / 晋级 / 0-3 次数，
+    以及 (k, 4) 的组合键 (本轮各场胜方位, 3-0 掩码, 3-1/3-2 掩码, 0-3 掩码) 和对应次数
+    """
+    n_teams = len(wins0)
+    shifts = np.arange(n_teams, dtype=np.uint64)
+    team_counts = np.zeros((3, n_teams), dtype=np.int64)
+    all_keys = [np.zeros((0, 4), dtype=np.uint64)]
+    all_counts = [np.zeros(0, dtype=np.int64)]
+    done = 0
+    while done < n:
+        size = min(VECTOR_CHUNK_SIZE, n - done)
+        masks, branch_bits = engine.run(wins0, losses0, faced0, start_round, size, rng, branch_matches)
+        done += size
+        team_counts += ((masks[:, :, None] >> shifts) & np.uint64(1)).sum(axis=0).astype(np.int64)
+
+        # 能拼进一个 uint64 时按一维去重，比按行去重快得多
+        if 3 * n_teams + len(branch_matches) <= 64:
+            packed = (
+                masks[:, 0]
+                | (masks[:, 1] << np.uint64(n_teams))
+                | (masks[:, 2] << np.uint64(2 * n_teams))
+                | (branch_bits << np.uint64(3 * n_teams))
+            )
+            packed_keys, counts = np.unique(packed, return_counts=True)
+            full = np.uint64((1 << n_teams) - 1)
+            keys = np.stack([
+                packed_keys >> np.uint64(3 * n_teams),
+                packed_keys & full,
+                (packed_keys >> np.uint64(n_teams)) & full,
+                (packed_keys >> np.uint64(2 * n_teams)) & full,
+            ], axis=1)
+        else:
+            keys, counts = _merge_histograms(np.column_stack([branch_bits, masks]), np.ones(size, dtype=np.int64))
+        all_keys.append(keys)
+        all_counts.append(counts.astype(np.int64))
 
-def _batch_task(args: tuple[Callable[[int], dict], int]) -> tuple[int, dict]:
-    batch_func, iterations = args
-    return iterations, batch_func(iterations)
+    keys, counts = _merge_histograms(np.concatenate(all_keys), np.concatenate(all_counts))
+    return team_counts, keys, counts
 
 if TYPE_CHECKING:
     from collections.abc import Generator
     from pathlib import Path
 
+    from .gen_win_matrix import WinMatrix
+
 @dataclass(frozen=True)
 class Team:
     """
@@ -85,11 +221,13 @@ class Result:
         advanced: 3-1/3-2战绩的次数
         zero_three: 0-3战绩的次数
         pickem_results: 记录每个预测组合的出现次数
+        branch_results: 按当前轮未完赛各场的胜方细分的组合次数，键为 (胜方位, 3-0, 晋级, 0-3)
     """
     three_zero: int
     advanced: int
     zero_three: int
     pickem_results: dict[tuple[int, int, int], float]
+    branch_results: dict[tuple[int, int, int, int], float] = field(default_factory=dict)
 
     @staticmethod
     def new() -> Result:
@@ -115,12 +253,16 @@ class Result:
         combined_pickems = {}
         for key in set(self.pickem_results.keys()) | set(other.pickem_results.keys()):
             combined_pickems[key] = self.pickem_results.get(key, 0) + other.pickem_results.get(key, 0)
+        combined_branches = dict(self.branch_results)
+        for branch_key, count in other.branch_results.items():
+            combined_branches[branch_key] = combined_branches.get(branch_key, 0) + count
 
         return Result(
             three_zero=self.three_zero + other.three_zero,
             advanced=self.advanced + other.advanced,
             zero_three=self.zero_three + other.zero_three,
-            pickem_results=combined_pickems
+            pickem_results=combined_pickems,
+            branch_results=combined_branches,
         )
 
 
@@ -314,27 +456,9 @@ class SwissSystem:
                 return matches
 
             # 第四轮和第五轮：使用优先级模式
-            # 定义优先级匹配模式
-            priority_patterns = [
-                [(0,5), (1,4), (2,3)],  # 1v6 2v5 3v4
-                [(0,5), (1,3), (2,4)],  # 1v6 2v4 3v5
-                [(0,4), (1,5), (2,3)],  # 1v5 2v6 3v4
-                [(0,4), (1,3), (2,5)],  # 1v5 2v4 3v6
-                [(0,3), (1,5), (2,4)],  # 1v4 2v6 3v5
-                [(0,3), (1,4), (2,5)],  # 1v4 2v5 3v6
-                [(0,5), (1,2), (3,4)],  # 1v6 2v3 4v5
-                [(0,4), (1,2), (3,5)],  # 1v5 2v3 4v6
-                [(0,2), (1,5), (3,4)],  # 1v3 2v6 4v5
-                [(0,2), (1,4), (3,5)],  # 1v3 2v5 4v6
-                [(0,3), (1,2), (4,5)],  # 1v4 2v3 5v6
-                [(0,2), (1,3), (4,5)],  # 1v3 2v4 5v6
-                [(0,1), (2,5), (3,4)],  # 1v2 3v6 4v5
-                [(0,1), (2,4), (3,5)],  # 1v2 3v5 4v6
-                [(0,1), (2,3), (4,5)],  # 1v2 3v4 5v6
-            ]
 
             # 尝试每种优先级模式
-            for pattern in priority_patterns:
+            for pattern in PRIORITY_PATTERNS:
                 matches = []
                 used_indices = set()
                 valid_pattern = True
@@ -436,6 +560,325 @@ def load_win_matrix_from_csv(file_path: Path | str) -> dict[str, dict[str, float
     return win_matrix
 
 
+def _pair_greedy(faced: np.ndarray, rows: np.ndarray, pair_i: np.ndarray, pair_j: np.ndarray) -> None:
+    """
+    向量化的贪心配对：组内从高排名开始，依次找排名最低且未交手的对手
+    faced: (M, n, n) 组内两两是否交手过；只处理 rows 指定的赛事，结果写入 pair_i / pair_j
+    """
+    n = faced.shape[1]
+    used = np.zeros((len(rows), n), dtype=bool)
+    count = np.zeros(len(rows), dtype=np.int64)
+    sub = faced[rows]
+    for i in range(n):
+        active = ~used[:, i]
+        for j in range(n - 1, i, -1):
+            ok = active & ~used[:, j] & ~sub[:, i, j]
+            if not ok.any():
+                continue
+            hit = np.nonzero(ok)[0]
+            pair_i[rows[hit], count[hit]] = i
+            pair_j[rows[hit], count[hit]] = j
+            count[hit] += 1
+            used[hit, i] = True
+            used[hit, j] = True
+            active &= ~ok
+
+
+def _pair_group(faced: np.ndarray, round_num: int, first_round: bool) -> tuple[np.ndarray, np.ndarray]:
+    """
+    对 M 个赛事中同一战绩组（已按组内排名排好序）批量配对，规则与 SwissSystem.round_matches 一致
+    返回两个 (M, n // 2) 的组内下标数组，未配上的位置为 -1
+    """
+    m, n = faced.shape[0], faced.shape[1]
+    pair_i = np.full((m, n // 2), -1, dtype=np.int64)
+    pair_j = np.full((m, n // 2), -1, dtype=np.int64)
+    if n < 2:
+        return pair_i, pair_j
+    if first_round:
+        # 第一轮：按种子排名，前半对后半
+        half = np.arange(n // 2)
+        pair_i[:] = half
+        pair_j[:] = half + n // 2
+        return pair_i, pair_j
+    if round_num == 1:
+        half = np.arange(n // 2)
+        pair_i[:] = half
+        pair_j[:] = n - 1 - half
+        return pair_i, pair_j
+    if round_num <= 3:
+        _pair_greedy(faced, np.arange(m), pair_i, pair_j)
+        return pair_i, pair_j
+
+    pending = np.ones(m, dtype=bool)
+    for pattern in PRIORITY_PATTERNS:
+        if any(i >= n or j >= n for i, j in pattern):
+            continue
+        valid = pending.copy()
+        for i, j in pattern:
+            valid &= ~faced[:, i, j]
+        if valid.any():
+            for k, (i, j) in enumerate(pattern):
+                pair_i[valid, k] = i
+                pair_j[valid, k] = j
+            pending &= ~valid
+    if pending.any():
+        _pair_greedy(faced, np.nonzero(pending)[0], pair_i, pair_j)
+    return pair_i, pair_j
+
+
+def _pack_record(wins: int, losses: int, faced: int, offset: int = 0) -> int:
+    """
+    精确遍历用的单队状态：低 2 位胜场，再 2 位负场，再 5 位 Buchholz 偏移（+16），
+    其余位是交手过且仍在比赛中的队伍 id 掩码
+    """
+    return wins | (losses << 2) | ((offset + 16) << 4) | (faced << 9)
+
+
+def _unpack_record(record: int) -> tuple[int, int, int, int]:
+    return record & 3, (record >> 2) & 3, record >> 9, ((record >> 4) & 31) - 16
+
+
+def _retire_teams(records: list[int], finished_mask: int) -> None:
+    """
+    已晋级/淘汰的队伍不会再参与配对，战绩也不会再变：
+    把它们从其他队伍的交手掩码里移到 Buchholz 偏移中，再清掉它们自己的交手记录，
+    这样只在已结束队伍的对阵历史上不同的状态可以合并
+    """
+    diffs = {}
+    opponents = finished_mask
+    while opponents:
+        low = opponents & -opponents
+        team_id = low.bit_length() - 1
+        wins, losses, _, _ = _unpack_record(records[team_id])
+        diffs[low] = wins - losses
+        records[team_id] = _pack_record(wins, losses, 0)
+        opponents ^= low
+    for team_id, record in enumerate(records):
+        gone = (record >> 9) & finished_mask
+        if not gone:
+            continue
+        wins, losses, faced, offset = _unpack_record(record)
+        while gone:
+            low = gone & -gone
+            offset += diffs[low]
+            gone ^= low
+        records[team_id] = _pack_record(wins, losses, faced & ~finished_mask, offset)
+
+
+def _match_outcome(state: tuple[int, ...], winner: int, loser: int, p: float) -> tuple[float, int, int, int, int, int, tuple[int, int, int]]:
+    """一场比赛某一方获胜后的概率、两队新状态、因此结束的队伍掩码及其对竞猜组合的贡献"""
+    wins_w, losses_w, faced_w, offset_w = _unpack_record(state[winner])
+    wins_l, losses_l, faced_l, offset_l = _unpack_record(state[loser])
+    finished_mask = 0
+    three_zero_mask = advanced_mask = zero_three_mask = 0
+    if wins_w + 1 == 3:
+        finished_mask |= 1 << winner
+        if losses_w == 0:
+            three_zero_mask |= 1 << winner
+        else:
+            advanced_mask |= 1 << winner
+    if losses_l + 1 == 3:
+        finished_mask |= 1 << loser
+        if wins_l == 0:
+            zero_three_mask |= 1 << loser
+    return (
+        p,
+        winner,
+        _pack_record(wins_w + 1, losses_w, faced_w | (1 << loser), offset_w),
+        loser,
+        _pack_record(wins_l, losses_l + 1, faced_l | (1 << winner), offset_l),
+        finished_mask,
+        (three_zero_mask, advanced_mask, zero_three_mask),
+    )
+
+
+def _compact_pickem_key(state: tuple[int, ...]) -> tuple[int, int, int]:
+    three_zero_mask = 0
+    advanced_mask = 0
+    zero_three_mask = 0
+    for team_id, record in enumerate(state):
+        wins, losses, _, _ = _unpack_record(record)
+        if wins == 3:
+            if losses == 0:
+                three_zero_mask |= 1 << team_id
+            else:
+                advanced_mask |= 1 << team_id
+        elif losses == 3 and wins == 0:
+            zero_three_mask |= 1 << team_id
+    return three_zero_mask, advanced_mask, zero_three_mask
+
+
+def _compact_round_matches(state: tuple[int, ...], seeds: list[int]) -> list[tuple[int, int]]:
+    """在压缩状态上按 SwissSystem.round_matches 的规则配对下一轮，返回队伍 id 对"""
+    unpacked = [_unpack_record(record) for record in state]
+    remaining = [team_id for team_id, (wins, losses, _, _) in enumerate(unpacked) if wins < 3 and losses < 3]
+    if not remaining:
+        return []
+    round_num = min(unpacked[team_id][0] + unpacked[team_id][1] for team_id in remaining) + 1
+    if round_num > 5:
+        return []
+
+    diffs = [wins - losses for wins, losses, _, _ in unpacked]
+    groups: dict[int, list[tuple[int, int, int]]] = {}
+    eligible_count = 0
+    for team_id in remaining:
+        wins, losses, faced, buchholz = unpacked[team_id]
+        if wins + losses != round_num - 1:
+            continue
+        eligible_count += 1
+        opponents = faced
+        while opponents:
+            low = opponents & -opponents
+            buchholz += diffs[low.bit_length() - 1]
+            opponents ^= low
+        groups.setdefault(diffs[team_id], []).append((-buchholz, seeds[team_id], team_id))
+
+    if round_num == 1 and len(groups.get(0, [])) == eligible_count:
+        teams = [team_id for _, _, team_id in sorted(groups[0], key=lambda item: item[1])]
+        return list(zip(teams, teams[len(teams) // 2:]))
+
+    matches: list[tuple[int, int]] = []
+    for diff in sorted(groups, reverse=True):
+        teams = [team_id for _, _, team_id in sorted(groups[diff])]
+        n = len(teams)
+        if n < 2:
+            continue
+        if round_num == 1:
+            matches.extend((teams[i], teams[n - 1 - i]) for i in range(n // 2))
+            continue
+
+        def has_faced(i: int, j: int) -> bool:
+            return bool(unpacked[teams[i]][2] >> teams[j] & 1)
+
+        if round_num > 3:
+            pattern = next(
+                (pattern for pattern in PRIORITY_PATTERNS if all(i < n and j < n and not has_faced(i, j) for i, j in pattern)),
+                None,
+            )
+            if pattern is not None:
+                matches.extend((teams[i], teams[j]) for i, j in pattern)
+                continue
+
+        used: set[int] = set()
+        for i in range(n):
+            if i in used:
+                continue
+            for j in range(n - 1, i, -1):
+                if j not in used and not has_faced(i, j):
+                    matches.append((teams[i], teams[j]))
+                    used.add(i)
+                    used.add(j)
+                    break
+    return matches
+
+
+class VectorSwiss:
+    """
+    向量化的瑞士轮蒙特卡洛引擎，一次推进一整批赛事
+    每个赛事的状态是整数数组：胜场、负场、两两是否交手（Buchholz 由此现算）
+    配对规则、BO1/BO3 判定和 3-0 / 晋级 / 0-3 的统计口径与 SwissSystem 一致
+    """
+    def __init__(self, seeds: np.ndarray, win_prob: np.ndarray, force_bo3: bool):
+        self.seeds = seeds.astype(np.int64)
+        self.win_prob = win_prob
+        self.force_bo3 = force_bo3
+        self.n_teams = len(seeds)
+        self.bits = np.left_shift(np.uint64(1), np.arange(self.n_teams, dtype=np.uint64))
+
+    def _play_round(self, wins: np.ndarray, losses: np.ndarray, faced: np.ndarray, round_num: int, rng: np.random.Generator) -> None:
+        m, n = wins.shape
+        diff = wins.astype(np.int64) - losses
+        eligible = (wins < 3) & (losses < 3) & (wins + losses == round_num - 1)
+        if not eligible.any():
+            return
+        buchholz = np.einsum("mij,mj->mi", faced, diff)
+        # 排序键：战绩组从高到低，组内 Buchholz 从高到低，再按初始种子
+        key = (4 - diff) * (1 << 20) + (512 - buchholz) * 64 + self.seeds
+        key = np.where(eligible, key, np.iinfo(np.int64).max)
+        order = np.argsort(key, axis=1, kind="stable")
+
+        diffs = list(range(4, -5, -1))
+        counts = np.stack([(eligible & (diff == d)).sum(axis=1) for d in diffs], axis=1)
+        # 各战绩组人数编码成一个整数再去重，比按行 unique 快得多
+        packed = (counts << (np.arange(len(diffs), dtype=np.int64) * 6)).sum(axis=1)
+        _, first_index, inverse = np.unique(packed, return_index=True, return_inverse=True)
+        signatures = counts[first_index]
+        inverse = inverse.reshape(-1)
+
+        match_rows: list[np.ndarray] = []
+        match_a: list[np.ndarray] = []
+        match_b: list[np.ndarray] = []
+        for sig_index, signature in enumerate(signatures):
+            rows = np.nonzero(inverse == sig_index)[0]
+            total = int(signature.sum())
+            first_round = round_num == 1 and int(signature[diffs.index(0)]) == total
+            offset = 0
+            for size in signature:
+                size = int(size)
+                if size == 0:
+                    continue
+                slots = order[rows, offset:offset + size]
+                offset += size
+                group_faced = faced[rows[:, None, None], slots[:, :, None], slots[:, None, :]]
+                pair_i, pair_j = _pair_group(group_faced, round_num, first_round)
+                valid = pair_i >= 0
+                r_idx, k_idx = np.nonzero(valid)
+                match_rows.append(rows[r_idx])
+                match_a.append(slots[r_idx, pair_i[r_idx, k_idx]])
+                match_b.append(slots[r_idx, pair_j[r_idx, k_idx]])
+        if not match_rows:
+            return
+        rows = np.concatenate(match_rows)
+        team_a = np.concatenate(match_a)
+        team_b = np.concatenate(match_b)
+
+        p = self.win_prob[team_a, team_b]
+        if np.isnan(p).any():
+            raise KeyError("胜率矩阵中缺少部分对阵的数据，请检查 win_matrix.csv。")
+        is_bo3 = self.force_bo3 | (wins[rows, team_a] == 2) | (losses[rows, team_a] == 2)
+        random_values = rng.random((len(rows), 3))
+        first_map = p > random_values[:, 0]
+        second_map = p > random_values[:, 1]
+        bo3_win = np.where(first_map != second_map, p > random_values[:, 2], first_map)
+        team_a_win = np.where(is_bo3, bo3_win, first_map)
+
+        winner = np.where(team_a_win, team_a, team_b)
+        loser = np.where(team_a_win, team_b, team_a)
+        wins[rows, winner] += 1
+        losses[rows, loser] += 1
+        faced[rows, team_a, team_b] = True
+        faced[rows, team_b, team_a] = True
+
+    def run(
+        self,
+        wins0: np.ndarray,
+        losses0: np.ndarray,
+        faced0: np.ndarray,
+        start_round: int,
+        n: int,
+        rng: np.random.Generator,
+        branch_matches: list[tuple[int, int]] | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        从同一个初始状态模拟 n 次，返回 (n, 3) 的 uint64 掩码 (3-0, 3-1/3-2, 0-3)，
+        以及每次模拟中 branch_matches 各场是否由前一支队伍获胜的位掩码
+        """
+        wins = np.repeat(wins0[None, :], n, axis=0).astype(np.int8)
+        losses = np.repeat(losses0[None, :], n, axis=0).astype(np.int8)
+        faced = np.repeat(faced0[None, :, :], n, axis=0)
+        branch_bits = np.zeros(n, dtype=np.uint64)
+        for round_num in range(start_round, 6):
+            self._play_round(wins, losses, faced, round_num, rng)
+            if round_num == start_round and branch_matches:
+                for k, (team_a, _) in enumerate(branch_matches):
+                    branch_bits |= (wins[:, team_a] > wins0[team_a]).astype(np.uint64) << np.uint64(k)
+        three_zero = ((wins == 3) & (losses == 0)) * self.bits
+        advanced = ((wins == 3) & (losses > 0)) * self.bits
+        zero_three = ((wins != 3) & (wins == 0)) * self.bits
+        masks = np.stack([three_zero.sum(axis=1), advanced.sum(axis=1), zero_three.sum(axis=1)], axis=1).astype(np.uint64)
+        return masks, branch_bits
+
+
 @dataclass
 class Simulation:
     """
@@ -448,9 +891,15 @@ class Simulation:
     teams: set[Team]
     win_matrix: dict[str, dict[str, float]]
 
-    def __init__(self, filepath: Path | str, win_matrix_path: Path | str = "win_matrix.csv") -> None:
+    def __init__(
+        self,
+        filepath: Path | str,
+        win_matrix_path: Path | str = "win_matrix.csv",
+        win_matrix: WinMatrix | None = None,
+    ) -> None:
         """
         从JSON文件加载数据并初始化模拟器
+        传入 gen_win_matrix 返回的胜率矩阵时直接使用，不再读 win_matrix.csv
         """
         with open(filepath) as file:
             data = json.load(file)
@@ -480,7 +929,7 @@ class Simulation:
             self.alias2full[team_name] = team_name
             for alias in team_data.get("alias", []):
                 self.alias2full[alias] = team_name
-        self.win_matrix = load_win_matrix_from_csv(win_matrix_path)
+        self.win_matrix = win_matrix.to_dict() if win_matrix is not None else load_win_matrix_from_csv(win_matrix_path)
         self.force_bo3 = data.get("match_format") == "bo3" or bool(data.get("all_bo3", False))
 
         ss = SwissSystem(
@@ -518,96 +967,178 @@ class Simulation:
             ss.apply_result(winner, loser)
         return ss
 
-    @staticmethod
-    def _clone_state(ss: SwissSystem) -> SwissSystem:
-        return SwissSystem(
-            win_matrix=ss.win_matrix,
-            records={
-                team: Record(
-                    wins=record.wins,
-                    losses=record.losses,
-                    teams_faced=set(record.teams_faced),
-                )
-                for team, record in ss.records.items()
-            },
-            remaining=set(ss.remaining),
-            force_bo3=ss.force_bo3,
-        )
-
-    @staticmethod
-    def _next_round_num(ss: SwissSystem) -> int:
-        return ss.next_round_num()
-
-    @staticmethod
-    def _record_pickem_result(ss: SwissSystem, all_combinations: dict[tuple[int, int, int], float], weight: float = 1.0) -> None:
-        three_zero_mask = 0
-        advanced_mask = 0
-        zero_three_mask = 0
-
-        for team, record in ss.records.items():
-            if record.wins == 3:
-                if record.losses == 0:
-                    three_zero_mask |= 1 << team.id
-                else:
-                    advanced_mask |= 1 << team.id
-            elif record.losses == 3 and record.wins == 0:
-                zero_three_mask |= 1 << team.id
-
-        key = (three_zero_mask, advanced_mask, zero_three_mask)
-        all_combinations[key] = all_combinations.get(key, 0.0) + weight
+    def _compact_state(self, ss: SwissSystem) -> tuple[int, ...]:
+        """把 SwissSystem 状态压成可哈希的整数元组，见 _pack_record"""
+        wins, losses, faced, _ = self._state_arrays(ss)
+        state = []
+        for team_id in range(len(wins)):
+            faced_mask = sum(1 << int(opp) for opp in np.nonzero(faced[team_id])[0])
+            state.append(_pack_record(int(wins[team_id]), int(losses[team_id]), faced_mask))
+        finished_mask = 0
+        for team_id, record in enumerate(state):
+            if record & 3 == 3 or (record >> 2) & 3 == 3:
+                finished_mask |= 1 << team_id
+        _retire_teams(state, finished_mask)
+        return tuple(state)
 
     def exact(self, finished_matches: list[tuple[str, str, str, str]] | None = None, newest_first: bool = False, max_outcomes: int = MAX_EXACT_OUTCOMES) -> tuple[dict[Team, Result], int] | None:
-        all_combinations: dict[tuple[int, int, int], float] = {}
-        leaf_count = 0
-        initial_state = self._initial_state(finished_matches, newest_first)
-
-        class TooManyExactOutcomes(Exception):
-            pass
-
-        def enumerate_round(ss: SwissSystem, weight: float) -> None:
-            nonlocal leaf_count
-            round_num = self._next_round_num(ss)
-            if not ss.remaining or round_num > 5:
-                leaf_count += 1
-                if leaf_count > max_outcomes:
-                    raise TooManyExactOutcomes
-                self._record_pickem_result(ss, all_combinations, weight)
-                return
-
-            matches = ss.round_matches(round_num)
-            if not matches:
-                leaf_count += 1
-                if leaf_count > max_outcomes:
-                    raise TooManyExactOutcomes
-                self._record_pickem_result(ss, all_combinations, weight)
-                return
-
-            def enumerate_match(index: int, current: SwissSystem, current_weight: float) -> None:
-                if index >= len(matches):
-                    enumerate_round(current, current_weight)
-                    return
-                team_a, team_b = matches[index]
-                team_a_win_p = current.match_win_probability(team_a, team_b)
-
-                a_wins = self._clone_state(current)
-                a_wins.apply_result(team_a, team_b)
-                enumerate_match(index + 1, a_wins, current_weight * team_a_win_p)
-
-                b_wins = self._clone_state(current)
-                b_wins.apply_result(team_b, team_a)
-                enumerate_match(index + 1, b_wins, current_weight * (1 - team_a_win_p))
-
-            enumerate_match(0, ss, weight)
+        """
+        按轮精确遍历所有结果，相同的状态合并权重后再往下展开
+        状态同时记下本轮未完赛各场的胜方位（与随机模拟的 branch_results 相同），
+        只有本轮胜方相同的状态才合并，结果的 branch_results 是精确的细分分布
+        状态数超过 max_outcomes 时放弃并返回 None
+        返回 (结果, 展开的状态数)
+        """
+        branch_combinations: dict[tuple[int, int, int, int], float] = {}
+        teams = self._teams_by_id()
+        seeds = [team.seed for team in teams]
+        engine = self._vector_engine()
+        map_p = engine.win_prob.tolist()
+
+        initial_state = self._compact_state(self._initial_state(finished_matches, newest_first))
+        states: dict[tuple[int, tuple[int, ...]], float] = {(0, initial_state): 1.0}
+        first_round = True
+        expanded = 0
+        while states:
+            next_states: dict[tuple[int, tuple[int, ...]], float] = {}
+            for (branch, state), weight in states.items():
+                expanded += 1
+                matches = _compact_round_matches(state, seeds)
+                if not matches:
+                    combo_key = (branch, *_compact_pickem_key(state))
+                    branch_combinations[combo_key] = branch_combinations.get(combo_key, 0.0) + weight
+                    continue
 
-        try:
-            enumerate_round(initial_state, 1.0)
-        except TooManyExactOutcomes:
-            return None
+                # 同一轮每队只打一场，各场的两种结果互不影响，可以先算好每种结果带来的改动
+                base_key = _compact_pickem_key(state)
+                remaining_count = sum(1 for record in state if record & 3 != 3 and (record >> 2) & 3 != 3)
+                options = []
+                for team_a, team_b in matches:
+                    p = map_p[team_a][team_b]
+                    if p != p:
+                        raise KeyError(
+                            f"胜率矩阵中缺少 {teams[team_a].name} vs {teams[team_b].name} 的数据，请检查 win_matrix.csv。"
+                        )
+                    wins_a, losses_a, _, _ = _unpack_record(state[team_a])
+                    if self.force_bo3 or wins_a == 2 or losses_a == 2:
+                        p = p * p * (3 - 2 * p)
+                    options.append((
+                        _match_outcome(state, team_a, team_b, p),
+                        _match_outcome(state, team_b, team_a, 1 - p),
+                    ))
+
+                all_options = (1 << len(options)) - 1
+                for outcome in range(1 << len(options)):
+                    # outcome 第 k 位为 0 表示第 k 场前一支队伍获胜，第一轮就是本轮未完赛的场次
+                    outcome_branch = ~outcome & all_options if first_round else branch
+                    records = list(state)
+                    outcome_weight = weight
+                    newly_finished = 0
+                    three_zero_mask, advanced_mask, zero_three_mask = base_key
+                    for k, option in enumerate(options):
+                        p, winner, winner_record, loser, loser_record, finished_mask, key = option[outcome >> k & 1]
+                        outcome_weight *= p
+                        records[winner] = winner_record
+                        records[loser] = loser_record
+                        if finished_mask:
+                            newly_finished |= finished_mask
+                            three_zero_mask |= key[0]
+                            advanced_mask |= key[1]
+                            zero_three_mask |= key[2]
+                    if outcome_weight == 0.0:
+                        continue
+                    if bin(newly_finished).count("1") == remaining_count:
+                        # 所有队伍都已结束，直接计入组合
+                        combo_key = (outcome_branch, three_zero_mask, advanced_mask, zero_three_mask)
+                        branch_combinations[combo_key] = branch_combinations.get(combo_key, 0.0) + outcome_weight
+                        continue
+                    if newly_finished:
+                        _retire_teams(records, newly_finished)
+                    next_state = (outcome_branch, tuple(records))
+                    next_states[next_state] = next_states.get(next_state, 0.0) + outcome_weight
+            if len(next_states) > max_outcomes:
+                return None
+            states = next_states
+            first_round = False
 
+        all_combinations: dict[tuple[int, int, int], float] = {}
+        for (_, three_zero_mask, advanced_mask, zero_three_mask), weight in branch_combinations.items():
+            key = (three_zero_mask, advanced_mask, zero_three_mask)
+            all_combinations[key] = all_combinations.get(key, 0.0) + weight
         results = {team: Result.new() for team in self.teams}
         if self.teams:
-            results[list(self.teams)[0]].pickem_results = all_combinations
-        return results, leaf_count
+            first = results[list(self.teams)[0]]
+            first.pickem_results = all_combinations
+            first.branch_results = branch_combinations
+        return results, expanded
+
+    def _finished_pairs(self, finished_matches: list[tuple[str, str, str, str]] | None, newest_first: bool = False) -> list[tuple[int, int]]:
+        """已完赛场次按时间顺序转成 (胜方 id, 负方 id)"""
+        matches = list(reversed(finished_matches or [])) if newest_first else list(finished_matches or [])
+        return [
+            (self._team_from_name(winner_raw).id, self._team_from_name(loser_raw).id)
+            for winner_raw, loser_raw, _, _ in matches
+        ]
+
+    def _branch_matches(self, ss: SwissSystem) -> list[tuple[int, int]]:
+        """当前轮还没打的对阵（队伍 id），随机模拟按这些场次的胜方细分结果"""
+        return _compact_round_matches(self._compact_state(ss), [team.seed for team in self._teams_by_id()])
+
+    def _teams_by_id(self) -> list[Team]:
+        return sorted(self.teams, key=lambda team: team.id)
+
+    def _vector_engine(self) -> VectorSwiss:
+        teams = self._teams_by_id()
+        seeds = np.array([team.seed for team in teams], dtype=np.int64)
+        win_prob = np.full((len(teams), len(teams)), np.nan)
+        ss = SwissSystem(self.win_matrix, {}, set(), self.force_bo3)
+        for team_a in teams:
+            for team_b in teams:
+                if team_a.id == team_b.id:
+                    continue
+                try:
+                    win_prob[team_a.id, team_b.id] = ss.map_win_probability(team_a, team_b)
+                except KeyError:
+                    pass
+        return VectorSwiss(seeds, win_prob, self.force_bo3)
+
+    def _state_arrays(self, ss: SwissSystem) -> tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+        """把 SwissSystem 状态转成向量引擎的初始数组，并给出下一轮轮次"""
+        n_teams = len(self.teams)
+        wins = np.zeros(n_teams, dtype=np.int8)
+        losses = np.zeros(n_teams, dtype=np.int8)
+        faced = np.zeros((n_teams, n_teams), dtype=bool)
+        for team, record in ss.records.items():
+            wins[team.id] = record.wins
+            losses[team.id] = record.losses
+            for opp in record.teams_faced:
+                faced[team.id, opp.id] = True
+        return wins, losses, faced, ss.next_round_num()
+
+    def _histogram_results(self, team_counts: np.ndarray, keys: np.ndarray, counts: np.ndarray) -> dict[Team, Result]:
+        """把 _simulate_histogram 的计数数组转回每个队伍的 Result，组合分布放在第一个队伍上"""
+        results = {team: Result.new() for team in self.teams}
+        three_zero, advanced, zero_three = team_counts.tolist()
+        for team in self.teams:
+            results[team].three_zero = three_zero[team.id]
+            results[team].advanced = advanced[team.id]
+            results[team].zero_three = zero_three[team.id]
+
+        combination_keys, combination_counts = _merge_histograms(keys[:, 1:], counts)
+        first = results[list(self.teams)[0]]
+        first.pickem_results = dict(zip(map(tuple, combination_keys.tolist()), combination_counts.tolist()))
+        first.branch_results = dict(zip(map(tuple, keys.tolist()), counts.tolist()))
+        return results
+
+    def _worker_args(
+        self,
+        finished_matches: list[tuple[str, str, str, str]] | None = None,
+        newest_first: bool = False,
+    ) -> tuple[VectorSwiss, np.ndarray, np.ndarray, np.ndarray, int, list[tuple[int, int]]]:
+        """构建 _simulate_histogram 需要的引擎和初始状态"""
+        initial_state = self._initial_state(finished_matches, newest_first)
+        wins0, losses0, faced0, start_round = self._state_arrays(initial_state)
+        return self._vector_engine(), wins0, losses0, faced0, start_round, self._branch_matches(initial_state)
 
     def batch(
         self,
@@ -615,16 +1146,15 @@ class Simulation:
         show_progress: bool = True,
         finished_matches: list[tuple[str, str, str, str]] | None = None,
         newest_first: bool = False,
+        rng: np.random.Generator | None = None,
     ) -> dict[Team, Result]:
         """
-        运行n次模拟
+        在当前进程运行n次模拟，每次向量化推进 VECTOR_CHUNK_SIZE 个赛事
         """
-        results = {team: Result.new() for team in self.teams}
-        all_combinations: dict[tuple[int, int, int], int] = {}
-
-        # 预生成随机数
-        random_values = np.random.random(n * 10)  # 预生成足够的随机数
-        random_index = 0
+        if rng is None:
+            rng = np.random.default_rng()
+        worker_args = self._worker_args(finished_matches, newest_first)
+        histogram = _Histogram(len(self.teams))
 
         progress_bar = None
         if show_progress and n > 0:
@@ -638,43 +1168,19 @@ class Simulation:
             )
 
         try:
-            for _ in range(n):
-                ss = self._initial_state(finished_matches, newest_first)
-
-                ss.simulate_tournament()
-
-                # 记录当前模拟的结果
-                three_zero_mask = 0
-                advanced_mask = 0
-                zero_three_mask = 0
-
-                for team, record in ss.records.items():
-                    if record.wins == 3:
-                        if record.losses == 0:
-                            results[team].three_zero += 1
-                            three_zero_mask |= 1 << team.id
-                        else:
-                            results[team].advanced += 1
-                            advanced_mask |= 1 << team.id
-                    elif record.wins == 0:
-                        results[team].zero_three += 1
-                        zero_three_mask |= 1 << team.id
-
-                # 记录这个组合
-                key = (three_zero_mask, advanced_mask, zero_three_mask)
-                all_combinations[key] = all_combinations.get(key, 0) + 1
-
+            done = 0
+            while done < n:
+                size = min(VECTOR_CHUNK_SIZE, n - done)
+                histogram.add(*_simulate_histogram(*worker_args, size, rng))
+                done += size
                 if progress_bar:
-                    progress_bar.update(1)
-                    progress_bar.set_postfix({'当前组合数': len(all_combinations)})
+                    progress_bar.update(size)
+                    progress_bar.set_postfix({'当前组合数': len(histogram.keys)})
         finally:
             if progress_bar:
                 progress_bar.close()
 
-        # 将组合结果添加到第一个队伍的结果中
-        results[list(self.teams)[0]].pickem_results = all_combinations
-
-        return results
+        return self._histogram_results(*histogram.merge())
 
     def run(
         self,
@@ -682,20 +1188,24 @@ class Simulation:
         k: int,
         finished_matches: list[tuple[str, str, str, str]] | None = None,
         newest_first: bool = False,
+        seed: int | None = None,
     ) -> dict[Team, Result]:
         """
         使用k个进程运行n次模拟
+        每个进程启动时只接收一次引擎和初始状态，任务之间用 SeedSequence 派生的独立随机流，
+        返回的是计数数组而不是 Result 字典
         """
         if k <= 1:
-            return self.batch(n, show_progress=True, finished_matches=finished_matches, newest_first=newest_first)
-
-        def _run_batch_chunk(iterations: int) -> tuple[int, dict[Team, Result]]:
-            return iterations, self.batch(iterations, show_progress=False)
-
-        # 计算每个任务块的迭代次数，块越小进度刷新越频繁
-        chunk_estimate = n // (k * 10) if k > 0 else n
-        chunk_size = max(1, min(5000, max(1, chunk_estimate)))
+            return self.batch(
+                n,
+                show_progress=True,
+                finished_matches=finished_matches,
+                newest_first=newest_first,
+                rng=np.random.default_rng(seed),
+            )
 
+        # 每个进程分到几个任务，既能均衡负载也能刷新进度；任务太小会浪费向量化
+        chunk_size = max(1, min(VECTOR_CHUNK_SIZE, max(VECTOR_CHUNK_SIZE // 4, -(-n // (k * 4)))))
         tasks: list[int] = []
         remaining_iterations = n
         while remaining_iterations > 0:
@@ -706,14 +1216,9 @@ class Simulation:
         if not tasks:
             return {team: Result.new() for team in self.teams}
 
-        def _merge_results(acc: dict[Team, Result], result: dict[Team, Result]) -> dict[Team, Result]:
-            for team, team_result in result.items():
-                acc[team] += team_result
-            return acc
-
-        merged_results = {team: Result.new() for team in self.teams}
+        seeds = np.random.SeedSequence(seed).spawn(len(tasks))
+        histogram = _Histogram(len(self.teams))
 
-        # 创建进度条
         with tqdm.tqdm(
             total=n,
             desc="模拟进度",
@@ -722,23 +1227,13 @@ class Simulation:
             position=0,
             leave=True
         ) as pbar:
-            # 创建进程池
-            with Pool(k) as pool:
-                # 使用imap处理任务，这样可以实时获取结果
-                batch_func = partial(
-                    self.batch,
-                    show_progress=False,
-                    finished_matches=finished_matches,
-                    newest_first=newest_first,
-                )
-                task_args = [(batch_func, iterations) for iterations in tasks]
-                for iterations, result in pool.imap_unordered(_batch_task, task_args):
-                    _merge_results(merged_results, result)
-                    # 更新进度条
+            with Pool(k, initializer=_init_worker, initargs=self._worker_args(finished_matches, newest_first)) as pool:
+                for iterations, team_counts, keys, counts in pool.imap_unordered(_worker_task, zip(tasks, seeds)):
+                    histogram.add(team_counts, keys, counts)
                     pbar.update(iterations)
-                    pbar.set_postfix({'当前组合数': len(merged_results[list(self.teams)[0]].pickem_results)})
+                    pbar.set_postfix({'当前组合数': len(histogram.keys)})
 
-        return merged_results
+        return self._histogram_results(*histogram.merge())
 
 
 def format_results(
@@ -763,13 +1258,27 @@ def format_results(
     out = [f"已进行 {n:,} 次瑞士轮{mode}"]
     total_weight = float(n) if denominator is None else denominator
 
+    all_combinations = list(results.values())[0].pickem_results
+    if Path(output_path).suffix == ".bin":
+        # 二进制格式，见 verify.py
+        team_names = [team.name for team in sorted(results.keys(), key=lambda team: team.id)]
+        keys = np.array(list(all_combinations.keys()), dtype=np.uint64).reshape(-1, 3)
+        write_simulation_results(output_path, SimulationResults(
+            three_zero=keys[:, 0],
+            advanced=keys[:, 1],
+            zero_three=keys[:, 2],
+            weights=np.array(list(all_combinations.values()), dtype=np.float64),
+            team_to_bit={name: 1 << idx for idx, name in enumerate(team_names)},
+        ), header={"mode": mode, "n": n})
+        out.append(f"\n运行耗时: {run_time:.4f} 秒")
+        return out
+
     def format_weight(value: float) -> str:
         if abs(value - round(value)) < 1e-9:
             return str(int(round(value)))
         return f"{value:.12g}"
 
     # 输出组合统计
-    all_combinations = list(results.values())[0].pickem_results
     sorted_combinations = sorted(all_combinations.items(), key=lambda x: x[1], reverse=True)
     with open(output_path, 'w', encoding='utf-8') as f:
         team_names = [team.name for team in sorted(results.keys(), key=lambda team: team.id)]
@@ -786,11 +1295,169 @@ def format_results(
     return out
 
 
+def save_branch_results(
+    branch_path: Path | str,
+    simulation: Simulation,
+    finished_matches: list[tuple[str, str, str, str]] | None,
+    newest_first: bool,
+    branch_results: dict[tuple[int, int, int, int], float],
+) -> None:
+    """
+    保存按当前轮未完赛各场胜方细分的组合分布，供下一场赛果出来时直接取条件分布
+    """
+    initial_state = simulation._initial_state(finished_matches, newest_first)
+    branch_matches = simulation._branch_matches(initial_state)
+    items = list(branch_results.items())
+    np.savez(
+        branch_path,
+        teams=np.array([team.name for team in simulation._teams_by_id()]),
+        finished=np.array(simulation._finished_pairs(finished_matches, newest_first), dtype=np.int64).reshape(-1, 2),
+        matches=np.array(branch_matches, dtype=np.int64).reshape(-1, 2),
+        keys=np.array([key for key, _ in items], dtype=np.uint64).reshape(-1, 4),
+        weights=np.array([weight for _, weight in items], dtype=np.float64),
+    )
+
+
+def _load_branch_results(
+    simulation: Simulation,
+    branch_path: Path | str,
+    finished: list[tuple[int, int]],
+) -> tuple[list[tuple[int, int]], np.ndarray, np.ndarray] | None:
+    """读取 save_branch_results 保存的细分分布，队伍或已完赛场次对不上时返回 None"""
+    with np.load(branch_path) as data:
+        stored_teams = data["teams"].tolist()
+        stored_finished = data["finished"].tolist()
+        matches = [tuple(pair) for pair in data["matches"].tolist()]
+        keys = data["keys"]
+        weights = data["weights"]
+
+    if stored_teams != [team.name for team in simulation._teams_by_id()]:
+        return None
+    if [list(pair) for pair in finished] != stored_finished:
+        return None
+    return matches, keys, weights
+
+
+def what_if_simulation_result(
+    file_path: Path | str,
+    combo: dict[str, list[str]],
+    finished_matches: list[tuple[str, str, str, str]] | None = None,
+    newest_first: bool = False,
+    branch_path: Path | str = BRANCH_RESULT_PATH,
+) -> tuple[tuple[float, float], list[dict]] | None:
+    """
+    用上次模拟保存的细分分布回答“本轮某场比赛某队赢了会怎样”，不重新模拟
+    返回 ((当前 >=5 概率, 当前正确数期望), 每场本轮未完赛对阵的条件结果)，
+    每场为 {"teams": (A, B), "win_probability": (A 胜概率, B 胜概率),
+    "prob_ge5": (A 胜时, B 胜时), "expected": (A 胜时, B 胜时)}
+    没有可用的细分分布时返回 None
+    """
+    if not Path(branch_path).exists():
+        return None
+    simulation = Simulation(file_path)
+    loaded = _load_branch_results(simulation, branch_path, simulation._finished_pairs(finished_matches, newest_first))
+    if loaded is None:
+        return None
+    matches, keys, weights = loaded
+
+    teams = simulation._teams_by_id()
+    results = SimulationResults(
+        three_zero=keys[:, 1],
+        advanced=keys[:, 2],
+        zero_three=keys[:, 3],
+        weights=weights,
+        team_to_bit={team.name: 1 << team.id for team in teams},
+    )
+    # 条件依次为：全部、每场 A 胜、每场 B 胜
+    team_a_won = [((keys[:, 0] >> np.uint64(index)) & np.uint64(1)) == np.uint64(1) for index in range(len(matches))]
+    conditions = np.array([np.ones(len(keys), dtype=bool)] + team_a_won + [~won for won in team_a_won]).reshape(-1, len(keys))
+    prob_ge5, expected_value, condition_weight = evaluate_combination_given(combo, results, conditions)
+
+    total_weight = condition_weight[0]
+    outcomes = []
+    for index, (team_a, team_b) in enumerate(matches):
+        a_row = 1 + index
+        b_row = 1 + len(matches) + index
+        outcomes.append({
+            "teams": (teams[team_a].name, teams[team_b].name),
+            "win_probability": (
+                float(condition_weight[a_row] / total_weight) if total_weight else 0.0,
+                float(condition_weight[b_row] / total_weight) if total_weight else 0.0,
+            ),
+            "prob_ge5": (float(prob_ge5[a_row]), float(prob_ge5[b_row])),
+            "expected": (float(expected_value[a_row]), float(expected_value[b_row])),
+        })
+    return (float(prob_ge5[0]), float(expected_value[0])), outcomes
+
+
+def condition_simulation_result(
+    file_path: Path | str,
+    output_path: Path | str = "result.txt",
+    finished_matches: list[tuple[str, str, str, str]] | None = None,
+    newest_first: bool = False,
+    branch_path: Path | str = BRANCH_RESULT_PATH,
+) -> bool:
+    """
+    新赛果正好是上次模拟时本轮未完赛的某一场时，从上次保存的细分分布里取出与赛果一致的部分，
+    直接写出新的结果文件，并更新细分分布供本轮下一场使用
+    不满足条件（没有保存、队伍或已完赛场次对不上）时返回 False
+    """
+    if not finished_matches or not Path(branch_path).exists():
+        return False
+    start = perf_counter_ns()
+    simulation = Simulation(file_path)
+    finished = simulation._finished_pairs(finished_matches, newest_first)
+    loaded = _load_branch_results(simulation, branch_path, finished[:-1])
+    if loaded is None:
+        return False
+    matches, keys, weights = loaded
+    winner, loser = finished[-1]
+    if (winner, loser) in matches:
+        index = matches.index((winner, loser))
+        team_a_won = 1
+    elif (loser, winner) in matches:
+        index = matches.index((loser, winner))
+        team_a_won = 0
+    else:
+        return False
+
+    selected = ((keys[:, 0] >> np.uint64(index)) & np.uint64(1)) == np.uint64(team_a_won)
+    if not selected.any():
+        return False
+    keys = keys[selected]
+    weights = weights[selected]
+
+    # 去掉这一场对应的位，剩下的场次继续留作下一次取条件分布
+    low = keys[:, 0] & np.uint64((1 << index) - 1)
+    high = (keys[:, 0] >> np.uint64(index + 1)) << np.uint64(index)
+    keys = np.column_stack([low | high, keys[:, 1:]])
+    branch_results: dict[tuple[int, int, int, int], float] = {}
+    for key, weight in zip(map(tuple, keys.tolist()), weights.tolist()):
+        branch_results[key] = branch_results.get(key, 0.0) + weight
+    all_combinations: dict[tuple[int, int, int], float] = {}
+    for (_, three_zero_mask, advanced_mask, zero_three_mask), weight in branch_results.items():
+        key = (three_zero_mask, advanced_mask, zero_three_mask)
+        all_combinations[key] = all_combinations.get(key, 0.0) + weight
+
+    results = {team: Result.new() for team in simulation.teams}
+    results[list(simulation.teams)[0]].pickem_results = all_combinations
+    total_weight = float(weights.sum())
+    if matches[:index] + matches[index + 1:] == simulation._branch_matches(simulation._initial_state(finished_matches, newest_first)):
+        save_branch_results(branch_path, simulation, finished_matches, newest_first, branch_results)
+    else:
+        Path(branch_path).unlink(missing_ok=True)
+    run_time = (perf_counter_ns() - start) / 1_000_000_000
+    logger.info("\n".join(format_results(results, int(total_weight), run_time, output_path, mode="模拟（按新赛果取条件分布）", denominator=total_weight)))
+    return True
+
+
 def simulate(
     file_path: Path | str,
     output_path: Path | str = "result.txt",
     finished_matches: list[tuple[str, str, str, str]] | None = None,
     newest_first: bool = False,
+    branch_path: Path | str = BRANCH_RESULT_PATH,
+    win_matrix: WinMatrix | None = None,
 ):
 
     n_iterations = DEFAULT_SIMULATION_ITERATIONS
@@ -800,26 +1467,27 @@ def simulate(
 
     # 运行模拟并打印格式化结果
     start = perf_counter_ns()
-    simulation = Simulation(file_path)
+    simulation = Simulation(file_path, win_matrix=win_matrix)
     finished_count = len(finished_matches or [])
     remaining_matches = max(0, SWISS_TOTAL_MATCHES - finished_count)
-    exact_outcomes = 2 ** remaining_matches
     exact_result = None
-    if exact_outcomes <= MAX_EXACT_OUTCOMES:
-        logger.info(f"剩余 {remaining_matches} 场，尝试精确遍历 {exact_outcomes:,} 个分支")
+    if remaining_matches <= MAX_EXACT_REMAINING_MATCHES:
+        logger.info(f"剩余 {remaining_matches} 场，尝试精确遍历（每轮最多 {MAX_EXACT_OUTCOMES:,} 个状态）")
         exact_result = simulation.exact(
             finished_matches=finished_matches,
             newest_first=newest_first,
             max_outcomes=MAX_EXACT_OUTCOMES,
         )
+        if exact_result is None:
+            logger.info(f"剩余 {remaining_matches} 场，状态数超过上限 {MAX_EXACT_OUTCOMES:,}，使用随机模拟")
 
     mode = "模拟"
     if exact_result is not None:
         results, n_iterations = exact_result
         mode = "加权精确遍历"
     else:
-        if exact_outcomes > MAX_EXACT_OUTCOMES:
-            logger.info(f"剩余 {remaining_matches} 场，分支 {exact_outcomes:,} 超过上限 {MAX_EXACT_OUTCOMES:,}，使用随机模拟")
+        if remaining_matches > MAX_EXACT_REMAINING_MATCHES:
+            logger.info(f"剩余 {remaining_matches} 场，超过精确遍历上限 {MAX_EXACT_REMAINING_MATCHES}，使用随机模拟")
         results = simulation.run(
             n_iterations,
             n_cores,
@@ -829,4 +1497,5 @@ def simulate(
     run_time = (perf_counter_ns() - start) / 1_000_000_000
     all_combinations = list(results.values())[0].pickem_results
     denominator = sum(all_combinations.values()) if exact_result is not None else None
+    save_branch_results(branch_path, simulation, finished_matches, newest_first, list(results.values())[0].branch_results)
     logger.info("\n".join(format_results(results, n_iterations, run_time, output_path, mode=mode, denominator=denominator)))
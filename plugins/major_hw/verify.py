@@ -1,111 +1,349 @@
-
-from collections import defaultdict
+import gzip
 import json
 import re
+import struct
+from pathlib import Path
+
+import numpy as np
+
+# 一次评估时 (作业数 × 组合数) 的最大元素个数，控制临时数组的内存
+EVALUATE_BLOCK_SIZE = 1 << 22
 
+# 二进制结果文件：8 字节魔数 + 4 字节头部长度 + JSON 头部（补齐到 8 字节），
+# 之后是定长记录 (3-0 掩码, 3-1/3-2 掩码, 0-3 掩码, 权重)，掩码宽度由队伍数决定
+RESULT_MAGIC = b"MJHWRES1"
 
-class SimulationResults(defaultdict):
-    def __init__(self):
-        super().__init__(float)
-        self.team_to_bit: dict[str, int] = {}
+
+class SimulationResults:
+    """
+    模拟结果：每个组合拆成三个无符号整数掩码数组（3-0、3-1/3-2、0-3）和一个权重数组
+    从结果文件读出的数组是记录字段的视图，掩码保持文件里的宽度，评估时再按块转成 uint64
+    team_to_bit 把队伍名映射到掩码中的位
+    """
+    def __init__(
+        self,
+        three_zero: np.ndarray | None = None,
+        advanced: np.ndarray | None = None,
+        zero_three: np.ndarray | None = None,
+        weights: np.ndarray | None = None,
+        team_to_bit: dict[str, int] | None = None,
+    ):
+        self.three_zero = three_zero if three_zero is not None else np.zeros(0, dtype=np.uint64)
+        self.advanced = advanced if advanced is not None else np.zeros(0, dtype=np.uint64)
+        self.zero_three = zero_three if zero_three is not None else np.zeros(0, dtype=np.uint64)
+        self.weights = weights if weights is not None else np.zeros(0, dtype=np.float64)
+        self.team_to_bit: dict[str, int] = team_to_bit or {}
+
+    def __len__(self) -> int:
+        return len(self.weights)
+
+    def total_weight(self) -> float:
+        return float(self.weights.sum())
 
 
 def _mask_from_names(names, team_to_bit: dict[str, int]) -> int:
+    # 旧格式里从未出现过的队伍不占位，对正确数没有贡献
     mask = 0
     for name in names:
-        mask |= team_to_bit[name]
+        mask |= team_to_bit.get(name, 0)
     return mask
 
 
-def parse_simulation_results(file_path: str) -> tuple[SimulationResults, float]:
+def _mask_dtype(n_teams: int) -> str:
+    if n_teams <= 16:
+        return "<u2"
+    if n_teams <= 32:
+        return "<u4"
+    return "<u8"
+
+
+def _record_dtype(mask_dtype: str) -> np.dtype:
+    return np.dtype([
+        ("three_zero", mask_dtype),
+        ("advanced", mask_dtype),
+        ("zero_three", mask_dtype),
+        ("weight", "<f8"),
+    ])
+
+
+def encode_simulation_results(results: SimulationResults, header: dict | None = None) -> bytes:
+    """把模拟结果编码成二进制结果文件的内容"""
+    team_names = sorted(results.team_to_bit, key=lambda team: results.team_to_bit[team])
+    mask_dtype = _mask_dtype(len(team_names))
+    meta = dict(header or {})
+    meta.update({
+        "teams": team_names,
+        "mask_dtype": mask_dtype,
+        "count": len(results),
+        "total_weight": results.total_weight(),
+    })
+    raw_header = json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    raw_header += b" " * (-(len(RESULT_MAGIC) + 4 + len(raw_header)) % 8)
+
+    records = np.empty(len(results), dtype=_record_dtype(mask_dtype))
+    records["three_zero"] = results.three_zero
+    records["advanced"] = results.advanced
+    records["zero_three"] = results.zero_three
+    records["weight"] = results.weights
+    return RESULT_MAGIC + struct.pack("<I", len(raw_header)) + raw_header + records.tobytes()
+
+
+def write_simulation_results(file_path: str | Path, results: SimulationResults, header: dict | None = None) -> int:
+    """写出二进制结果文件（先写临时文件再替换），返回字节数"""
+    path = Path(file_path)
+    data = encode_simulation_results(results, header)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    tmp_path.write_bytes(data)
+    tmp_path.replace(path)
+    return len(data)
+
+
+def _decode_header(head: bytes) -> tuple[dict, int]:
+    header_size = struct.unpack("<I", head[len(RESULT_MAGIC):len(RESULT_MAGIC) + 4])[0]
+    offset = len(RESULT_MAGIC) + 4
+    header = json.loads(head[offset:offset + header_size].decode("utf-8"))
+    return header, offset + header_size
+
+
+def _results_from_records(records: np.ndarray, header: dict) -> SimulationResults:
+    # 直接用字段视图，不复制，内存映射读取时只有评估到的块才会读进内存
+    return SimulationResults(
+        three_zero=records["three_zero"],
+        advanced=records["advanced"],
+        zero_three=records["zero_three"],
+        weights=records["weight"],
+        team_to_bit={team: 1 << idx for idx, team in enumerate(header["teams"])},
+    )
+
+
+def load_simulation_results(file_path: str | Path) -> SimulationResults:
+    """内存映射读取二进制结果文件"""
+    with open(file_path, "rb") as file:
+        head = file.read(len(RESULT_MAGIC) + 4)
+        header_size = struct.unpack("<I", head[len(RESULT_MAGIC):])[0]
+        head += file.read(header_size)
+    header, offset = _decode_header(head)
+    dtype = _record_dtype(header["mask_dtype"])
+    if header["count"] == 0:
+        records = np.zeros(0, dtype=dtype)
+    else:
+        records = np.memmap(file_path, dtype=dtype, mode="r", offset=offset, shape=(header["count"],))
+    return _results_from_records(records, header)
+
+
+def decode_simulation_results(data: bytes) -> SimulationResults:
+    """从内存中的二进制结果（例如解压后的存档）读取"""
+    header, offset = _decode_header(data)
+    records = np.frombuffer(data, dtype=_record_dtype(header["mask_dtype"]), count=header["count"], offset=offset)
+    return _results_from_records(records, header)
+
+
+def is_binary_result(file_path: str | Path) -> bool:
+    with open(file_path, "rb") as file:
+        return file.read(len(RESULT_MAGIC)) == RESULT_MAGIC
+
+
+def archive_simulation_results(archive_path: str | Path, result_path: str | Path) -> int:
+    """把结果文件存档为 gzip 压缩的二进制格式（文本结果先转换），返回存档字节数"""
+    if is_binary_result(result_path):
+        data = Path(result_path).read_bytes()
+    else:
+        data = encode_simulation_results(parse_simulation_results(result_path)[0])
+    path = Path(archive_path)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    tmp_path.write_bytes(gzip.compress(data, compresslevel=1))
+    tmp_path.replace(path)
+    return path.stat().st_size
+
+
+def results_from_bytes(data: bytes) -> SimulationResults:
+    """从结果文件的完整内容读取，二进制和文本格式都支持"""
+    if data.startswith(RESULT_MAGIC):
+        return decode_simulation_results(data)
+    return _parse_text_results(data.decode("utf-8").splitlines(keepends=True))
+
+
+def convert_text_results(src_path: str | Path, dst_path: str | Path) -> int:
+    """把文本结果文件转换为二进制格式，返回组合数"""
+    results = parse_simulation_results(src_path)[0]
+    write_simulation_results(dst_path, results)
+    return len(results)
+
+
+def parse_simulation_results(file_path: str | Path) -> tuple[SimulationResults, float]:
     """
-    解析模拟结果文件，返回每个组合及其出现频率的字典
-    格式: {('3-0': set, '3-1/3-2': set, '0-3': set): frequency}
+    读取模拟结果文件，返回组合掩码数组及其权重
+    二进制格式直接内存映射；文本格式逐行解析
     """
-    results = SimulationResults()
-    total_simulations = 0.0
+    if is_binary_result(file_path):
+        results = load_simulation_results(file_path)
+        return results, results.total_weight()
+    with open(file_path, 'r') as file:
+        results = _parse_text_results(file)
+    return results, results.total_weight()
+
+
+def _parse_text_results(lines) -> SimulationResults:
+    """
+    解析文本结果，旧格式（直接写队伍名）按出现顺序给队伍分配位
+    """
+    team_to_bit: dict[str, int] = {}
+    three_zero: list[int] = []
+    advanced: list[int] = []
+    zero_three: list[int] = []
+    weights: list[float] = []
     number = r"[0-9]+(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?"
     pattern = rf"3-0: (.*?) \| 3-1/3-2: (.*?) \| 0-3: (.*?): ({number})/{number}"
-    mask_pattern = rf"m ([0-9a-fA-F]+) ([0-9a-fA-F]+) ([0-9a-fA-F]+): ({number})/{number}"
-
-    def parse_team_set(raw: str) -> frozenset[str]:
-        return frozenset(t.strip() for t in raw.split(',') if t.strip())
 
-    with open(file_path, 'r') as file:
-        for line in file:
-            if line.startswith("# teams:"):
-                team_names = json.loads(line.split(":", 1)[1].strip())
-                results.team_to_bit = {team: 1 << idx for idx, team in enumerate(team_names)}
-                continue
-            mask_match = re.match(mask_pattern, line)
-            if mask_match:
-                three_zero = int(mask_match.group(1), 16)
-                three_one_two = int(mask_match.group(2), 16)
-                zero_three = int(mask_match.group(3), 16)
-                count = float(mask_match.group(4))
-
-                key = (three_zero, three_one_two, zero_three)
-                results[key] += count
-                total_simulations += count
+    def legacy_mask(raw: str) -> int:
+        mask = 0
+        for name in raw.split(','):
+            name = name.strip()
+            if not name:
                 continue
+            if name not in team_to_bit:
+                team_to_bit[name] = 1 << len(team_to_bit)
+            mask |= team_to_bit[name]
+        return mask
+
+    for line in lines:
+        if line.startswith("m "):
+            # m <3-0> <3-1/3-2> <0-3>: <权重>/<总权重> (<百分比>)
+            parts = line.split()
+            three_zero.append(int(parts[1], 16))
+            advanced.append(int(parts[2], 16))
+            zero_three.append(int(parts[3][:-1], 16))
+            weights.append(float(parts[4].split("/", 1)[0]))
+            continue
+        if line.startswith("# teams:"):
+            team_names = json.loads(line.split(":", 1)[1].strip())
+            team_to_bit = {team: 1 << idx for idx, team in enumerate(team_names)}
+            continue
+
+        match = re.match(pattern, line)
+        if match:
+            three_zero.append(legacy_mask(match.group(1)))
+            advanced.append(legacy_mask(match.group(2)))
+            zero_three.append(legacy_mask(match.group(3)))
+            weights.append(float(match.group(4)))
+
+    results = SimulationResults(
+        three_zero=np.array(three_zero, dtype=np.uint64),
+        advanced=np.array(advanced, dtype=np.uint64),
+        zero_three=np.array(zero_three, dtype=np.uint64),
+        weights=np.array(weights, dtype=np.float64),
+        team_to_bit=team_to_bit,
+    )
+    return results
+
+
+def evaluate_combinations(combos: list[dict], results: SimulationResults) -> tuple[np.ndarray, np.ndarray]:
+    """
+    一次评估多份作业
+
+    Args:
+        combos: 要评估的组合列表
+        results: 模拟结果
 
-            match = re.match(pattern, line)
-            if match:
-                three_zero = parse_team_set(match.group(1))
-                three_one_two = parse_team_set(match.group(2))
-                zero_three = parse_team_set(match.group(3))
-                count = float(match.group(4))
+    Returns:
+        tuple: (每份作业正确数>=5的概率, 每份作业正确数期望)
+    """
+    prob_ge5 = np.zeros(len(combos), dtype=np.float64)
+    expected_value = np.zeros(len(combos), dtype=np.float64)
+    total_weight = results.total_weight() if len(results) else 0.0
+    if not combos or total_weight <= 0:
+        return prob_ge5, expected_value
+    if not results.team_to_bit:
+        raise ValueError("numeric simulation results require a # teams header")
+
+    # 作业和结果都展开成 (队伍, 档位) 的 0/1 指示向量，正确数就是二者的内积
+    n_bits = max(team_to_bit.bit_length() for team_to_bit in results.team_to_bit.values())
+    shifts = np.arange(n_bits, dtype=np.uint64)
+    combo_masks = np.array([
+        (
+            _mask_from_names(combo['3-0'], results.team_to_bit),
+            _mask_from_names(combo['3-1/3-2'], results.team_to_bit),
+            _mask_from_names(combo['0-3'], results.team_to_bit),
+        )
+        for combo in combos
+    ], dtype=np.uint64)
+    homework = ((combo_masks[:, :, None] >> shifts) & np.uint64(1)).reshape(len(combos), -1).T.astype(np.float32)
 
-                key = (three_zero, three_one_two, zero_three)
-                results[key] += count
-                total_simulations += count
+    block = max(1, EVALUATE_BLOCK_SIZE // len(combos))
+    for start in range(0, len(results), block):
+        end = start + block
+        masks = np.stack(
+            [results.three_zero[start:end], results.advanced[start:end], results.zero_three[start:end]],
+            axis=1,
+        ).astype(np.uint64)
+        outcome = ((masks[:, :, None] >> shifts) & np.uint64(1)).reshape(len(masks), -1).astype(np.float32)
+        weights = results.weights[start:end]
+        correct = outcome @ homework
+        # 块内用 float32 累加，块间再用 float64 汇总
+        prob_ge5 += weights.astype(np.float32) @ (correct >= 4.5).astype(np.float32)
+        expected_value += (weights @ outcome) @ homework
 
-    return results, total_simulations
+    return prob_ge5 / total_weight, expected_value / total_weight
 
 
-def evaluate_combination(combo: dict, results: dict) -> tuple:
+def evaluate_combination(combo: dict, results: SimulationResults) -> tuple:
     """
     评估组合在模拟结果中的表现
 
     Args:
         combo: 要评估的组合
-        results: 模拟结果字典
+        results: 模拟结果
 
     Returns:
         tuple: (正确数列表, 正确数>=5的概率, 正确数期望)
     """
-    correct_counts = []
-    total_weight = sum(results.values())
-    if total_weight <= 0:
-        return correct_counts, 0.0, 0.0
-
-    ge5_weight = 0.0
-    expected_total = 0.0
-    team_to_bit = getattr(results, "team_to_bit", {})
-    combo_masks = None
-    if team_to_bit:
-        combo_masks = (
-            _mask_from_names(combo['3-0'], team_to_bit),
-            _mask_from_names(combo['3-1/3-2'], team_to_bit),
-            _mask_from_names(combo['0-3'], team_to_bit),
-        )
-    for (three_zero, three_one_two, zero_three), count in results.items():
-        if isinstance(three_zero, int):
-            if combo_masks is None:
-                raise ValueError("numeric simulation results require a # teams header")
-            correct = 0
-            correct += (combo_masks[0] & three_zero).bit_count()
-            correct += (combo_masks[1] & three_one_two).bit_count()
-            correct += (combo_masks[2] & zero_three).bit_count()
-        else:
-            correct = 0
-            correct += len(set(combo['3-0']) & set(three_zero))
-            correct += len(set(combo['3-1/3-2']) & set(three_one_two))
-            correct += len(set(combo['0-3']) & set(zero_three))
-        if correct >= 5:
-            ge5_weight += count
-        expected_total += correct * count
-
-    prob_ge5 = ge5_weight / total_weight
-    expected_value = expected_total / total_weight
-    return correct_counts, prob_ge5, expected_value
+    prob_ge5, expected_value = evaluate_combinations([combo], results)
+    return [], float(prob_ge5[0]), float(expected_value[0])
+
+
+def evaluate_combination_given(
+    combo: dict,
+    results: SimulationResults,
+    conditions: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    在若干条件下评估同一份作业
+
+    Args:
+        combo: 要评估的组合
+        results: 模拟结果
+        conditions: (条件数, 组合数) 的布尔数组，表示每个组合是否满足该条件
+
+    Returns:
+        tuple: (每个条件下正确数>=5的概率, 每个条件下正确数期望, 每个条件的总权重)
+    """
+    conditions = np.asarray(conditions, dtype=bool).reshape(-1, len(results))
+    prob_ge5 = np.zeros(len(conditions), dtype=np.float64)
+    expected_value = np.zeros(len(conditions), dtype=np.float64)
+    condition_weight = np.zeros(len(conditions), dtype=np.float64)
+    if len(results) == 0:
+        return prob_ge5, expected_value, condition_weight
+    if not results.team_to_bit:
+        raise ValueError("numeric simulation results require a # teams header")
+
+    combo_masks = [
+        np.uint64(_mask_from_names(combo[category], results.team_to_bit))
+        for category in ('3-0', '3-1/3-2', '0-3')
+    ]
+    for start in range(0, len(results), EVALUATE_BLOCK_SIZE):
+        end = start + EVALUATE_BLOCK_SIZE
+        correct = np.zeros(min(end, len(results)) - start, dtype=np.float64)
+        for masks, combo_mask in zip((results.three_zero, results.advanced, results.zero_three), combo_masks):
+            hits = masks[start:end].astype(np.uint64) & combo_mask
+            while hits.any():
+                correct += (hits & np.uint64(1)).astype(np.float64)
+                hits = hits >> np.uint64(1)
+        weights = conditions[:, start:end] * results.weights[start:end]
+        condition_weight += weights.sum(axis=1)
+        prob_ge5 += weights @ (correct >= 4.5).astype(np.float64)
+        expected_value += weights @ correct
+
+    nonzero = condition_weight > 0
+    prob_ge5[nonzero] /= condition_weight[nonzero]
+    expected_value[nonzero] /= condition_weight[nonzero]
+    return prob_ge5, expected_value, condition_weight
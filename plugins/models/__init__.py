@@ -141,6 +141,40 @@ class MatchStatsPWExtra(Base):
     team1Legacy: Mapped[float] = mapped_column(Float)
     team2Legacy: Mapped[float] = mapped_column(Float)
 
+# 完美比赛按赛季与模式汇总的累计值
+class MatchStatsPWAgg(Base):
+    __tablename__ = "matches_agg"
+
+    steamid: Mapped[str] = mapped_column(String(20), primary_key=True)
+    seasonId: Mapped[str] = mapped_column(String(20), primary_key=True)
+    # ladder / custom / other
+    modeClass: Mapped[str] = mapped_column(String(10), primary_key=True)
+
+    cnt: Mapped[int] = mapped_column(Integer)
+    winCnt: Mapped[int] = mapped_column(Integer)
+    roundSum: Mapped[int] = mapped_column(Integer)
+
+    ratingSum: Mapped[float] = mapped_column(Float)
+    ratingSqSum: Mapped[float] = mapped_column(Float)
+    weSum: Mapped[float] = mapped_column(Float)
+    weSqSum: Mapped[float] = mapped_column(Float)
+    adrSum: Mapped[float] = mapped_column(Float)
+    adrSqSum: Mapped[float] = mapped_column(Float)
+    scoreChangeSum: Mapped[int] = mapped_column(BigInteger)
+    scoreChangeSqSum: Mapped[int] = mapped_column(BigInteger)
+
+    killSum: Mapped[int] = mapped_column(Integer)
+    deathSum: Mapped[int] = mapped_column(Integer)
+    assistSum: Mapped[int] = mapped_column(Integer)
+    headShotSum: Mapped[int] = mapped_column(Integer)
+    entryKillSum: Mapped[int] = mapped_column(Integer)
+    firstDeathSum: Mapped[int] = mapped_column(Integer)
+    snipeSum: Mapped[int] = mapped_column(Integer)
+    multiKillSum: Mapped[int] = mapped_column(Integer)
+    flashTeammateSum: Mapped[int] = mapped_column(Integer)
+    flashSuccessSum: Mapped[int] = mapped_column(Integer)
+    throwsSum: Mapped[int] = mapped_column(Integer)
+
 # 官匹比赛数据
 class MatchStatsGP(Base):
     __tablename__ = "matches_gp"
@@ -442,11 +476,55 @@ class ChatRetrievalSpan(Base):
     end_time: Mapped[int] = mapped_column(BigInteger)
     span_text: Mapped[str] = mapped_column(Text)
     keywords: Mapped[str] = mapped_column(Text, default="[]")
-    token_text: Mapped[str] = mapped_column(Text, default="[]")
+    # 以下三列都是小端 uint32 数组，token_ids 是按出现顺序的 ChatSpanTerm.term_id
+    token_ids: Mapped[bytes] = mapped_column(LargeBinary, default=b"")
     token_count: Mapped[int] = mapped_column(Integer, default=0)
-    participant_uids: Mapped[str] = mapped_column(Text, default="[]")
-    message_ids: Mapped[str] = mapped_column(Text, default="[]")
-    chunk_ids: Mapped[str] = mapped_column(Text, default="[]")
+    message_ids: Mapped[bytes] = mapped_column(LargeBinary, default=b"")
+    chunk_ids: Mapped[bytes] = mapped_column(LargeBinary, default=b"")
+
+
+class ChatSpanParticipant(Base):
+    __tablename__ = "chat_span_participant"
+    __table_args__ = (
+        Index("ix_chat_span_participant_user", "group_id", "user_id", "span_id"),
+    )
+
+    span_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[str] = mapped_column(String(20), primary_key=True)
+    group_id: Mapped[str] = mapped_column(String(20))
+
+
+class ChatSpanPosting(Base):
+    __tablename__ = "chat_span_posting"
+    __table_args__ = (
+        Index("ix_chat_span_posting_span", "span_id"),
+    )
+
+    group_id: Mapped[str] = mapped_column(String(20), primary_key=True)
+    term_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    span_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    term_freq: Mapped[int] = mapped_column(Integer, default=0)
+
+
+# 按群的词表，term_id 分配后不再变化，doc_freq 降到 0 也保留，整群重建时才清空
+class ChatSpanTerm(Base):
+    __tablename__ = "chat_span_term"
+    __table_args__ = (
+        Index("ix_chat_span_term_term", "group_id", "term", unique=True),
+    )
+
+    group_id: Mapped[str] = mapped_column(String(20), primary_key=True)
+    term_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    term: Mapped[str] = mapped_column(String(80))
+    doc_freq: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class ChatSpanIndexStat(Base):
+    __tablename__ = "chat_span_index_stat"
+
+    group_id: Mapped[str] = mapped_column(String(20), primary_key=True)
+    span_count: Mapped[int] = mapped_column(Integer, default=0)
+    token_total: Mapped[int] = mapped_column(BigInteger, default=0)
 
 
 class ChatTokenLexicon(Base):
@@ -464,6 +542,13 @@ class ChatTokenLexicon(Base):
     enabled: Mapped[bool] = mapped_column(Boolean, default=False)
 
 
+class ChatLexiconStat(Base):
+    __tablename__ = "chat_lexicon_stat"
+
+    group_id: Mapped[str] = mapped_column(String(20), primary_key=True)
+    doc_count: Mapped[int] = mapped_column(Integer, default=0)
+
+
 class ChatReplyEdge(Base):
     __tablename__ = "chat_reply_edge"
     __table_args__ = (
@@ -564,6 +649,17 @@ class MajorHWSnapshot(Base):
     winrate: Mapped[float] = mapped_column(Float)
     expval: Mapped[float] = mapped_column(Float)
 
+# Major作业概率历史（列式）：每个阶段每个用户一行，points 为按场次追加的定长记录，见 major_hw/history.py
+class MajorHWHistory(Base):
+    __tablename__ = "major_hw_history"
+
+    stage: Mapped[str] = mapped_column(String(50), primary_key=True)
+    uid: Mapped[str] = mapped_column(String(20), primary_key=True)
+
+    homework_texts: Mapped[str] = mapped_column(Text)
+    points: Mapped[bytes] = mapped_column(LargeBinary)
+    updated_at: Mapped[int] = mapped_column(BigInteger)
+
 # 复读点数记录
 class FuduPoint(Base):
     __tablename__ = "fudu_points"
@@ -13,6 +13,7 @@ import aiohttp
 import os
 from pyppeteer import launch
 import asyncio
+from contextlib import asynccontextmanager
 from pathlib import Path
 from alembic.runtime.migration import MigrationContext
 from alembic.autogenerate import compare_metadata
@@ -150,15 +151,96 @@ def local_record_segment(path: str | Path) -> MessageSegment:
     encoded = base64.b64encode(data).decode("ascii")
     return MessageSegment.record(f"base64://{encoded}")
 
+# 各类数据的版本号，数据变化时加一，依赖它的缓存（如截图）随之失效
+data_versions: dict[str, int] = {}
+
+def bump_data_version(scope: str) -> None:
+    data_versions[scope] = data_versions.get(scope, 0) + 1
+
+def get_data_version(scope: str) -> int:
+    return data_versions.get(scope, 0)
+
+class BrowserPool:
+    """
+    常驻的无头浏览器，页面用完放回池中复用
+    每个页面有独立的无痕上下文，cookie 互不影响；浏览器崩溃后下次使用时自动重启
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self.semaphore = asyncio.Semaphore(size)
+        self.lock = asyncio.Lock()
+        self.browser = None
+        self.idle: list = []
+
+    def _on_disconnected(self, browser) -> None:
+        if self.browser is browser:
+            logger.warning("浏览器连接断开，下次截图时重启")
+            self.browser = None
+            self.idle = []
+
+    async def _get_browser(self):
+        async with self.lock:
+            if self.browser is None:
+                logger.info("启动无头浏览器")
+                browser = await launch(headless=True, args=['--no-sandbox', '--disable-setuid-sandbox'],
+                                       handleSIGINT=False, handleSIGTERM=False, handleSIGHUP=False)
+                browser.on("disconnected", lambda: self._on_disconnected(browser))
+                self.browser = browser
+                self.idle = []
+            return self.browser
+
+    async def _acquire(self):
+        browser = await self._get_browser()
+        while self.idle:
+            context, page = self.idle.pop()
+            if not page.isClosed():
+                return browser, context, page
+        context = await browser.createIncognitoBrowserContext()
+        return browser, context, await context.newPage()
+
+    @asynccontextmanager
+    async def page(self):
+        async with self.semaphore:
+            browser, context, page = await self._acquire()
+            try:
+                yield page
+            except BaseException:
+                # 出错的页面不再复用
+                try:
+                    await context.close()
+                except Exception:
+                    pass
+                raise
+            try:
+                await page.goto("about:blank")
+                if self.browser is browser:
+                    self.idle.append((context, page))
+                    return
+            except Exception as exc:
+                logger.warning(f"回收浏览器页面失败: {exc}")
+            try:
+                await context.close()
+            except Exception:
+                pass
+
+    async def close(self) -> None:
+        async with self.lock:
+            browser, self.browser, self.idle = self.browser, None, []
+        if browser is not None:
+            await browser.close()
+
+browser_pool = BrowserPool(config.cs_browser_pages)
+
+@driver.on_shutdown
+async def close_browser_pool():
+    await browser_pool.close()
+
 async def screenshot_html_to_png(url: str, width: int, height: int):
-    browser = await launch(headless=True, args=['--no-sandbox', '--disable-setuid-sandbox'])
-    page = await browser.newPage()
-    await page.setViewport({'width': width, 'height': height})
-    await page.goto(url)
-    await asyncio.sleep(1)
-    image = await page.screenshot()
-    await browser.close()
-    return image
+    async with browser_pool.page() as page:
+        await page.setViewport({'width': width, 'height': height})
+        await page.goto(url)
+        await asyncio.sleep(1)
+        return await page.screenshot()
 
 async def getcard(bot: Bot, gid: str, uid: str):
     try:
@@ -3,4 +3,5 @@ from pydantic import BaseModel
 
 class Config(BaseModel):
     """Plugin Config Here"""
-    cs_database: str
\ No newline at end of file
+    cs_database: str
+    cs_browser_pages: int = 3
@@ -47,7 +47,7 @@ def prefix_matches(finished_matches: list, match_count: int) -> list:
 
 async def apply_results(args: argparse.Namespace) -> None:
     import plugins.major_hw as major_hw
-    from plugins.major_hw.verify import evaluate_combination, parse_simulation_results
+    from plugins.major_hw.verify import evaluate_combinations, results_from_bytes
     from plugins.utils import local_storage
 
     result_dir = Path(args.result_dir)
@@ -61,37 +61,35 @@ async def apply_results(args: argparse.Namespace) -> None:
         f"members={len(members)} current_match_count={current_match_count}"
     )
 
-    for gzip_path in sorted(result_dir.glob("*.txt.gz"), key=lambda path: int(path.name.split(".", 1)[0])):
-        match_count = int(gzip_path.name.split(".", 1)[0])
+    # 同一场次既有旧的 .txt.gz 又有 .bin.gz 时以二进制存档为准
+    archives: dict[int, Path] = {}
+    for gzip_path in sorted(result_dir.glob("*.txt.gz")) + sorted(result_dir.glob("*.bin.gz")):
+        archives[int(gzip_path.name.split(".", 1)[0])] = gzip_path
+
+    for match_count, gzip_path in sorted(archives.items()):
         if args.max_match_count is not None and match_count > args.max_match_count:
             continue
 
         result_bytes = gzip.decompress(gzip_path.read_bytes())
-        temp_path = result_dir / f".apply-{match_count}.txt"
-        temp_path.write_bytes(result_bytes)
-        try:
-            results, total_weight = parse_simulation_results(str(temp_path))
-        finally:
-            temp_path.unlink(missing_ok=True)
+        results = results_from_bytes(result_bytes)
+        total_weight = results.total_weight()
 
         current_matches = prefix_matches(finished_matches, match_count)
         latest_match_id = None
         if current_matches and len(current_matches[0]) >= 4:
             latest_match_id = str(current_matches[0][3])
 
-        homework_rows: list[tuple[str, str, float, float]] = []
-        for member in members:
-            teams = json.loads(member.teams)
-            combo = {
-                "3-0": teams[:2],
-                "3-1/3-2": teams[2:8],
-                "0-3": teams[8:],
-            }
-            _, winrate, expval = evaluate_combination(combo, results)
-            homework_text = major_hw.homework_teams_text(member.teams)
-            homework_rows.append((member.uid, homework_text, winrate, expval))
-            if match_count == current_match_count:
-                await major_hw.db.set_uid_val(member.uid, major_hw.major_stage_name, winrate, expval)
+        combos = [major_hw.homework_combo(json.loads(member.teams)) for member in members]
+        winrates, expvals = evaluate_combinations(combos, results)
+        homework_rows: list[tuple[str, str, float, float]] = [
+            (member.uid, major_hw.homework_teams_text(member.teams), float(winrate), float(expval))
+            for member, winrate, expval in zip(members, winrates, expvals)
+        ]
+        if match_count == current_match_count:
+            await major_hw.db.set_uid_vals(
+                major_hw.major_stage_name,
+                [(uid, winrate, expval) for uid, _, winrate, expval in homework_rows],
+            )
 
         await major_hw.db.save_simulation_snapshot(
             stage=major_hw.major_stage_name,
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+import sys
+import time
+
+import nonebot
+from sqlalchemy.ext.asyncio import create_async_engine
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+nonebot.init()
+nonebot.load_plugin(Path("plugins") / "models")
+nonebot.load_plugin(Path("plugins") / "utils")
+nonebot.load_plugin(Path("plugins") / "chat_history")
+
+from plugins.chat_history import db as chat_history_db
+from plugins.models import ChatSpanIndexStat, ChatSpanPosting, ChatSpanTerm
+
+
+def main_progress(started: float):
+    def progress(stage: str, current: int, total: int | None) -> None:
+        elapsed = time.monotonic() - started
+        print(f"{stage} {current}/{total if total else '?'} elapsed={elapsed:.1f}s", flush=True)
+
+    return progress
+
+
+async def main() -> None:
+    started = time.monotonic()
+    database_url = nonebot.get_driver().config.cs_database
+    engine = create_async_engine(database_url, pool_pre_ping=True, pool_recycle=3600)
+    async with engine.begin() as connection:
+        for table in [ChatSpanPosting.__table__, ChatSpanTerm.__table__, ChatSpanIndexStat.__table__]:
+            await connection.run_sync(table.create, checkfirst=True)
+    await engine.dispose()
+    print("chat span index tables are ready", flush=True)
+    # 直接用已存的 span 分词建倒排索引，不重新切分 chunk / span
+    await chat_history_db.rebuild_all_span_postings(progress_callback=main_progress(started))
+    elapsed = time.monotonic() - started
+    print(f"chat span index build complete in {elapsed:.1f}s", flush=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import argparse
+import gzip
+from pathlib import Path
+import sys
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+# verify.py 只依赖 numpy，直接导入，不用初始化 nonebot
+sys.path.insert(0, str(REPO_ROOT / "plugins" / "major_hw"))
+
+from verify import encode_simulation_results, results_from_bytes
+
+
+def convert_archive(path: Path, remove: bool) -> Path:
+    target = path.with_name(path.name.replace(".txt.gz", ".bin.gz"))
+    results = results_from_bytes(gzip.decompress(path.read_bytes()))
+    tmp_path = target.with_suffix(target.suffix + ".tmp")
+    tmp_path.write_bytes(gzip.compress(encode_simulation_results(results), compresslevel=1))
+    tmp_path.replace(target)
+    print(f"{path} -> {target}: combinations={len(results)} size={path.stat().st_size}->{target.stat().st_size}")
+    if remove:
+        path.unlink()
+    return target
+
+
+def convert_result(path: Path, remove: bool) -> Path:
+    target = path.with_suffix(".bin")
+    results = results_from_bytes(path.read_bytes())
+    tmp_path = target.with_suffix(target.suffix + ".tmp")
+    tmp_path.write_bytes(encode_simulation_results(results))
+    tmp_path.replace(target)
+    print(f"{path} -> {target}: combinations={len(results)} size={path.stat().st_size}->{target.stat().st_size}")
+    if remove:
+        path.unlink()
+    return target
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Convert text Major simulation results to the binary result format.")
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        type=Path,
+        help="result.txt files or *.txt.gz archives; defaults to result.txt and data/major_simulations",
+    )
+    parser.add_argument("--remove", action="store_true", help="delete the text files after converting")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    paths: list[Path] = args.paths
+    if not paths:
+        paths = [REPO_ROOT / "result.txt"] if (REPO_ROOT / "result.txt").exists() else []
+        paths += sorted((REPO_ROOT / "data" / "major_simulations").glob("*/*.txt.gz"))
+
+    for path in paths:
+        if path.name.endswith(".txt.gz"):
+            convert_archive(path, args.remove)
+        else:
+            convert_result(path, args.remove)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,9 +17,14 @@ nonebot.load_plugin(Path("plugins") / "models")
 from plugins.models import (
     ChatChunkIndex,
     ChatChunkMessage,
+    ChatLexiconStat,
     ChatMessageIndex,
     ChatReplyEdge,
     ChatRetrievalSpan,
+    ChatSpanIndexStat,
+    ChatSpanParticipant,
+    ChatSpanPosting,
+    ChatSpanTerm,
     ChatTokenLexicon,
 )
 
@@ -33,7 +38,12 @@ async def main() -> None:
             ChatChunkIndex.__table__,
             ChatChunkMessage.__table__,
             ChatRetrievalSpan.__table__,
+            ChatSpanParticipant.__table__,
+            ChatSpanPosting.__table__,
+            ChatSpanTerm.__table__,
+            ChatSpanIndexStat.__table__,
             ChatTokenLexicon.__table__,
+            ChatLexiconStat.__table__,
             ChatReplyEdge.__table__,
         ]:
             await connection.run_sync(table.create, checkfirst=True)
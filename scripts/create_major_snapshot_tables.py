@@ -5,17 +5,52 @@ from pathlib import Path
 import sys
 
 import nonebot
-from sqlalchemy import text
+from sqlalchemy import insert, select, text
 from sqlalchemy.ext.asyncio import create_async_engine
 
 
 REPO_ROOT = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(REPO_ROOT))
+# history.py 只依赖 numpy，直接导入，不用加载 major_hw 插件
+sys.path.insert(0, str(REPO_ROOT / "plugins" / "major_hw"))
 
 nonebot.init()
 nonebot.load_plugin(Path("plugins") / "models")
 
-from plugins.models import MajorHWSnapshot, MajorSimulationSnapshot
+from plugins.models import MajorHWHistory, MajorHWSnapshot, MajorSimulationSnapshot
+from history import HomeworkHistory
+
+
+async def migrate_homework_history(connection) -> int:
+    """把旧的逐行作业快照转成列式历史，已经有历史的阶段跳过，返回迁移的行数"""
+    migrated_stages = set((await connection.execute(select(MajorHWHistory.stage).distinct())).scalars().all())
+    result = await connection.execute(
+        select(MajorHWSnapshot).order_by(MajorHWSnapshot.stage, MajorHWSnapshot.uid, MajorHWSnapshot.match_count)
+    )
+    histories: dict[tuple[str, str], HomeworkHistory] = {}
+    updated_at: dict[tuple[str, str], int] = {}
+    for row in result.all():
+        if row.stage in migrated_stages:
+            continue
+        key = (row.stage, row.uid)
+        histories.setdefault(key, HomeworkHistory()).upsert(
+            row.match_count, row.created_at, row.homework_text, row.winrate, row.expval
+        )
+        updated_at[key] = max(updated_at.get(key, 0), row.created_at)
+
+    values = []
+    for (stage, uid), history in histories.items():
+        homework_texts, points = history.encode()
+        values.append({
+            "stage": stage,
+            "uid": uid,
+            "homework_texts": homework_texts,
+            "points": points,
+            "updated_at": updated_at[(stage, uid)],
+        })
+    if values:
+        await connection.execute(insert(MajorHWHistory), values)
+    return len(values)
 
 
 async def main() -> None:
@@ -58,6 +93,9 @@ async def main() -> None:
         await connection.execute(text(
             "ALTER TABLE major_hw_snapshots DROP COLUMN IF EXISTS teams_hash"
         ))
+        await connection.run_sync(MajorHWHistory.__table__.create, checkfirst=True)
+        migrated = await migrate_homework_history(connection)
+        print(f"migrated {migrated} homework history rows")
     await engine.dispose()
     print("major snapshot tables are ready")
 
@@ -43,9 +43,13 @@ async def main() -> None:
     )
     print(f"chat history group rebuild: refreshed {refreshed} image messages", flush=True)
     await chat_history_db.rebuild_all_group_indexes(progress_callback=main_progress(started))
+    chat_history_db.shutdown_tokenizer()
     elapsed = time.monotonic() - started
     print(f"chat history group rebuild complete in {elapsed:.1f}s", flush=True)
 
 
 if __name__ == "__main__":
+    # 分词进程要在事件循环和数据库连接之前 fork
+    chat_history_db.configure_tokenizer(max(1, (os.cpu_count() or 2) - 1))
+    print(f"chat history group rebuild: tokenizing with {chat_history_db.tokenizer_workers} worker processes", flush=True)
     asyncio.run(main())
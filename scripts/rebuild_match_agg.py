@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+import sys
+import time
+
+import nonebot
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+nonebot.init()
+nonebot.load_plugin(Path("plugins") / "models")
+nonebot.load_plugin(Path("plugins") / "utils")
+nonebot.load_plugin(Path("plugins") / "cs_db_val")
+nonebot.load_plugin(Path("plugins") / "cs_db_upd")
+
+from plugins.cs_db_upd import db as db_upd
+
+
+async def main() -> None:
+    started = time.monotonic()
+    print("rebuilding matches_agg from matches", flush=True)
+    rows = await db_upd.rebuild_match_agg()
+    print(f"matches_agg rebuilt: rows={rows} elapsed={time.monotonic() - started:.1f}s", flush=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -139,7 +139,7 @@ def run_cpp_simulator(
 async def recalculate(args: argparse.Namespace) -> None:
     import plugins.major_hw as major_hw
     from plugins.major_hw.gen_win_matrix import gen_win_matrix
-    from plugins.major_hw.verify import evaluate_combination, parse_simulation_results
+    from plugins.major_hw.verify import convert_text_results, evaluate_combinations, parse_simulation_results
     from plugins.utils import local_storage
 
     raw_matches = await local_storage.get(f"hltvresult{major_hw.config.major_event_id}", default="[]")
@@ -183,29 +183,25 @@ async def recalculate(args: argparse.Namespace) -> None:
             args.threads,
             force_bo3,
         )
-        run_cpp_simulator(cpp_input, Path(major_hw.file_path), simulator_path, team_names)
+        cpp_output = cpp_input.with_name(f"{match_count}.output.txt")
+        run_cpp_simulator(cpp_input, cpp_output, simulator_path, team_names)
+        convert_text_results(cpp_output, major_hw.file_path)
+        cpp_output.unlink(missing_ok=True)
 
         results, total_weight = parse_simulation_results(major_hw.file_path)
-        result_bytes = Path(major_hw.file_path).read_bytes()
-        result_path = major_hw.save_simulation_result_file(match_count, result_bytes)
-
-        homework_rows: list[tuple[str, str, float, float]] = []
-        for member in members:
-            teams = json.loads(member.teams)
-            combo = {
-                "3-0": teams[:2],
-                "3-1/3-2": teams[2:8],
-                "0-3": teams[8:],
-            }
-            _, winrate, expval = evaluate_combination(combo, results)
-            homework_rows.append((
-                member.uid,
-                major_hw.homework_teams_text(member.teams),
-                winrate,
-                expval,
-            ))
-            if match_count == max_count:
-                await major_hw.db.set_uid_val(member.uid, major_hw.major_stage_name, winrate, expval)
+        result_path = major_hw.save_simulation_result_file(match_count)
+
+        combos = [major_hw.homework_combo(json.loads(member.teams)) for member in members]
+        winrates, expvals = evaluate_combinations(combos, results)
+        homework_rows: list[tuple[str, str, float, float]] = [
+            (member.uid, major_hw.homework_teams_text(member.teams), float(winrate), float(expval))
+            for member, winrate, expval in zip(members, winrates, expvals)
+        ]
+        if match_count == max_count:
+            await major_hw.db.set_uid_vals(
+                major_hw.major_stage_name,
+                [(uid, winrate, expval) for uid, _, winrate, expval in homework_rows],
+            )
 
         latest_match_id = None
         if current_matches and len(current_matches[0]) >= 4:
@@ -218,7 +214,7 @@ async def recalculate(args: argparse.Namespace) -> None:
             latest_match_id=latest_match_id,
             total_weight=total_weight,
             homework_rows=homework_rows,
-            result_size=len(result_bytes),
+            result_size=Path(major_hw.file_path).stat().st_size,
         )
         print(
             f"saved match_count={match_count} total_weight={total_weight:g} "
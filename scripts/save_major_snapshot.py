@@ -27,21 +27,14 @@ async def main() -> None:
     )
     results, total_weight = parse_simulation_results(major_hw.file_path)
     major_hw.results = results
-    result_bytes = Path(major_hw.file_path).read_bytes()
 
-    homework_rows: list[tuple[str, str, float, float]] = []
-    members = await major_hw.db.get_all_hw(major_hw.major_stage_name)
-    for member in members:
-        calc_result = await major_hw.calc_val(member.uid)
-        if calc_result is not None:
-            winrate, expval = calc_result
-            homework_rows.append((member.uid, major_hw.homework_teams_text(member.teams), winrate, expval))
+    homework_rows = await major_hw.calc_all_val()
 
     latest_match_id = None
     if finished_matches and len(finished_matches[0]) >= 4:
         latest_match_id = str(finished_matches[0][3])
 
-    major_hw.save_simulation_result_file(len(finished_matches), result_bytes)
+    major_hw.save_simulation_result_file(len(finished_matches))
     await major_hw.db.save_simulation_snapshot(
         stage=major_hw.major_stage_name,
         event_id=major_hw.config.major_event_id,
@@ -49,7 +42,7 @@ async def main() -> None:
         latest_match_id=latest_match_id,
         total_weight=total_weight,
         homework_rows=homework_rows,
-        result_size=len(result_bytes),
+        result_size=Path(major_hw.file_path).stat().st_size,
     )
     print(
         f"saved stage={major_hw.major_stage_name} "
@@ -1,11 +1,13 @@
 from __future__ import annotations
 
 import asyncio
+import os
 from pathlib import Path
 import sys
+import time
 
 import nonebot
-from sqlalchemy import inspect, text
+from sqlalchemy import inspect
 from sqlalchemy.ext.asyncio import create_async_engine
 
 
@@ -14,32 +16,66 @@ sys.path.insert(0, str(REPO_ROOT))
 
 nonebot.init()
 nonebot.load_plugin(Path("plugins") / "models")
+nonebot.load_plugin(Path("plugins") / "utils")
+nonebot.load_plugin(Path("plugins") / "chat_history")
 
-from plugins.models import ChatRetrievalSpan, ChatTokenLexicon
+from plugins.chat_history import db as chat_history_db
+from plugins.models import (
+    ChatLexiconStat,
+    ChatRetrievalSpan,
+    ChatSpanIndexStat,
+    ChatSpanParticipant,
+    ChatSpanPosting,
+    ChatSpanTerm,
+    ChatTokenLexicon,
+)
+
+# 全部可以从消息重新生成，旧格式（JSON 分词、按词串的倒排）直接删表重建
+SPAN_TABLES = [
+    ChatRetrievalSpan.__table__,
+    ChatSpanParticipant.__table__,
+    ChatSpanPosting.__table__,
+    ChatSpanTerm.__table__,
+    ChatSpanIndexStat.__table__,
+]
 
 
 async def main() -> None:
+    started = time.monotonic()
     database_url = nonebot.get_driver().config.cs_database
     engine = create_async_engine(database_url, pool_pre_ping=True, pool_recycle=3600)
     async with engine.begin() as connection:
         await connection.run_sync(ChatTokenLexicon.__table__.create, checkfirst=True)
+        await connection.run_sync(ChatLexiconStat.__table__.create, checkfirst=True)
 
         def existing_columns(sync_connection):
             inspector = inspect(sync_connection)
+            if not inspector.has_table(ChatRetrievalSpan.__tablename__):
+                return set()
             return {column["name"] for column in inspector.get_columns(ChatRetrievalSpan.__tablename__)}
 
         columns = await connection.run_sync(existing_columns)
-        if "token_text" not in columns:
-            await connection.execute(text("ALTER TABLE chat_retrieval_span ADD COLUMN token_text TEXT NOT NULL DEFAULT '[]'"))
-            await connection.execute(text("ALTER TABLE chat_retrieval_span ALTER COLUMN token_text DROP DEFAULT"))
-        if "token_count" not in columns:
-            await connection.execute(text("ALTER TABLE chat_retrieval_span ADD COLUMN token_count INTEGER NOT NULL DEFAULT 0"))
-            await connection.execute(text("ALTER TABLE chat_retrieval_span ALTER COLUMN token_count DROP DEFAULT"))
-
-        await connection.run_sync(ChatTokenLexicon.__table__.create, checkfirst=True)
+        needs_rebuild = bool(columns) and "token_ids" not in columns
+        if needs_rebuild:
+            for table in reversed(SPAN_TABLES):
+                await connection.run_sync(table.drop, checkfirst=True)
+        for table in SPAN_TABLES:
+            await connection.run_sync(table.create, checkfirst=True)
     await engine.dispose()
-    print("chat history token schema is ready")
+    print("chat history token schema is ready", flush=True)
+    if not needs_rebuild:
+        return
+
+    def progress(stage: str, current: int, total: int | None) -> None:
+        print(f"{stage} {current}/{total if total else '?'} elapsed={time.monotonic() - started:.1f}s", flush=True)
+
+    await chat_history_db.rebuild_all_group_indexes(progress_callback=progress)
+    chat_history_db.shutdown_tokenizer()
+    print(f"chat history token upgrade complete in {time.monotonic() - started:.1f}s", flush=True)
 
 
 if __name__ == "__main__":
+    # 分词进程要在事件循环和数据库连接之前 fork
+    chat_history_db.configure_tokenizer(max(1, (os.cpu_count() or 2) - 1))
+    print(f"chat history token upgrade: tokenizing with {chat_history_db.tokenizer_workers} worker processes", flush=True)
     asyncio.run(main())
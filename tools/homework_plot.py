@@ -1,17 +1,24 @@
 import sys
 from pathlib import Path
 import json
-import os
 from tqdm import tqdm
 import matplotlib.cm as cm
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 import numpy as np
+import nonebot
 
-sys.path.append(f"{os.getcwd()}/../plugins/major_hw")
-from gen_win_matrix import gen_win_matrix
-from simulate import simulate
-from verify import parse_simulation_results, evaluate_combination
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+nonebot.init()
+nonebot.load_plugin(Path("plugins") / "models")
+nonebot.load_plugin(Path("plugins") / "utils")
+nonebot.load_plugin(Path("plugins") / "major_hw")
+
+from plugins.major_hw.gen_win_matrix import gen_win_matrix
+from plugins.major_hw.simulate import simulate
+from plugins.major_hw.verify import parse_simulation_results, evaluate_combination
 
 
 filepath = Path(sys.argv[1])
@@ -36,8 +43,7 @@ for i in range(len(games) + 1):
     print(f"{i}/{len(games)}")
     out_path = Path(".") / "temp" / f"{data['stage']}-{i}.txt"
     if not out_path.exists():
-        gen_win_matrix(info_path, games[:i])
-        simulate(info_path, out_path)
+        simulate(info_path, out_path, win_matrix=gen_win_matrix(info_path, games[:i]))
 
 
 members = data['homework']